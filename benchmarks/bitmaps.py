@@ -0,0 +1,84 @@
+"""
+Latency of multi-tag filters: tag bitmaps of the in-memory index against SQL EXISTS filters.
+
+Every media gets three of TAGS tags, popular tags being much more frequent
+than rare ones (tag k is picked with a weight of 1 / k). The bitmap filter is
+TagFilter.apply on the video bitmap, which /search runs before checking text
+matches against the result. The SQL path is the first page of media cards
+filtered with EXISTS, as search_media_pages runs it without the index:
+
+    python benchmarks/bitmaps.py [--rows 1000000]
+"""
+import argparse
+import random
+import time
+from common import load_gateway, bulk_insert, seed_catalog, analyze, measure, print_table
+
+TAGS = 200
+TAGS_PER_MEDIA = 3
+LIMIT = 20
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--rows", type=int, default=1000000)
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    app, package, engine = load_gateway("search_gateway")
+    from search_gateway.database.media import Media
+    from search_gateway.database.tags import Tags
+    from search_gateway.helpers.cards import media_card_query
+    from search_gateway.helpers.pagination import paginate
+    from search_gateway.search.bitmaps import Bitmap, TagFilter
+
+    generator = random.Random(42)
+    weights = [1 / k for k in range(1, TAGS + 1)]
+    media_tags = {media_id: set(generator.choices(range(1, TAGS + 1), weights, k=TAGS_PER_MEDIA))
+                  for media_id in range(1, args.rows + 1)}
+    seed_catalog(engine, package, args.rows, tags=TAGS)
+    bulk_insert(engine, package.Base.metadata.tables["MediaTagsConnector"], (
+        {"IdMedia": media_id, "IdTag": tag_id} for media_id, tag_ids in media_tags.items() for tag_id in tag_ids))
+    analyze(engine)  # Without statistics, SQLite looks tags up through the IdTag index for every media
+
+    started = time.perf_counter()
+    members = {}
+    for media_id, tag_ids in media_tags.items():
+        for tag_id in tag_ids:
+            members.setdefault(tag_id, []).append(media_id)
+    tag_bitmaps = {tag_id: Bitmap.of(media_ids) for tag_id, media_ids in members.items()}
+    videos = Bitmap.of(media_id for media_id in media_tags if media_id % 4)  # seed_catalog's mp4 media
+    build_seconds = time.perf_counter() - started
+    memory = sum(bitmap.memory_usage() for bitmap in tag_bitmaps.values())
+
+    filters = {
+        "any of 3 popular": TagFilter.of([1, 2, 3]),
+        "all of 2 popular": TagFilter.of([1, 2], match_all=True),
+        "popular and rare": TagFilter.of([1, TAGS], match_all=True),
+        "all of 3, none of 2": TagFilter.of([1, 2, 3], match_all=True, exclude_ids=[4, 5]),
+        "none of 1 popular": TagFilter.of(exclude_ids=[1]),
+    }
+    results = []
+    with app.app_context():
+        session = package.Session()
+        for name, tag_filter in filters.items():
+            matches = len(tag_filter.apply(videos, tag_bitmaps))
+            bitmap_ms, _ = measure(lambda: tag_filter.apply(videos, tag_bitmaps), args.repeat)
+
+            query = media_card_query(session)
+            if tag_filter.tag_ids and tag_filter.match_all:
+                query = query.filter(*[Media.tags.any(Tags.IdTag == tag_id) for tag_id in tag_filter.tag_ids])
+            elif tag_filter.tag_ids:
+                query = query.filter(Media.tags.any(Tags.IdTag.in_(tag_filter.tag_ids)))
+            if tag_filter.exclude_ids:
+                query = query.filter(~Media.tags.any(Tags.IdTag.in_(tag_filter.exclude_ids)))
+            sql_ms, _ = measure(lambda: paginate(query, (Media.UploadTime, Media.IdMedia), LIMIT),
+                                max(args.repeat // 4, 1))
+            results.append((name, matches, bitmap_ms * 1000, sql_ms))
+    print(f"{args.rows} media, {TAGS} tags: bitmaps built in {build_seconds:.2f} s, "
+          f"{memory / 1024 / 1024:.1f} MB")
+    print_table(["filter", "video matches", "bitmap median µs", "SQL first page median ms"], results)
+
+
+if __name__ == "__main__":
+    main()
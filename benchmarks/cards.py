@@ -0,0 +1,67 @@
+"""
+Throughput and memory of listing media as card rows or as ORM objects.
+
+Serializes batches of media with their company name and tags, once through the
+card read model (helpers/cards.py) and once by hydrating Media objects with
+their company and tags eagerly loaded, the way the listings did before. The
+peak is the memory traced by tracemalloc while a batch is loaded and serialized,
+the JSON-ready dicts included:
+
+    python benchmarks/cards.py [--rows 100000] [--batch 1000]
+"""
+import argparse
+import time
+import tracemalloc
+from common import load_gateway, seed_catalog, print_table
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--rows", type=int, default=100000)
+    parser.add_argument("--batch", type=int, default=1000, help="Rows loaded and serialized at once")
+    args = parser.parse_args()
+
+    app, package, engine = load_gateway("video_gateway")
+    seed_catalog(engine, package, args.rows, tags=50, tags_per_media=3)
+    from sqlalchemy.orm import joinedload, selectinload
+    from video_gateway.database.media import Media
+    from video_gateway.helpers.cards import media_card_query, serialize_media_cards
+
+    def cards(session, first_id):
+        rows = media_card_query(session).filter(Media.IdMedia.between(first_id, first_id + args.batch - 1)).all()
+        return serialize_media_cards(session, rows)
+
+    def orm(session, first_id):
+        media = session.query(Media).options(joinedload(Media.companies), selectinload(Media.tags))\
+                       .filter(Media.IdMedia.between(first_id, first_id + args.batch - 1)).all()
+        return [{
+            "id": m.IdMedia, "name": m.NameV, "description": m.DescriptionV,
+            "upload_time": m.UploadTime.isoformat() if m.UploadTime else None,
+            "company_id": m.IdCompany, "company_name": m.companies.Name if m.companies else None,
+            "tags": [{"id": tag.IdTag, "name": tag.TagName} for tag in m.tags],
+        } for m in media]
+
+    results = []
+    for name, load in (("card rows", cards), ("ORM objects", orm)):
+        with app.app_context():
+            session = package.Session()
+            load(session, 1)  # Warms up the caches of compiled statements, which aren't per row
+            session.expunge_all()
+            tracemalloc.start()
+            load(session, 1)
+            _, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            session.expunge_all()
+
+            start = time.perf_counter()
+            for first_id in range(1, args.rows + 1, args.batch):
+                assert len(load(session, first_id)) == min(args.batch, args.rows - first_id + 1)
+                session.expunge_all()  # As a request would, at its end
+            elapsed = time.perf_counter() - start
+        results.append((name, int(args.rows / elapsed), peak / args.batch / 1024))
+    print(f"{args.rows} media with 3 tags each, in batches of {args.batch}")
+    print_table(["path", "rows/s", "peak KB per row"], results)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,53 @@
+"""
+Latency of a search of every type, with its parts run one after another or fanned out.
+
+Runs the user, media and company parts of /search, as the route builds them, for
+search text that matches nothing, so every part scans its table. A local database
+answers without the network round trips of a MySQL server, so --latency-ms adds
+that much to every statement:
+
+    python benchmarks/fanout.py [--rows 100000] [--latency-ms 0]
+"""
+import argparse
+import time
+from sqlalchemy import event
+from common import load_gateway, seed_catalog, measure, print_table
+
+TEXT = "zz"  # Short enough for the LIKE scan, which SQLite can run
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--rows", type=int, default=100000, help="Rows of each of Media, Users and Companies")
+    parser.add_argument("--repeat", type=int, default=20)
+    parser.add_argument("--latency-ms", type=float, default=0, help="Round trip added to every statement")
+    args = parser.parse_args()
+
+    app, package, engine = load_gateway("search_gateway")
+    seed_catalog(engine, package, args.rows, companies=args.rows, users=args.rows)
+    if args.latency_ms:
+        @event.listens_for(engine, "before_cursor_execute")
+        def round_trip(*_):
+            time.sleep(args.latency_ms / 1000)
+    from search_gateway.search.routes import search_user_page, search_media_pages, search_company_page
+    from search_gateway.search.bitmaps import TagFilter
+    from search_gateway.search.fanout import FanOut
+
+    tasks = {
+        "user": lambda session: {"user": search_user_page(session, TEXT, 20, None, False)},
+        "media": lambda session: search_media_pages(session, TEXT, TagFilter(), 20,
+                                                    {"video": None, "audio": None}, False),
+        "company": lambda session: {"company": search_company_page(session, TEXT, 20, None, False)},
+    }
+    results = []
+    for name, fan_out in (("sequential", FanOut(app, package.Session, enabled=False)),
+                          ("fan-out", FanOut(app, package.Session, workers=4, timeout=30))):
+        with app.app_context():
+            session = package.Session()
+            results.append((name, *measure(lambda: fan_out.run(tasks, session), args.repeat)))
+    print(f"{args.rows} rows per table, {args.latency_ms} ms per statement")
+    print_table(["mode", "median ms", "p95 ms"], results)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,50 @@
+"""
+Latency of a page of the video list by keyset (cursor) pagination and by OFFSET.
+
+For each catalog size, fetches a page of media cards, newest first, at the start,
+the middle and the end of the list. A keyset page seeks the
+(UploadTime, IdMedia) index from the cursor, so it takes the same time at any
+depth and catalog size. OFFSET reads and throws away every row before the page:
+
+    python benchmarks/pagination.py [--sizes 10000 100000 1000000]
+"""
+import argparse
+import datetime
+from common import START, load_gateway, empty_tables, seed_catalog, measure, print_table
+
+LIMIT = 20
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10000, 100000, 1000000])
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    app, package, engine = load_gateway("video_gateway")
+    from video_gateway.helpers.pagination import paginate, encode_cursor
+    from video_gateway.helpers.cards import media_card_query
+    from video_gateway.database.media import Media
+    columns = (Media.UploadTime, Media.IdMedia)
+
+    results = []
+    for size in args.sizes:
+        empty_tables(engine, package)
+        seed_catalog(engine, package, size)
+        for position, depth in (("start", 0), ("middle", size // 2), ("end", size - LIMIT)):
+            last_id = size - depth + 1  # Newest first: the page after media last_id starts at depth
+            cursor = encode_cursor([START + datetime.timedelta(minutes=last_id), last_id]) if depth else None
+            with app.app_context():
+                session = package.Session()
+                query = media_card_query(session)
+                keyset, _ = measure(lambda: paginate(query, columns, LIMIT, cursor), args.repeat)
+                offset, _ = measure(lambda: query.order_by(*[column.desc() for column in columns])
+                                    .offset(depth).limit(LIMIT + 1).all(), args.repeat)
+                rows, _ = paginate(query, columns, LIMIT, cursor)
+                assert rows[0].IdMedia == size - depth  # Both read the same page
+            results.append((size, position, keyset, offset))
+    print_table(["rows", "page", "keyset median ms", "offset median ms"], results)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,74 @@
+"""
+Latency of searching media by text: LIKE '%text%' scans, the FULLTEXT index and
+the in-memory index of the search gateway.
+
+Media are named after a vocabulary of 1000 words, so a word matches one media in
+a thousand, "media" (in every description) matches all of them and a missing
+word none.
+The LIKE path is the query /search ran before helpers/fulltext.py. MATCH ...
+AGAINST only runs on MySQL, so the FULLTEXT path is skipped on SQLite. The
+in-memory index searches the video and audio pages, as /search does, and its
+build time and memory are printed too. Building it reads the search event
+generations and popularity from the gateway's Redis server (REDIS_HOST...):
+
+    python benchmarks/search.py [--rows 100000]
+"""
+import argparse
+from common import load_gateway, seed_catalog, measure, print_table
+
+WORDS = [f"topic{i:04d}" for i in range(1000)]
+QUERIES = {"rare word": "topic0042", "common word": "media", "no match": "nothing"}
+LIMIT = 20
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--rows", type=int, default=100000)
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    app, package, engine = load_gateway("search_gateway")
+    seed_catalog(engine, package, args.rows, words=WORDS)
+    from sqlalchemy import or_
+    from search_gateway.database.media import Media
+    from search_gateway.helpers.cards import media_card_query
+    from search_gateway.helpers.fulltext import text_search
+    from search_gateway.helpers.pagination import paginate
+    from search_gateway.search.routes import search_index
+    from search_gateway.search.bitmaps import TagFilter
+    columns = (Media.NameV, Media.DescriptionV)
+    key = (Media.UploadTime, Media.IdMedia)
+
+    def like(session, text):
+        query = media_card_query(session).filter(or_(*[column.ilike(f"%{text}%") for column in columns]))
+        return paginate(query, key, LIMIT)
+
+    def fulltext(session, text):
+        query, text_key, descending = text_search(media_card_query(session), columns, text, key)
+        return paginate(query, text_key, LIMIT, descending=descending)
+
+    def in_memory(session, text):
+        pages = [search_index.search_media(text, media_type, TagFilter(), LIMIT, fuzzy=False)
+                 for media_type in ("video", "audio")]
+        return [card for cards, _ in pages for card in cards], None
+
+    paths = {"LIKE scan": like}
+    if engine.dialect.name == "mysql":
+        paths["FULLTEXT"] = fulltext
+    search_index.build()
+    paths["in-memory index"] = in_memory
+    results = []
+    with app.app_context():
+        session = package.Session()
+        for query_name, text in QUERIES.items():
+            for path_name, search in paths.items():
+                median, p95 = measure(lambda: search(session, text), args.repeat)
+                results.append((query_name, path_name, len(search(session, text)[0]), median, p95))
+    stats = search_index.get_stats()
+    print(f"{args.rows} media, index built in {stats['build_seconds']} s, "
+          f"{stats['bytes_per_document']} bytes per document")
+    print_table(["query", "path", "results", "median ms", "p95 ms"], results)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,63 @@
+"""
+Accuracy and latency of unique viewer counts: HyperLogLog against COUNT(DISTINCT).
+
+Media i of the synthetic view log has sizes[i] viewers, each one a ViewHistory
+row like the video worker writes, and the same viewers added to its Redis
+HyperLogLog. For each media, prints the exact count from ViewHistory, the
+HyperLogLog estimate with its error and the latency of both counts. The Redis
+server is the gateway's (REDIS_HOST, REDIS_PORT...). Without one, only the exact
+counts are measured:
+
+    python benchmarks/viewers.py [--sizes 1000 10000 100000 1000000]
+"""
+import argparse
+import datetime
+import redis
+from common import START, load_gateway, bulk_insert, seed_catalog, measure, print_table
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000, 100000, 1000000])
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    app, package, engine = load_gateway("video_gateway")
+    seed_catalog(engine, package, len(args.sizes), users=max(args.sizes))
+    from video_gateway.helpers.viewers import media_viewers_key, count_media_viewers, count_exact_media_viewers
+    redis_client = package.redis_client
+    try:
+        redis_client.ping()
+    except redis.RedisError as e:
+        print(f"No Redis server ({e}), measuring exact counts only")
+        redis_client = None
+
+    bulk_insert(engine, package.Base.metadata.tables["ViewHistory"], (
+        {"IdUser": user_id, "IdMedia": media_id, "ViewCount": 1,
+         "ViewTime": START + datetime.timedelta(seconds=user_id)}
+        for media_id, size in enumerate(args.sizes, 1) for user_id in range(1, size + 1)))
+    if redis_client is not None:
+        for media_id, size in enumerate(args.sizes, 1):
+            redis_client.delete(media_viewers_key(media_id))
+            for first in range(1, size + 1, 10000):
+                redis_client.pfadd(media_viewers_key(media_id), *range(first, min(first + 10000, size + 1)))
+
+    results = []
+    with app.app_context():
+        session = package.Session()
+        for media_id, size in enumerate(args.sizes, 1):
+            exact = count_exact_media_viewers(session, media_id)
+            exact_ms, _ = measure(lambda: count_exact_media_viewers(session, media_id), args.repeat)
+            if redis_client is None:
+                results.append((size, exact, exact_ms, "-", "-", "-", "-"))
+                continue
+            estimate = count_media_viewers(redis_client, media_id)
+            hll_ms, _ = measure(lambda: count_media_viewers(redis_client, media_id), args.repeat)
+            memory = redis_client.memory_usage(media_viewers_key(media_id))
+            results.append((size, exact, exact_ms, estimate, (estimate - exact) / exact * 100, hll_ms, memory))
+    print_table(["viewers", "exact", "exact median ms", "estimate", "error %", "HLL median ms", "HLL bytes"],
+                results)
+
+
+if __name__ == "__main__":
+    main()
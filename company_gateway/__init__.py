@@ -3,9 +3,9 @@ from flask import Flask
 from flasgger import Swagger
 import redis
 from dotenv import load_dotenv
-from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker, declarative_base
+from sqlalchemy.orm import declarative_base
 import os
+from .helpers.sessions import create_engines, create_request_session, register_pool_route
 
 load_dotenv()
 
@@ -48,22 +48,18 @@ redis_db = int(os.getenv("REDIS_DB") or 0)
 
 redis_client = redis.Redis(host=redis_host, port=redis_port, db=redis_db, username=redis_username, password=redis_password)
 
-# Database connection
-db_user = os.getenv("DB_USER")
-db_password = os.getenv("DB_PASSWORD")
-db_host = os.getenv("DB_HOST")
-db_name = os.getenv("DB_NAME")
+# Database connection pools (DB_POOL_*) and optional read replicas (DB_REPLICA_*)
+engine, replica_router = create_engines(app, redis_client)
 
-DATABASE_URL = f"mysql+pymysql://{db_user}:{db_password}@{db_host}/{db_name}"
-engine = create_engine(DATABASE_URL)
-Session = sessionmaker(bind=engine)
+# One session per request, connection is returned on app context teardown
+Session = create_request_session(app, engine, replica_router)
 Base = declarative_base()
 
 from .database import accessLevels, comments, companies, \
     media, mediaTagsConnector, ratings, ratingTypes, searchHistory, \
     subscribers, tags, userRoles, users, viewHistory, mediaPreview, \
-    logos, reports
-Base.metadata.create_all(engine)
+    logos, reports, schemaVersion
+# Schema is created and migrated by database.migrations, once per deploy
 
 # Configuration for uploads
 # UPLOAD_FOLDER = 'uploads'  # Directory to store uploaded files
@@ -88,3 +84,6 @@ app.config['MAX_CONTENT_LENGTH'] = None  # Disable limit in Flask
 @app.route("/")
 def home():
     return "<h1>Hello World from company routes!</h1>"
+
+
+register_pool_route(app, engine, replica_router)
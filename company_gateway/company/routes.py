@@ -1,7 +1,11 @@
 import os
 import json
+import datetime
+import redis
 from flask import Flask, request, jsonify, send_from_directory
 from sqlalchemy import exc, func
+from sqlalchemy.orm import joinedload
+from functools import partial
 from .functions import allowed_logo_file, get_unique_filepath_logo
 from ..database.companies import Companies
 from ..database.subscribers import Subscribers
@@ -10,7 +14,15 @@ from ..database.userRoles import UserRoles
 from ..database.logos import CompanyLogo
 from .. import app, redis_client, Session
 from werkzeug.utils import secure_filename  # For secure filename
-from ..helpers.functions import company_owner_level, admin_level, token_required, after_token_required, get_access_level_by_name
+from ..helpers.functions import company_owner_level, admin_level, token_required, get_access_level_by_name
+from ..helpers.sessions import read_only
+from ..helpers.pagination import paginate_request, next_cursor_headers, PaginationError
+from ..helpers.streaming import get_stream_format, stream_query, StreamFormatError
+from ..helpers.cards import media_card_query, serialize_media_cards
+from ..helpers.viewers import count_company_viewers
+from ..helpers.deletion import queue_company_deletion, get_progress
+from ..helpers.search_events import publish_search_event, COMPANY
+from ..helpers.suggest import update_suggestion, add_popularity
 
 app: Flask
 
@@ -18,7 +30,6 @@ app: Flask
 @app.post('/company')
 @token_required(app, redis_client, Session)
 @admin_level
-@after_token_required
 def create_company(user, session):
     """
     Creates a new company (Admin only).
@@ -112,6 +123,8 @@ def create_company(user, session):
                 session.commit()
                 return jsonify({'message': 'Invalid image file type'}), 400
 
+        publish_search_event(redis_client, COMPANY, [new_company.IdCompany])
+        update_suggestion(redis_client, COMPANY, new_company.IdCompany, name)
         return jsonify({'id': new_company.IdCompany, 'message': "success"}), 201
 
     except Exception as e:
@@ -122,7 +135,6 @@ def create_company(user, session):
 
 @app.get('/company/<int:id>')
 @token_required(app, redis_client, Session)
-@after_token_required
 def get_company_info(current_user, session, id):
     """
 Retrieves information about a specific company.
@@ -204,7 +216,6 @@ responses:
 @app.put('/company/<int:id>')
 @token_required(app, redis_client, Session)
 @company_owner_level
-@after_token_required
 def update_company(user, session, id):
     """
 Updates a company's information (name, description, and/or image).
@@ -314,7 +325,10 @@ responses:
                     session.delete(prev_logo)
             else:
                 return jsonify({'message': 'Invalid image file type'}), 400
+        name = company.Name
         session.commit()
+        publish_search_event(redis_client, COMPANY, [id])
+        update_suggestion(redis_client, COMPANY, id, name)
         return jsonify({'message': 'Company updated successfully'}), 200
 
     except exc.SQLAlchemyError as e:
@@ -329,11 +343,14 @@ responses:
 @app.delete('/company/<int:id>')
 @token_required(app, redis_client, Session)
 @admin_level
-@after_token_required
 def delete_company(user, session, id):
     """
     Deletes a company and all associated data (videos, comments, user roles, etc.). (Admin only)
 
+    The deletion is queued and run by the video worker, in batches of videos, so the
+    company is only gone once GET /company/{id}/deletion reports it done. A deletion
+    that fails is retried by the worker, and deleting the company again queues it again.
+
     ---
     security:
       - bearerAuth: []
@@ -346,89 +363,105 @@ def delete_company(user, session, id):
         required: true
         description: The ID of the company to delete.
     responses:
-      200:
-        description: Company and associated data deleted successfully.
+      202:
+        description: Deletion of the company and its associated data queued.
+        content:
+          application/json:
+            schema:
+              type: object
+              properties:
+                total:
+                  type: integer
+                  description: Number of media to delete.
       404:
         description: Company not found.
       403:
         description: Forbidden. Admin access required.
+      503:
+        description: The deletion could not be queued (Redis is unavailable).
       500:
         description: Internal server error.
     """
     try:
-        company = session.query(Companies).filter_by(IdCompany=id).first()
-        if not company:
+        if session.query(Companies.IdCompany).filter_by(IdCompany=id).scalar() is None:
             return jsonify({'message': 'Company not found'}), 404
 
-        # Delete related data (order is important to avoid foreign key issues)
-        # 1. Delete UserRoles
-        for role in company.user_roles:
-            session.delete(role)
-
-        # 2. Delete Comments
-        for video in company.media:
-            for comment in video.comments:
-                # 2.5 Remove all reports
-                for report in comment.reports:
-                    session.delete(report)
-                session.delete(comment)
-            # 3. Delete ratings
-            for rating in video.ratings:
-                session.delete(rating)
-            # 4. Delete views
-            for view in video.view_history:
-                session.delete(view)
-            # 5. Unlink tags
-            for tag in video.tags:
-                session.delete(tag)
-            # 6. Delete Videos and their previews
-            if video.preview.IdMediaPreview != 1 and video.preview.IdMediaPreview != 2:
-                try:
-                    os.remove(video.preview.PreviewPath)
-                except FileNotFoundError:
-                    pass # It is not critical if preview is not found
-                except Exception as e:
-                    app.logger.exception(f"Error while removing preview: {e}")
-            try:
-                os.remove(video.VideoPath)
-            except FileNotFoundError:
-                pass # It is not critical if video is not found
-            except Exception as e:
-                app.logger.exception(f"Error while removing video: {e}")
-            session.delete(video)
-
-        # 7. Delete Logo, but remove record of it after removing company
-        if company.companyLogo and company.companyLogo.IdCompanyLogo != 1:
-            try:
-                os.remove(company.companyLogo.LogoPath)
-            except FileNotFoundError:
-                pass
-            except Exception as e:
-                app.logger.exception(f"Error while removing company logo: {e}")
-
-        # 8. Unlink subscribers
-        for subscriber in company.subscribers:
-            session.delete(subscriber)
-
-        # 9. Finally, delete the company itself
-        logo = company.companyLogo
-        session.refresh(company)
-        session.delete(company)
-        if logo.IdCompanyLogo != 1:
-            session.delete(logo)
-
-        session.commit()
-        return jsonify({'message': 'Company and associated data deleted successfully'}), 200
+        total = queue_company_deletion(session, redis_client, id)
+        return jsonify({'message': 'Company deletion queued', 'total': total}), 202
 
+    except redis.RedisError as e:
+        app.logger.error(f"Could not queue deletion of company {id}: {e}")
+        return jsonify({'message': 'Could not queue the deletion, try again later'}), 503
     except Exception as e:
         session.rollback()
         app.logger.exception(f"Error deleting company: {e}")
         return jsonify({'message': 'Internal server error'}), 500
 
 
+@app.get('/company/<int:id>/deletion')
+@token_required(app, redis_client, Session)
+@admin_level
+def get_company_deletion(user, session, id):
+    """
+    Returns the progress of a company deletion queued in the last 24 hours. (Admin only)
+
+    The video worker commits deleted media in batches, so the progress moves while
+    it works. A failed step is retried by the worker, with the error kept here
+    until a step succeeds.
+
+    ---
+    security:
+      - bearerAuth: []
+    tags:
+      - Company
+    parameters:
+      - in: path
+        name: id
+        type: integer
+        required: true
+        description: The ID of the deleted company.
+    responses:
+      200:
+        description: Deletion progress.
+        content:
+          application/json:
+            schema:
+              type: object
+              properties:
+                status:
+                  type: string
+                  enum: [queued, deleting, done, failed]
+                total:
+                  type: integer
+                  description: Number of media the company had when the deletion was queued.
+                deleted:
+                  type: integer
+                  description: Number of media deleted so far.
+                error:
+                  type: string
+                  description: Error of the last failed step, while the worker retries it.
+                updated:
+                  type: string
+                  format: date-time
+      403:
+        description: Forbidden. Admin access required.
+      404:
+        description: No recent deletion of this company.
+      500:
+        description: Internal server error.
+    """
+    try:
+        progress = get_progress(redis_client, "company", id)
+        if progress is None:
+            return jsonify({'message': 'No recent deletion of this company'}), 404
+        return jsonify(progress), 200
+    except Exception as e:
+        app.logger.exception(f"Error reading company deletion progress: {e}")
+        return jsonify({'message': 'Internal server error'}), 500
+
+
 @app.get('/company/<int:id>/logo')
 @token_required(app, redis_client, Session)
-@after_token_required
 def get_company_preview(current_user, session, id):
     """
 Retrieves and serves a company's logo preview image (if available).
@@ -481,7 +514,6 @@ responses:
 @app.get('/company/<int:id>/owners')
 @token_required(app, redis_client, Session)
 @company_owner_level
-@after_token_required
 def get_company_owners(user, session, id):
     """
 Retrieves a list of owners for a specific company.
@@ -535,9 +567,10 @@ responses:
             app.logger.error("Company Owner Access Level not found in database")
             return jsonify({'message': 'Internal server error'}), 500
 
-        users_in_company = company.user_roles
+        users_in_company = session.query(UserRoles).options(joinedload(UserRoles.users))\
+                                  .filter_by(IdCompany=id, IdAccessLevel=owner_level.IdAccessLevel).all()
 
-        owners = [{'user_id': x.users.IdUser, 'Email': x.users.Email} for x in users_in_company if x.access_levels == owner_level]
+        owners = [{'user_id': x.users.IdUser, 'Email': x.users.Email} for x in users_in_company]
 
         return jsonify(owners), 200
 
@@ -550,7 +583,6 @@ responses:
 @app.post('/company/<int:id>/owners')
 @token_required(app, redis_client, Session)
 @admin_level # Only admins can manage owners
-@after_token_required
 def update_company_owners(user, session, id):
     """
 Updates the owner status (add or remove) for a specific user in a company.
@@ -647,7 +679,6 @@ responses:
 @app.delete('/company/<int:id>/owners')
 @token_required(app, redis_client, Session)
 @admin_level # Only admins can manage owners
-@after_token_required
 def delete_company_owners(user, session, id):
     """
 Removes owners from a company.
@@ -730,7 +761,6 @@ responses:
 @app.get('/company/<int:id>/moderators')
 @token_required(app, redis_client, Session)
 @company_owner_level
-@after_token_required
 def get_company_moderators(user, session, id):
     """
 Retrieves a list of moderators for a specific company.
@@ -784,9 +814,10 @@ responses:
             app.logger.error("Moderator Access Level not found in database")
             return jsonify({'message': 'Internal server error'}), 500
 
-        users_in_company = company.user_roles
+        users_in_company = session.query(UserRoles).options(joinedload(UserRoles.users))\
+                                  .filter_by(IdCompany=id, IdAccessLevel=moderator_level.IdAccessLevel).all()
 
-        moderators = [{'user_id': x.users.IdUser, 'Email': x.users.Email} for x in users_in_company if x.access_levels == moderator_level]
+        moderators = [{'user_id': x.users.IdUser, 'Email': x.users.Email} for x in users_in_company]
 
         return jsonify(moderators), 200
 
@@ -799,7 +830,6 @@ responses:
 @app.post('/company/<int:id>/moderators')
 @token_required(app, redis_client, Session)
 @company_owner_level # Only admins can manage moderators
-@after_token_required
 def update_company_moderators(user, session, id):
     """
 Updates the moderator status (add or remove) for a specific user in a company.
@@ -900,7 +930,6 @@ responses:
 @app.delete('/company/<int:id>/moderators')
 @token_required(app, redis_client, Session)
 @company_owner_level # Only admins can manage moderators
-@after_token_required
 def delete_company_moderators(user, session, id):
     """
 Removes moderators from a company.
@@ -982,7 +1011,6 @@ responses:
 
 @app.post('/company/<int:id>/subscribe')
 @token_required(app, redis_client, Session)
-@after_token_required
 def subscribe_to_company(current_user, session, id):
     """
 Subscribes the current user to a company.
@@ -1041,6 +1069,7 @@ responses:
         new_subscription = Subscribers(IdUser=current_user.IdUser, IdCompany=id)
         session.add(new_subscription)
         session.commit()
+        add_popularity(redis_client, COMPANY, {id: 1})
         return jsonify({'message': 'Subscribed successfully',
                         "is_subscribed": True,
                         "subscribers": subscriber_count+1}), 201
@@ -1057,7 +1086,6 @@ responses:
 
 @app.post('/company/<int:id>/unsubscribe')
 @token_required(app, redis_client, Session)
-@after_token_required
 def unsubscribe_from_company(current_user, session, id):
     """
 Unsubscribes the current user from a company.
@@ -1115,6 +1143,7 @@ responses:
 
         session.delete(existing_subscription)
         session.commit()
+        add_popularity(redis_client, COMPANY, {id: -1})
         return jsonify({'message': 'Unsubscribed successfully',
                         "is_subscribed": False,
                         "subscribers": subscriber_count-1}), 201
@@ -1131,11 +1160,13 @@ responses:
 
 @app.get('/company/<int:id>/videos')
 @token_required(app, redis_client, Session)
-@after_token_required
+@read_only
 def get_company_videos(currrent_user, session, id):
     """
 Retrieves a list of videos belonging to a specific company.
 
+Returns at most `limit` items (50 by default), where it used to return the whole list:
+follow the X-Next-Cursor header until a response comes without it, or stream the whole listing.
 ---
 security:
   - bearerAuth: []
@@ -1147,9 +1178,28 @@ parameters:
     type: integer
     required: true
     description: The ID of the company to retrieve videos from.
+  - in: query
+    name: limit
+    type: integer
+    description: Maximum number of items to return (default 50, at most 200).
+  - in: query
+    name: cursor
+    type: string
+    description: Value of the X-Next-Cursor header from the previous page.
+  - in: query
+    name: stream
+    type: string
+    enum: ["ndjson", "json"]
+    description: >-
+      Stream the whole listing instead of one page, as NDJSON or as a JSON array.
+      An NDJSON stream that fails midway ends with an {"error": ...} line, a JSON array stream is cut off.
 responses:
   200:
     description: List of company videos retrieved successfully.
+    headers:
+      X-Next-Cursor:
+        type: string
+        description: Cursor of the next page. Missing on the last page.
     content:
       application/json:
         schema:
@@ -1171,6 +1221,12 @@ responses:
                 format: date-time
                 nullable: true
                 description: The upload time of the video in ISO 8601 format.
+              company_id:
+                type: integer
+                description: The ID of the company.
+              company_name:
+                type: string
+                description: The name of the company.
               tags:
                 type: array
                 items:
@@ -1182,6 +1238,8 @@ responses:
                     name:
                       type: string
                       description: The name of the tag.
+  400:
+    description: Invalid limit, cursor or stream format.
   404:
     description: Company not found.
   500:
@@ -1194,24 +1252,117 @@ responses:
         if not company:
             return jsonify({'message': 'Company not found'}), 404
 
-        videos = session.query(Media).filter_by(IdCompany=id).all()
+        videos_query = media_card_query(session).filter(Media.IdCompany == id)
+        serialize = partial(serialize_media_cards, session)
+        stream_format = get_stream_format(request)
+        if stream_format:
+            return stream_query(app, videos_query, (Media.UploadTime, Media.IdMedia), serialize, stream_format)
 
-        video_list = []
-        for video in videos:
-            tags = [{"id": tag.IdTag, "name": tag.TagName} for tag in video.tags]
-            video_list.append({
-                "id": video.IdMedia,
-                "name": video.NameV,
-                "description": video.DescriptionV,
-                "upload_time": video.UploadTime.isoformat() if video.UploadTime else None,
-                "tags": tags
-            })
+        videos, next_cursor = paginate_request(videos_query, (Media.UploadTime, Media.IdMedia), request)
+        video_list = serialize(videos)
 
-        return jsonify(video_list), 200
+        return jsonify(video_list), 200, next_cursor_headers(next_cursor)
 
+    except (PaginationError, StreamFormatError) as e:
+        return jsonify({'message': str(e)}), 400
     except exc.SQLAlchemyError as e:
         app.logger.exception(f"Database error getting company videos: {e}")
         return jsonify({'message': 'Database error'}), 500
     except Exception as e:
         app.logger.exception(f"Error getting company videos: {e}")
         return jsonify({'message': 'Error getting company videos'}), 500
+
+
+@app.get('/company/<int:id>/viewers')
+@token_required(app, redis_client, Session)
+@company_owner_level
+def get_company_viewers(user, session, id):
+    """
+Retrieves the approximate number of unique viewers of a company's videos.
+
+Without dates the count covers all time. With dates it covers the days from
+'from' to 'to' (inclusive), counting a user who watched on several days once.
+---
+security:
+  - bearerAuth: []
+tags:
+  - Company
+parameters:
+  - in: path
+    name: id
+    type: integer
+    required: true
+    description: The ID of the company.
+  - in: header
+    name: X-idCompany
+    description: ID of a company, for which the check of ownership will be performed
+    type: integer
+  - in: query
+    name: from
+    type: string
+    format: date
+    description: First day of the period (YYYY-MM-DD). Defaults to the 'to' day.
+  - in: query
+    name: to
+    type: string
+    format: date
+    description: Last day of the period (YYYY-MM-DD). Defaults to today.
+responses:
+  200:
+    description: Unique viewer count.
+    content:
+      application/json:
+        schema:
+          type: object
+          properties:
+            company_id:
+              type: integer
+              description: The ID of the company.
+            from:
+              type: string
+              format: date
+              nullable: true
+              description: First day of the period, null for all time.
+            to:
+              type: string
+              format: date
+              nullable: true
+              description: Last day of the period, null for all time.
+            unique_viewers:
+              type: integer
+              description: Approximate number of unique viewers (about 1% error).
+  400:
+    description: Invalid dates or period longer than a year.
+  404:
+    description: Company not found.
+  500:
+    description: Internal server error.
+"""
+    try:
+        start = datetime.date.fromisoformat(request.args['from']) if request.args.get('from') else None
+        end = datetime.date.fromisoformat(request.args['to']) if request.args.get('to') else None
+    except ValueError:
+        return jsonify({'message': 'Dates must be in YYYY-MM-DD format'}), 400
+
+    try:
+        company = session.query(Companies).filter_by(IdCompany=id).first()
+        if not company:
+            return jsonify({'message': 'Company not found'}), 404
+
+        if start is not None or end is not None:
+            end = end or datetime.date.today()
+            start = start or end
+        unique_viewers = count_company_viewers(redis_client, id, start, end)
+
+        return jsonify({
+            'company_id': id,
+            'from': start.isoformat() if start else None,
+            'to': end.isoformat() if end else None,
+            'unique_viewers': unique_viewers
+        }), 200
+
+    except ValueError as e:
+        return jsonify({'message': str(e)}), 400
+    except Exception as e:
+        app.logger.exception(f"Error counting company viewers: {e}")
+        return jsonify({'message': 'Internal server error'}), 500
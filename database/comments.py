@@ -1,10 +1,13 @@
 from .. import Base
-from sqlalchemy import Column, Integer, String, ForeignKey, DateTime
+from sqlalchemy import Column, Integer, String, ForeignKey, DateTime, Index
 from sqlalchemy.orm import relationship
 
 
 class Comments(Base):
     __tablename__ = 'Comments'
+    __table_args__ = (
+        Index('ix_Comments_IdMedia_Date', 'IdMedia', 'Date'),
+    )
 
     IdComment = Column(Integer, primary_key=True, autoincrement=True)
     IdUser = Column(Integer, ForeignKey("Users.IdUser"))
@@ -1,10 +1,13 @@
 from .. import Base
-from sqlalchemy import Column, Integer, String, VARCHAR, TEXT, ForeignKey
+from sqlalchemy import Column, Integer, String, VARCHAR, TEXT, ForeignKey, Index
 from sqlalchemy.orm import relationship
 
 
 class Companies(Base):
     __tablename__ = 'Companies'
+    __table_args__ = (
+        Index('ft_Companies_Name', 'Name', mysql_prefix='FULLTEXT'),
+    )
 
     IdCompany = Column(Integer, primary_key=True, nullable=False, autoincrement="auto")
     Name = Column(VARCHAR(255), nullable=False)
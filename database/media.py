@@ -1,10 +1,15 @@
 from .. import Base
-from sqlalchemy import Column, Integer, String, ForeignKey, VARCHAR, TIMESTAMP
+from sqlalchemy import Column, Integer, String, ForeignKey, VARCHAR, TIMESTAMP, Index
 from sqlalchemy.orm import relationship
 
 
 class Media(Base):
     __tablename__ = 'Media'
+    __table_args__ = (
+        Index('ix_Media_IdCompany_UploadTime', 'IdCompany', 'UploadTime'),
+        Index('ix_Media_UploadTime_IdMedia', 'UploadTime', 'IdMedia'),
+        Index('ft_Media_NameV_DescriptionV', 'NameV', 'DescriptionV', mysql_prefix='FULLTEXT'),
+    )
 
     IdMedia = Column(Integer, primary_key=True, nullable=False, autoincrement="auto")
     IdCompany = Column(Integer, ForeignKey("Companies.IdCompany"))
@@ -1,10 +1,14 @@
 from .. import Base
-from sqlalchemy import Column, Integer, ForeignKey
+from sqlalchemy import Column, Integer, ForeignKey, Index
 from sqlalchemy.orm import relationship
 
 
 class MediaTagsConnector(Base):
     __tablename__ = 'MediaTagsConnector'
+    __table_args__ = (
+        Index('ix_MediaTagsConnector_IdMedia', 'IdMedia'),
+        Index('ix_MediaTagsConnector_IdTag', 'IdTag'),
+    )
 
     IdConnection = Column(Integer, primary_key=True, nullable=False, autoincrement="auto")
     IdTag = Column(Integer, ForeignKey("Tags.IdTag"))
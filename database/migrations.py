@@ -0,0 +1,286 @@
+"""
+Versioned schema migrations.
+
+Run once per deploy, before the gateways start. The migrate package only loads
+the models, without starting a gateway:
+
+    python -m migrate.database.migrations
+
+Migration 1 creates the tables as they were before migrations existed, from
+table definitions frozen in this module: a change to the models needs a
+migration of its own, and upgrading replays the same steps on every database.
+Applied migrations are recorded in the SchemaVersion table, so running the
+command again only applies the migrations that are missing. A migration runs in
+a transaction of its own, but MySQL commits DDL implicitly: a migration that
+fails halfway keeps the tables and indexes it had created, without being
+recorded. Migrations are therefore written to be run again over their own
+partial work: tables and indexes are created only if missing, and duplicate
+rows are merged before a unique key is added. Fix the cause and rerun.
+"""
+import datetime
+import logging
+from sqlalchemy import (MetaData, Table, Column, ForeignKey, Integer, String, VARCHAR, TEXT, DateTime,
+                        TIMESTAMP, Boolean, select, insert, update, delete, func, inspect)
+from .. import engine
+from .schemaVersion import SchemaVersion
+from .ratings import Ratings
+from .viewHistory import ViewHistory
+from .subscribers import Subscribers
+from .searchHistory import SearchHistory
+from .mediaTagsConnector import MediaTagsConnector
+from .comments import Comments
+from .media import Media
+from .users import Users
+from .companies import Companies
+
+logger = logging.getLogger(__name__)
+
+MIGRATIONS = []
+
+
+def migration(version, description):
+    """Registers a function taking a connection as the migration to a schema version."""
+    def register(f):
+        MIGRATIONS.append((version, description, f))
+        return f
+    return register
+
+
+def missing_indexes(connection, model, names):
+    """Returns those of the named indexes that the model's table doesn't have yet."""
+    existing = {index['name'] for index in inspect(connection).get_indexes(model.__tablename__)}
+    return set(names) - existing
+
+
+def create_indexes(connection, model, names):
+    """Creates the named indexes declared on a model, skipping those that already exist."""
+    declared = {index.name: index for index in model.__table__.indexes}
+    unknown = set(names) - declared.keys()
+    if unknown:
+        # A renamed model index would otherwise make the migration silently do nothing
+        raise ValueError(f"{model.__tablename__} declares no index named {', '.join(sorted(unknown))}")
+    for name in sorted(missing_indexes(connection, model, names)):
+        declared[name].create(connection)
+
+
+# The schema the gateways created before migrations existed, frozen: later changes
+# to the models go into migrations of their own, never into this one
+baseline = MetaData()
+
+Table('Users', baseline,
+      Column('IdUser', Integer, primary_key=True, autoincrement=True),
+      Column('Email', String(255), nullable=False, unique=True),
+      Column('LoginUser', String(255), nullable=False, unique=True),
+      Column('NameUser', String(255)),
+      Column('Surname', String(255)),
+      Column('Patronymic', String(255)),
+      Column('Birthday', DateTime),
+      Column('RegisterTime', TIMESTAMP),
+      Column('Password', String(255), nullable=False),
+      Column('IsActive', Boolean, nullable=False))
+Table('AccessLevels', baseline,
+      Column('IdAccessLevel', Integer, primary_key=True, autoincrement=True),
+      Column('AccessName', String(20), nullable=False),
+      Column('AccessLevel', Integer, nullable=False))
+Table('CompanyLogo', baseline,
+      Column('IdCompanyLogo', Integer, primary_key=True, nullable=False, autoincrement="auto"),
+      Column('LogoPath', VARCHAR(1024), nullable=False))
+Table('Companies', baseline,
+      Column('IdCompany', Integer, primary_key=True, nullable=False, autoincrement="auto"),
+      Column('Name', VARCHAR(255), nullable=False),
+      Column('About', TEXT(65535)),
+      Column('IdCompanyLogo', Integer, ForeignKey("CompanyLogo.IdCompanyLogo")))
+Table('UserRoles', baseline,
+      Column('IdUser', Integer, ForeignKey("Users.IdUser"), primary_key=True),
+      Column('IdCompany', Integer, ForeignKey("Companies.IdCompany"), primary_key=True, nullable=True),
+      Column('IdAccessLevel', Integer, ForeignKey("AccessLevels.IdAccessLevel")))
+Table('Subscribers', baseline,
+      Column('IdSubscriber', Integer, primary_key=True, nullable=False, autoincrement="auto"),
+      Column('IdCompany', Integer, ForeignKey("Companies.IdCompany")),
+      Column('IdUser', Integer, ForeignKey("Users.IdUser")))
+Table('SearchHistory', baseline,
+      Column('IdSearchHistory', Integer, primary_key=True, autoincrement=True),
+      Column('IdUser', Integer, ForeignKey("Users.IdUser")),
+      Column('SearchQuery', String(255)),
+      Column('SearchTime', TIMESTAMP))
+Table('MediaPreview', baseline,
+      Column('IdMediaPreview', Integer, primary_key=True, nullable=False, autoincrement="auto"),
+      Column('PreviewPath', VARCHAR(1024), nullable=False))
+Table('Media', baseline,
+      Column('IdMedia', Integer, primary_key=True, nullable=False, autoincrement="auto"),
+      Column('IdCompany', Integer, ForeignKey("Companies.IdCompany")),
+      Column('NameV', VARCHAR(255), nullable=False),
+      Column('DescriptionV', VARCHAR(10000)),
+      Column('UploadTime', TIMESTAMP()),
+      Column('VideoPath', VARCHAR(255), nullable=False, unique=True),
+      Column('IdMediaPreview', Integer, ForeignKey("MediaPreview.IdMediaPreview")))
+Table('Tags', baseline,
+      Column('IdTag', Integer, primary_key=True, nullable=False, autoincrement="auto"),
+      Column('TagName', VARCHAR(50), nullable=False, unique=True))
+Table('MediaTagsConnector', baseline,
+      Column('IdConnection', Integer, primary_key=True, nullable=False, autoincrement="auto"),
+      Column('IdTag', Integer, ForeignKey("Tags.IdTag")),
+      Column('IdMedia', Integer, ForeignKey("Media.IdMedia")))
+Table('RatingTypes', baseline,
+      Column('IdRatingType', Integer, primary_key=True, autoincrement=True),
+      Column('NameRating', String(20), nullable=False),
+      Column('RatingFactor', Integer, nullable=False))
+Table('Ratings', baseline,
+      Column('IdRating', Integer, primary_key=True, autoincrement=True),
+      Column('IdUser', Integer, ForeignKey("Users.IdUser")),
+      Column('IdMedia', Integer, ForeignKey("Media.IdMedia")),
+      Column('IdRatingType', Integer, ForeignKey("RatingTypes.IdRatingType")),
+      Column('RatingTime', TIMESTAMP))
+Table('Comments', baseline,
+      Column('IdComment', Integer, primary_key=True, autoincrement=True),
+      Column('IdUser', Integer, ForeignKey("Users.IdUser")),
+      Column('IdMedia', Integer, ForeignKey("Media.IdMedia")),
+      Column('TextComment', String(10000), nullable=False),
+      Column('Date', DateTime, nullable=False))
+Table('Reports', baseline,
+      Column('IdReport', Integer, primary_key=True, nullable=False, autoincrement="auto"),
+      Column('ReportTime', TIMESTAMP()),
+      Column('IdComment', Integer, ForeignKey("Comments.IdComment")),
+      Column('IdUser', Integer, ForeignKey("Users.IdUser")),
+      Column('ReportReason', VARCHAR(10000)))
+Table('ViewHistory', baseline,
+      Column('IdViewHistory', Integer, primary_key=True, autoincrement=True),
+      Column('IdUser', Integer, ForeignKey("Users.IdUser")),
+      Column('IdMedia', Integer, ForeignKey("Media.IdMedia")),
+      Column('ViewTime', TIMESTAMP),
+      Column('ViewCount', Integer, nullable=False))
+
+
+@migration(1, "Create tables")
+def create_tables(connection):
+    baseline.create_all(connection)  # Tables that already exist are kept as they are
+
+
+@migration(2, "Add indexes and unique keys for hot paths")
+def add_hot_path_indexes(connection):
+    # One view history row per user and media, merging duplicates
+    duplicate_views = connection.execute(
+        select(ViewHistory.IdUser, ViewHistory.IdMedia, func.min(ViewHistory.IdViewHistory),
+               func.sum(ViewHistory.ViewCount), func.max(ViewHistory.ViewTime))
+        .group_by(ViewHistory.IdUser, ViewHistory.IdMedia)
+        .having(func.count(ViewHistory.IdViewHistory) > 1)
+    ).all()
+    for user_id, media_id, keep_id, view_count, view_time in duplicate_views:
+        if user_id is None or media_id is None:
+            continue
+        connection.execute(update(ViewHistory).where(ViewHistory.IdViewHistory == keep_id)
+                           .values(ViewCount=view_count, ViewTime=view_time))
+        connection.execute(delete(ViewHistory).where(ViewHistory.IdUser == user_id,
+                                                     ViewHistory.IdMedia == media_id,
+                                                     ViewHistory.IdViewHistory != keep_id))
+
+    # One subscription per user and company
+    duplicate_subscriptions = connection.execute(
+        select(Subscribers.IdCompany, Subscribers.IdUser, func.min(Subscribers.IdSubscriber))
+        .group_by(Subscribers.IdCompany, Subscribers.IdUser)
+        .having(func.count(Subscribers.IdSubscriber) > 1)
+    ).all()
+    for company_id, user_id, keep_id in duplicate_subscriptions:
+        if company_id is None or user_id is None:
+            continue
+        connection.execute(delete(Subscribers).where(Subscribers.IdCompany == company_id,
+                                                     Subscribers.IdUser == user_id,
+                                                     Subscribers.IdSubscriber != keep_id))
+
+    create_indexes(connection, Ratings, {'ix_Ratings_IdMedia_IdRatingType'})
+    create_indexes(connection, ViewHistory, {'ux_ViewHistory_IdUser_IdMedia', 'ix_ViewHistory_IdMedia'})
+    create_indexes(connection, Subscribers, {'ux_Subscribers_IdCompany_IdUser'})
+    create_indexes(connection, SearchHistory, {'ix_SearchHistory_IdUser_SearchTime'})
+    create_indexes(connection, MediaTagsConnector, {'ix_MediaTagsConnector_IdMedia', 'ix_MediaTagsConnector_IdTag'})
+    create_indexes(connection, Comments, {'ix_Comments_IdMedia_Date'})
+    create_indexes(connection, Media, {'ix_Media_IdCompany_UploadTime'})
+
+
+@migration(3, "Add index for paginated media listing")
+def add_media_listing_index(connection):
+    create_indexes(connection, Media, {'ix_Media_UploadTime_IdMedia'})
+
+
+@migration(4, "Allow one rating per user and media")
+def add_unique_ratings(connection):
+    if not missing_indexes(connection, Ratings, {'ux_Ratings_IdUser_IdMedia'}):
+        return  # Created with the tables by an earlier version of migration 1
+
+    # Keep the latest rating when a user has rated a media more than once
+    duplicate_ratings = connection.execute(
+        select(Ratings.IdUser, Ratings.IdMedia, func.max(Ratings.IdRating))
+        .group_by(Ratings.IdUser, Ratings.IdMedia)
+        .having(func.count(Ratings.IdRating) > 1)
+    ).all()
+    for user_id, media_id, keep_id in duplicate_ratings:
+        if user_id is None or media_id is None:
+            continue
+        connection.execute(delete(Ratings).where(Ratings.IdUser == user_id,
+                                                 Ratings.IdMedia == media_id,
+                                                 Ratings.IdRating != keep_id))
+
+    create_indexes(connection, Ratings, {'ux_Ratings_IdUser_IdMedia'})
+
+
+@migration(5, "Add full-text indexes for search")
+def add_fulltext_indexes(connection):
+    # create_indexes skips the indexes that exist, whichever migration created them
+    create_indexes(connection, Media, {'ft_Media_NameV_DescriptionV'})
+    create_indexes(connection, Users, {'ft_Users_NameUser_Surname_LoginUser_Email'})
+    create_indexes(connection, Companies, {'ft_Companies_Name'})
+
+
+@migration(6, "Keep one search history entry per user and query")
+def add_unique_search_history(connection):
+    if not missing_indexes(connection, SearchHistory, {'ux_SearchHistory_IdUser_SearchQuery'}):
+        return  # Created with the tables by an earlier version of migration 1
+
+    # One entry per user and query, merging duplicates into the newest one
+    duplicate_searches = connection.execute(
+        select(SearchHistory.IdUser, SearchHistory.SearchQuery, func.max(SearchHistory.IdSearchHistory),
+               func.max(SearchHistory.SearchTime))
+        .group_by(SearchHistory.IdUser, SearchHistory.SearchQuery)
+        .having(func.count(SearchHistory.IdSearchHistory) > 1)
+    ).all()
+    for user_id, query, keep_id, search_time in duplicate_searches:
+        if user_id is None or query is None:
+            continue
+        connection.execute(delete(SearchHistory).where(SearchHistory.IdUser == user_id,
+                                                       SearchHistory.SearchQuery == query,
+                                                       SearchHistory.IdSearchHistory != keep_id))
+        connection.execute(update(SearchHistory).where(SearchHistory.IdSearchHistory == keep_id)
+                           .values(SearchTime=search_time))
+
+    create_indexes(connection, SearchHistory, {'ux_SearchHistory_IdUser_SearchQuery'})
+
+
+def get_current_version(connection):
+    SchemaVersion.__table__.create(connection, checkfirst=True)
+    return connection.execute(select(func.max(SchemaVersion.Version))).scalar() or 0
+
+
+def upgrade(engine):
+    """Applies all migrations newer than the current schema version."""
+    with engine.begin() as connection:
+        current_version = get_current_version(connection)
+
+    for version, description, step in sorted(MIGRATIONS, key=lambda m: m[0]):
+        if version <= current_version:
+            continue
+        logger.info(f"Migrating schema to version {version}: {description}")
+        with engine.begin() as connection:
+            step(connection)
+            connection.execute(insert(SchemaVersion).values(
+                Version=version,
+                Description=description,
+                AppliedAt=datetime.datetime.now()
+            ))
+        current_version = version
+
+    logger.info(f"Schema is up to date (version {current_version})")
+    return current_version
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+    upgrade(engine)
@@ -1,10 +1,14 @@
 from .. import Base
-from sqlalchemy import Column, Integer, ForeignKey, TIMESTAMP
+from sqlalchemy import Column, Integer, ForeignKey, TIMESTAMP, Index
 from sqlalchemy.orm import relationship
 
 
 class Ratings(Base):
     __tablename__ = 'Ratings'
+    __table_args__ = (
+        Index('ix_Ratings_IdMedia_IdRatingType', 'IdMedia', 'IdRatingType'),
+        Index('ux_Ratings_IdUser_IdMedia', 'IdUser', 'IdMedia', unique=True),
+    )
 
     IdRating = Column(Integer, primary_key=True, autoincrement=True)
     IdUser = Column(Integer, ForeignKey("Users.IdUser"))
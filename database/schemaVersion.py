@@ -0,0 +1,10 @@
+from .. import Base
+from sqlalchemy import Column, Integer, VARCHAR, TIMESTAMP
+
+
+class SchemaVersion(Base):
+    __tablename__ = 'SchemaVersion'
+
+    Version = Column(Integer, primary_key=True, autoincrement=False)
+    Description = Column(VARCHAR(255), nullable=False)
+    AppliedAt = Column(TIMESTAMP, nullable=False)
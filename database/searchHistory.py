@@ -1,10 +1,14 @@
 from .. import Base
-from sqlalchemy import Column, Integer, String, ForeignKey, TIMESTAMP
+from sqlalchemy import Column, Integer, String, ForeignKey, TIMESTAMP, Index
 from sqlalchemy.orm import relationship
 
 
 class SearchHistory(Base):
     __tablename__ = 'SearchHistory'
+    __table_args__ = (
+        Index('ix_SearchHistory_IdUser_SearchTime', 'IdUser', 'SearchTime'),
+        Index('ux_SearchHistory_IdUser_SearchQuery', 'IdUser', 'SearchQuery', unique=True),
+    )
 
     IdSearchHistory = Column(Integer, primary_key=True, autoincrement=True)
     IdUser = Column(Integer, ForeignKey("Users.IdUser"))
@@ -1,10 +1,13 @@
 from .. import Base
-from sqlalchemy import Column, Integer, String, ForeignKey
+from sqlalchemy import Column, Integer, String, ForeignKey, Index
 from sqlalchemy.orm import relationship
 
 
 class Subscribers(Base):
     __tablename__ = 'Subscribers'
+    __table_args__ = (
+        Index('ux_Subscribers_IdCompany_IdUser', 'IdCompany', 'IdUser', unique=True),
+    )
 
     IdSubscriber = Column(Integer, primary_key=True, nullable=False, autoincrement="auto")
     IdCompany = Column(Integer, ForeignKey("Companies.IdCompany"))
@@ -1,10 +1,14 @@
 from .. import Base
-from sqlalchemy import Column, Integer, String, VARCHAR, DateTime, TIMESTAMP, Boolean
+from sqlalchemy import Column, Integer, String, VARCHAR, DateTime, TIMESTAMP, Boolean, Index
 from sqlalchemy.orm import relationship
 
 
 class Users(Base):
     __tablename__ = 'Users'
+    __table_args__ = (
+        Index('ft_Users_NameUser_Surname_LoginUser_Email', 'NameUser', 'Surname', 'LoginUser', 'Email',
+              mysql_prefix='FULLTEXT'),
+    )
 
     IdUser = Column(Integer, primary_key=True, autoincrement=True)
     Email = Column(String(255), nullable=False, unique=True)
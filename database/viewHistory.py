@@ -1,10 +1,14 @@
 from .. import Base
-from sqlalchemy import Column, Integer, ForeignKey, TIMESTAMP
+from sqlalchemy import Column, Integer, ForeignKey, TIMESTAMP, Index
 from sqlalchemy.orm import relationship
 
 
 class ViewHistory(Base):
     __tablename__ = 'ViewHistory'
+    __table_args__ = (
+        Index('ux_ViewHistory_IdUser_IdMedia', 'IdUser', 'IdMedia', unique=True),
+        Index('ix_ViewHistory_IdMedia', 'IdMedia'),
+    )
 
     IdViewHistory = Column(Integer, primary_key=True, autoincrement=True)
     IdUser = Column(Integer, ForeignKey("Users.IdUser"))
@@ -0,0 +1,116 @@
+"""
+Read models for listings.
+
+Listings only need a handful of columns, so they select those columns directly and
+wrap each row in a NamedTuple instead of hydrating ORM objects into the identity
+map. The serializers here produce the card shapes shared by the gateways.
+"""
+import datetime
+from collections import defaultdict
+from typing import NamedTuple, Optional
+from ..database.media import Media
+from ..database.companies import Companies
+from ..database.users import Users
+from ..database.tags import Tags
+from ..database.mediaTagsConnector import MediaTagsConnector
+
+
+class MediaCard(NamedTuple):
+    IdMedia: int
+    NameV: str
+    DescriptionV: Optional[str]
+    UploadTime: Optional[datetime.datetime]
+    IdCompany: Optional[int]
+    CompanyName: Optional[str]
+
+
+class CompanyCard(NamedTuple):
+    IdCompany: int
+    Name: str
+    About: Optional[str]
+
+
+class UserCard(NamedTuple):
+    IdUser: int
+    NameUser: Optional[str]
+    Surname: Optional[str]
+    Email: str
+
+
+class TagCard(NamedTuple):
+    IdTag: int
+    TagName: str
+
+
+def make_card(card_type, row):
+    """Builds a card from a row, ignoring extra columns selected for sorting (like a relevance score)."""
+    return card_type._make(row[:len(card_type._fields)])
+
+
+def media_card_query(session):
+    """Query of media card rows. Filter and paginate it like a Media query."""
+    return session.query(Media.IdMedia, Media.NameV, Media.DescriptionV, Media.UploadTime,
+                         Media.IdCompany, Companies.Name.label('CompanyName'))\
+                  .outerjoin(Companies, Companies.IdCompany == Media.IdCompany)
+
+
+def company_card_query(session):
+    return session.query(Companies.IdCompany, Companies.Name, Companies.About)
+
+
+def user_card_query(session):
+    return session.query(Users.IdUser, Users.NameUser, Users.Surname, Users.Email)
+
+
+def load_media_tags(session, media_ids):
+    """Returns the tags of every given media, loaded with a single query."""
+    tags = defaultdict(list)
+    if not media_ids:
+        return tags
+
+    rows = session.query(MediaTagsConnector.IdMedia, Tags.IdTag, Tags.TagName)\
+                  .join(Tags, Tags.IdTag == MediaTagsConnector.IdTag)\
+                  .filter(MediaTagsConnector.IdMedia.in_(set(media_ids))).all()
+    for media_id, tag_id, tag_name in rows:
+        tags[media_id].append(TagCard(tag_id, tag_name))
+    return tags
+
+
+def serialize_media_card(card: MediaCard, tags=None):
+    media = {
+        "id": card.IdMedia,
+        "name": card.NameV,
+        "description": card.DescriptionV,
+        "upload_time": card.UploadTime.isoformat() if card.UploadTime else None,
+        "company_id": card.IdCompany,
+        "company_name": card.CompanyName,
+    }
+    if tags is not None:
+        media["tags"] = [{"id": tag.IdTag, "name": tag.TagName} for tag in tags]
+    return media
+
+
+def serialize_media_cards(session, rows, with_tags=True):
+    """Serializes media card rows, loading the tags of the whole batch at once."""
+    cards = [make_card(MediaCard, row) for row in rows]
+    if not with_tags:
+        return [serialize_media_card(card) for card in cards]
+
+    tags = load_media_tags(session, [card.IdMedia for card in cards])
+    return [serialize_media_card(card, tags.get(card.IdMedia, [])) for card in cards]
+
+
+def serialize_company_card(card: CompanyCard):
+    return {
+        "company_id": card.IdCompany,
+        "name": card.Name,
+        "about": card.About,
+    }
+
+
+def serialize_user_card(card: UserCard):
+    return {
+        "user_id": card.IdUser,
+        "name": " ".join(part for part in (card.NameUser, card.Surname) if part),
+        "email": card.Email,
+    }
@@ -0,0 +1,240 @@
+"""
+Set-based deletion of media and the rows that depend on them.
+
+Media are deleted DELETE_BATCH_SIZE at a time: every batch is a handful of
+DELETE ... WHERE ... IN (...) statements committed in their own transaction, so
+memory and lock time stay bounded whatever the size of a company. An interrupted
+deletion can simply be run again, it continues with the media that are left.
+
+Files are not removed by the request. Their paths are pushed to the Redis list
+'files:remove' once the batch is committed, and the video worker (the service
+that mounts the upload, preview and logo volumes) removes them.
+
+Companies are deleted by the video worker too: the request only adds the company
+to the Redis set 'companies:delete'. Every pass of the worker deletes a batch of
+its media, and the company itself once they are gone, so a company stays queued
+(and is retried) until it is deleted completely. The progress of a company
+deletion is kept in the hash deletion:company:{id}.
+"""
+import datetime
+import logging
+import os
+import redis
+from sqlalchemy import select, delete, func
+from ..database.media import Media
+from ..database.mediaPreview import MediaPreview
+from ..database.comments import Comments
+from ..database.reports import Reports
+from ..database.ratings import Ratings
+from ..database.viewHistory import ViewHistory
+from ..database.mediaTagsConnector import MediaTagsConnector
+from ..database.companies import Companies
+from ..database.subscribers import Subscribers
+from ..database.userRoles import UserRoles
+from .stats import stats_key
+from .viewers import media_viewers_key, company_viewers_key
+from .search_events import publish_search_event, MEDIA, COMPANY
+from .suggest import remove_suggestions
+
+DELETE_BATCH_SIZE = 500
+DEFAULT_PREVIEW_IDS = (1, 2)  # Placeholder previews shared by every audio and video without one
+DEFAULT_LOGO_ID = 1  # Placeholder logo of companies without one
+FILE_REMOVAL_QUEUE = "files:remove"
+COMPANY_DELETION_QUEUE = "companies:delete"
+DELETION_LOCK_TTL = 5 * 60  # Seconds one worker may spend on a batch before another one takes over
+PROGRESS_TTL = 24 * 60 * 60
+
+logger = logging.getLogger(__name__)
+
+
+def progress_key(kind, object_id):
+    return f"deletion:{kind}:{object_id}"
+
+
+def set_progress(redis_client: redis.Redis, kind, object_id, clear=(), **fields):
+    """
+    Records the progress of a deletion, removing the fields in clear.
+    Progress is informative, so Redis errors are only logged.
+    """
+    fields["updated"] = datetime.datetime.now().isoformat()
+    try:
+        pipe = redis_client.pipeline()
+        pipe.hset(progress_key(kind, object_id), mapping=fields)
+        if clear:
+            pipe.hdel(progress_key(kind, object_id), *clear)
+        pipe.expire(progress_key(kind, object_id), PROGRESS_TTL)
+        pipe.execute()
+    except redis.RedisError as e:
+        logger.warning(f"Could not record progress of {kind} {object_id} deletion: {e}")
+
+
+def add_progress(redis_client: redis.Redis, kind, object_id, deleted):
+    """Adds to the number of items a deletion has deleted so far."""
+    try:
+        pipe = redis_client.pipeline()
+        pipe.hincrby(progress_key(kind, object_id), "deleted", deleted)
+        pipe.hset(progress_key(kind, object_id), mapping={"status": "deleting",
+                                                          "updated": datetime.datetime.now().isoformat()})
+        pipe.hdel(progress_key(kind, object_id), "error")  # From a failed attempt before this one
+        pipe.expire(progress_key(kind, object_id), PROGRESS_TTL)
+        pipe.execute()
+    except redis.RedisError as e:
+        logger.warning(f"Could not record progress of {kind} {object_id} deletion: {e}")
+
+
+def get_progress(redis_client: redis.Redis, kind, object_id):
+    """Returns the progress of a deletion, or None if there was none in the last PROGRESS_TTL seconds."""
+    progress = {field.decode('utf-8'): value.decode('utf-8')
+                for field, value in redis_client.hgetall(progress_key(kind, object_id)).items()}
+    if not progress:
+        return None
+    for field in ("total", "deleted"):
+        if field in progress:
+            progress[field] = int(progress[field])
+    return progress
+
+
+def remove_files(paths):
+    for path in paths:
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass  # Already removed
+        except OSError as e:
+            logger.error(f"Error removing file {path}: {e}")
+
+
+def queue_file_removal(redis_client: redis.Redis, paths):
+    """Queues files of deleted rows for the video worker, removing them right away if Redis is unavailable."""
+    paths = [path for path in paths if path]
+    if not paths:
+        return
+    try:
+        redis_client.rpush(FILE_REMOVAL_QUEUE, *paths)
+    except redis.RedisError as e:
+        logger.warning(f"Could not queue {len(paths)} files for removal, removing them now: {e}")
+        remove_files(paths)
+
+
+def remove_queued_files(redis_client: redis.Redis, batch_size=500):
+    """Removes one batch of queued files. Returns the number of paths processed."""
+    paths = redis_client.lpop(FILE_REMOVAL_QUEUE, batch_size)
+    if not paths:
+        return 0
+    remove_files([path.decode('utf-8') for path in paths])
+    return len(paths)
+
+
+def delete_media_batch(session, redis_client: redis.Redis, media_ids):
+    """
+    Deletes media with their comments, reports, ratings, views and tag links in one
+    transaction, and queues their files for removal. Tags themselves are shared
+    between media and are kept. Returns the number of media deleted.
+    """
+    if not media_ids:
+        return 0
+
+    files = session.query(Media.VideoPath, Media.IdMediaPreview, MediaPreview.PreviewPath)\
+                   .outerjoin(MediaPreview, MediaPreview.IdMediaPreview == Media.IdMediaPreview)\
+                   .filter(Media.IdMedia.in_(media_ids)).all()
+    preview_ids = [preview_id for _, preview_id, _ in files
+                   if preview_id is not None and preview_id not in DEFAULT_PREVIEW_IDS]
+
+    comment_ids = select(Comments.IdComment).where(Comments.IdMedia.in_(media_ids))
+    statements = [delete(Reports).where(Reports.IdComment.in_(comment_ids))]
+    statements += [delete(model).where(model.IdMedia.in_(media_ids))
+                   for model in (Comments, Ratings, ViewHistory, MediaTagsConnector, Media)]
+    if preview_ids:
+        statements.append(delete(MediaPreview).where(MediaPreview.IdMediaPreview.in_(preview_ids)))
+    for statement in statements:
+        # Nothing of this is loaded in the session, so there is nothing to synchronize
+        session.execute(statement, execution_options={"synchronize_session": False})
+    session.commit()
+
+    paths = [video_path for video_path, _, _ in files]
+    paths += [preview_path for _, preview_id, preview_path in files if preview_id in preview_ids]
+    queue_file_removal(redis_client, paths)
+    publish_search_event(redis_client, MEDIA, media_ids)
+    remove_suggestions(redis_client, MEDIA, media_ids)
+    try:
+        redis_client.delete(*[stats_key(media_id) for media_id in media_ids],
+                            *[media_viewers_key(media_id) for media_id in media_ids])
+    except redis.RedisError as e:
+        logger.warning(f"Could not remove counters of deleted media: {e}")
+    return len(files)
+
+
+def queue_company_deletion(session, redis_client: redis.Redis, company_id):
+    """
+    Queues the deletion of a company for the video worker. Queuing it again resumes a
+    deletion that failed. Raises redis.RedisError if it could not be queued.
+    """
+    total = session.query(func.count(Media.IdMedia)).filter(Media.IdCompany == company_id).scalar()
+    pipe = redis_client.pipeline()
+    pipe.hset(progress_key("company", company_id), mapping={
+        "status": "queued", "total": total, "deleted": 0, "updated": datetime.datetime.now().isoformat()})
+    pipe.hdel(progress_key("company", company_id), "error")
+    pipe.expire(progress_key("company", company_id), PROGRESS_TTL)
+    pipe.sadd(COMPANY_DELETION_QUEUE, company_id)
+    pipe.execute()
+    return total
+
+
+def delete_company_batch(session, redis_client: redis.Redis, company_id, batch_size=DELETE_BATCH_SIZE):
+    """
+    Runs the next step of a company deletion: a batch of its media, or once they are all
+    gone, the rows that reference the company and the company itself, which ends it.
+    Returns the number of media deleted.
+    """
+    media_ids = [media_id for media_id, in session.query(Media.IdMedia)
+                                                .filter(Media.IdCompany == company_id)
+                                                .order_by(Media.IdMedia).limit(batch_size)]
+    if media_ids:
+        deleted = delete_media_batch(session, redis_client, media_ids)
+        add_progress(redis_client, "company", company_id, deleted)
+        return deleted
+
+    logo_path = None
+    company = session.query(Companies).filter_by(IdCompany=company_id).first()
+    if company:
+        logo = company.companyLogo if company.IdCompanyLogo != DEFAULT_LOGO_ID else None
+        session.query(UserRoles).filter(UserRoles.IdCompany == company_id).delete(synchronize_session=False)
+        session.query(Subscribers).filter(Subscribers.IdCompany == company_id).delete(synchronize_session=False)
+        session.delete(company)
+        if logo:
+            logo_path = logo.LogoPath
+            session.delete(logo)
+        session.commit()
+
+    if logo_path:
+        queue_file_removal(redis_client, [logo_path])
+    try:
+        redis_client.delete(company_viewers_key(company_id))
+    except redis.RedisError as e:
+        logger.warning(f"Could not remove viewer count of company {company_id}: {e}")
+    publish_search_event(redis_client, COMPANY, [company_id])
+    remove_suggestions(redis_client, COMPANY, [company_id])
+    redis_client.srem(COMPANY_DELETION_QUEUE, company_id)
+    set_progress(redis_client, "company", company_id, clear=("error",), status="done")
+    return 0
+
+
+def delete_queued_companies(session, redis_client: redis.Redis, batch_size=DELETE_BATCH_SIZE):
+    """
+    Runs the next step of every queued company deletion. A step that fails is recorded in
+    the progress and retried on the next call. Returns the number of media deleted.
+    """
+    deleted = 0
+    for company_id in sorted(int(company_id) for company_id in redis_client.smembers(COMPANY_DELETION_QUEUE)):
+        lock_key = f"{progress_key('company', company_id)}:lock"
+        if not redis_client.set(lock_key, 1, nx=True, ex=DELETION_LOCK_TTL):
+            continue  # Another worker is on it
+        try:
+            deleted += delete_company_batch(session, redis_client, company_id, batch_size)
+        except Exception as e:
+            session.rollback()
+            logger.exception(f"Error deleting company {company_id}, retrying: {e}")
+            set_progress(redis_client, "company", company_id, status="failed", error=str(e))
+        finally:
+            redis_client.delete(lock_key)
+    return deleted
@@ -0,0 +1,52 @@
+"""
+Full-text search over the FULLTEXT indexes added by migration 5.
+
+Search text becomes a boolean mode query in which every word is required and
+matches as a prefix, so "cat vid" finds "Cats video". MATCH ... AGAINST filters
+through the index instead of scanning with LIKE '%text%', and its score orders the
+results by relevance. Stopwords and words shorter than innodb_ft_min_token_size are
+not indexed; text made only of such words falls back to the LIKE scan.
+
+The columns passed to MATCH must be exactly those of one FULLTEXT index.
+"""
+import re
+from sqlalchemy import Float, func, or_, type_coerce
+from sqlalchemy.dialects.mysql import match
+
+MIN_TOKEN_LENGTH = 3  # innodb_ft_min_token_size
+SCORE_DECIMALS = 6  # Rounded, so a score read into a cursor compares equal to the one computed again
+WORD_PATTERN = re.compile(r"\w+")
+# INFORMATION_SCHEMA.INNODB_FT_DEFAULT_STOPWORD: never indexed, so they can't be required
+STOPWORDS = frozenset((
+    "a", "about", "an", "are", "as", "at", "be", "by", "com", "de", "en", "for", "from", "how", "i", "in",
+    "is", "it", "la", "of", "on", "or", "that", "the", "this", "to", "was", "what", "when", "where", "who",
+    "will", "with", "und", "www",
+))
+
+
+def boolean_query(text):
+    """Builds a boolean mode query requiring every indexable word of the text as a prefix."""
+    words = [word for word in WORD_PATTERN.findall(text.lower())
+             if len(word) >= MIN_TOKEN_LENGTH and word not in STOPWORDS]
+    return " ".join(f"+{word}*" for word in dict.fromkeys(words))
+
+
+def text_search(query, columns, text, key_columns, descending=True):
+    """
+    Filters a query by search text over the given indexed columns.
+
+    Returns the filtered query with the key columns and direction to paginate it
+    by: relevance then the unique last key column when the index is used, the
+    given ones otherwise. The relevance column is added to the selected columns.
+    """
+    text = (text or "").strip()
+    if not text:
+        return query, key_columns, descending
+
+    terms = boolean_query(text)
+    if not terms:
+        return query.filter(or_(*[column.ilike(f"%{text}%") for column in columns])), key_columns, descending
+
+    condition = match(*columns, against=terms).in_boolean_mode()
+    relevance = type_coerce(func.round(condition, SCORE_DECIMALS), Float).label("relevance")
+    return query.add_columns(relevance).filter(condition), (relevance, key_columns[-1]), True
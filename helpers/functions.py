@@ -1,5 +1,6 @@
 import jwt
 import datetime
+import secrets
 import redis
 from ..database.accessLevels import AccessLevels
 from ..database.users import Users
@@ -21,17 +22,88 @@ def generate_token(app: Flask, redis_client: redis.Redis, user_id):
 
     return token
 
-def after_token_required(f):
-    @wraps(f)
-    def decorated_function(user, session, *args, **kwargs):
-        try:
-            result = f(user, session, *args, **kwargs)  # Call the original function
-            return result
-        finally:
-            # Code to be executed AFTER the function call, ALWAYS
-            session.close()
 
-    return decorated_function
+def generate_refresh_token(app: Flask, redis_client: redis.Redis, user_id):
+    """
+    Generates an opaque refresh token for a given user ID.
+
+    Tokens rotated from each other share a family, so that replaying an already
+    used token can revoke everything issued after it.
+    """
+    token = secrets.token_urlsafe(32)
+    pipe = redis_client.pipeline()
+    store_refresh_token(app, pipe, user_id, secrets.token_urlsafe(16), token)
+    pipe.execute()
+    return token
+
+
+def store_refresh_token(app: Flask, pipe, user_id, family, token):
+    """Queues the Redis commands storing a refresh token as the latest one of its family."""
+    timeout = datetime.timedelta(minutes=int(app.config['REFRESH_TOKEN_TIMEOUT']))
+    pipe.setex(f"refresh:{token}", timeout, f"{user_id}:{family}")
+    pipe.setex(f"refresh_family:{family}", timeout, token)  # Only the latest token is valid
+    pipe.sadd(f"user:{user_id}:refresh_families", family)
+    pipe.expire(f"user:{user_id}:refresh_families", timeout)
+
+
+def rotate_refresh_token(app: Flask, redis_client: redis.Redis, refresh_token):
+    """
+    Exchanges a refresh token for a new one from the same family.
+
+    Returns a (user_id, new_refresh_token) tuple, or (None, None) if the token
+    is unknown, expired or was already used. Reuse revokes the whole family.
+    """
+    record = redis_client.get(f"refresh:{refresh_token}")
+    if not record:
+        return None, None
+    user_id, family = record.decode('utf-8').split(":", 1)
+    user_id = int(user_id)
+
+    new_token = secrets.token_urlsafe(32)
+    with redis_client.pipeline() as pipe:
+        try:
+            pipe.watch(f"refresh_family:{family}")
+            current_token = pipe.get(f"refresh_family:{family}")
+            if not current_token or current_token.decode('utf-8') != refresh_token:
+                pipe.reset()
+                # Token was already exchanged, so somebody is replaying it
+                revoke_refresh_family(redis_client, user_id, family)
+                return None, None
+
+            pipe.multi()
+            store_refresh_token(app, pipe, user_id, family, new_token)
+            pipe.execute()
+        except redis.WatchError:
+            # Concurrent refresh with the same token won the race
+            return None, None
+
+    return user_id, new_token
+
+
+def revoke_refresh_family(redis_client: redis.Redis, user_id, family):
+    """Revokes a refresh token family along with the user's current access token."""
+    current_token = redis_client.get(f"refresh_family:{family}")
+    access_token = redis_client.get(f"user:{user_id}:token")
+    access_token_ttl = redis_client.ttl(f"user:{user_id}:token")
+
+    pipe = redis_client.pipeline()
+    if current_token:
+        pipe.delete(f"refresh:{current_token.decode('utf-8')}")
+    pipe.delete(f"refresh_family:{family}")
+    pipe.srem(f"user:{user_id}:refresh_families", family)
+    if access_token and access_token_ttl > 0:
+        # Mark access token as invalid, so it cannot be accepted again by its signature
+        pipe.setex(f"token:{access_token.decode('utf-8')}", access_token_ttl, "INVALID")
+    pipe.delete(f"user:{user_id}:token")
+    pipe.execute()
+
+
+def revoke_refresh_tokens(redis_client: redis.Redis, user_id):
+    """Revokes all refresh tokens issued to a user."""
+    families = redis_client.smembers(f"user:{user_id}:refresh_families")
+    for family in families:
+        revoke_refresh_family(redis_client, user_id, family.decode('utf-8'))
+    redis_client.delete(f"user:{user_id}:refresh_families")
 
 
 def token_required(app: Flask, redis_client: redis.Redis, Session):
@@ -86,6 +158,7 @@ def token_required(app: Flask, redis_client: redis.Redis, Session):
                     except jwt.InvalidTokenError:
                         return jsonify({'message': 'Token is invalid!'}), 401
 
+                session.info['user_id'] = user.IdUser  # Lets the session keep this user's reads on the primary after writes
                 return f(user, session, *args, **kwargs)
 
             except Exception as e:
@@ -96,6 +169,35 @@ def token_required(app: Flask, redis_client: redis.Redis, Session):
     return token_required_outer
 
 
+def cached_token_required(app: Flask, redis_client: redis.Redis, Session):
+    """
+    token_required for hot endpoints that only need the user id: a token already
+    validated and cached in Redis is accepted without loading the user from the
+    database. Any other token goes through token_required. Passes the user id.
+    """
+    def cached_token_required_outer(f):
+        @wraps(f)
+        def cached_token_required_inner(*args, **kwargs):
+            token = request.headers.get('Authorization', '').partition(" ")[2]
+            if token:
+                try:
+                    user_id_bytes = redis_client.get(f"token:{token}")
+                    if user_id_bytes and user_id_bytes.isdigit():
+                        current_auth_token = redis_client.get(f"user:{user_id_bytes.decode('utf-8')}:token")
+                        if current_auth_token and current_auth_token.decode('utf-8') == token:
+                            return f(int(user_id_bytes), *args, **kwargs)
+                except redis.RedisError:
+                    pass  # token_required reports it
+
+            @token_required(app, redis_client, Session)
+            def with_user(user, session, *args, **kwargs):
+                return f(user.IdUser, *args, **kwargs)
+            return with_user(*args, **kwargs)
+
+        return cached_token_required_inner
+    return cached_token_required_outer
+
+
 def get_access_level_by_name(session, access_name):
     access_level_record = session.query(AccessLevels).filter_by(AccessName=access_name).first()
     return access_level_record if access_level_record else None
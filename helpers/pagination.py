@@ -0,0 +1,176 @@
+import base64
+import binascii
+import datetime
+import json
+from sqlalchemy import and_, or_, func, false
+
+DEFAULT_LIMIT = 50
+MAX_LIMIT = 200
+
+NEXT_CURSOR_HEADER = 'X-Next-Cursor'
+
+
+class PaginationError(ValueError):
+    """Raised when the limit or cursor sent by the client is invalid."""
+
+
+def get_limit(value, default=DEFAULT_LIMIT):
+    """Parses a page size, capping it at MAX_LIMIT."""
+    if value is None or value == '':
+        return default
+    try:
+        limit = int(value)
+    except (TypeError, ValueError):
+        raise PaginationError("Limit must be an integer")
+    if limit < 1:
+        raise PaginationError("Limit must be a positive integer")
+    return min(limit, MAX_LIMIT)
+
+
+def encode_cursor(values):
+    """Packs the sort key of the last returned row into an opaque token. NULL keys become JSON null."""
+    values = [v.isoformat() if isinstance(v, datetime.datetime) else v for v in values]
+    return base64.urlsafe_b64encode(json.dumps(values).encode('utf-8')).decode('utf-8')
+
+
+def decode_cursor_values(cursor, length):
+    """Unpacks the raw values of a token made by encode_cursor, checking there are as many as expected."""
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor.encode('utf-8')))
+    except (AttributeError, binascii.Error, UnicodeError, ValueError):
+        raise PaginationError("Invalid cursor")
+
+    if not isinstance(values, list) or len(values) != length:
+        raise PaginationError("Invalid cursor")
+    return values
+
+
+def decode_cursor(cursor, columns):
+    """Unpacks a token made by encode_cursor back into values for the given key columns."""
+    values = decode_cursor_values(cursor, len(columns))
+    try:
+        return [
+            datetime.datetime.fromisoformat(value)
+            if value is not None and column.type.python_type is datetime.datetime else value
+            for column, value in zip(columns, values)
+        ]
+    except (TypeError, ValueError):
+        raise PaginationError("Invalid cursor")
+
+
+def sorts_after(column, value, descending=True):
+    """
+    Condition for the values of column that sort after value.
+
+    NULL sorts as the smallest value, as MySQL and SQLite order it: last when descending,
+    first when ascending. Columns that can't be NULL get the plain comparison.
+    """
+    if not getattr(column, 'nullable', False):
+        return column < value if descending else column > value
+    if value is None:
+        return false() if descending else column.isnot(None)
+    return or_(column < value, column.is_(None)) if descending else column > value
+
+
+def keyset_filter(columns, values, descending=True):
+    """Builds (a, b) < (x, y) as (a < x) OR (a = x AND b < y)."""
+    clauses = []
+    for i, column in enumerate(columns):
+        equal = [c == v for c, v in zip(columns[:i], values[:i])]  # == None compiles to IS NULL
+        clauses.append(and_(*equal, sorts_after(column, values[i], descending)))
+    return or_(*clauses)
+
+
+def keyset_filters(columns, values, descending=True):
+    """
+    Conditions for the rows after a cursor, to apply one after another until a page is full:
+    the rows of each condition sort after those of the conditions before it.
+
+    Each condition bounds the leading column, so MySQL and SQLite seek the index to the
+    cursor instead of scanning it from the start. Rows whose leading column is NULL get a
+    condition of their own, since OR-ing IS NULL into the bounded one would lose the seek.
+    """
+    leading, value = columns[0], values[0]
+    rest = keyset_filter(columns[1:], values[1:], descending) if len(columns) > 1 else false()
+    if value is None:
+        filters = [and_(leading.is_(None), rest)]
+        if not descending:
+            filters.append(leading.isnot(None))
+        return filters
+
+    bound = leading <= value if descending else leading >= value
+    filters = [and_(bound, or_(leading < value if descending else leading > value, rest))]
+    if descending and getattr(leading, 'nullable', False):
+        filters.append(leading.is_(None))
+    return filters
+
+
+def paginate(query, columns, limit, cursor=None, descending=True):
+    """
+    Returns one page of a query ordered by the given key columns, and the cursor of the next page.
+
+    The last column must be unique (usually the primary key), so rows with equal leading keys
+    are never skipped or repeated. The cursor is None on the last page.
+    """
+    filters = keyset_filters(columns, decode_cursor(cursor, columns), descending) if cursor else [None]
+    query = query.order_by(*[column.desc() if descending else column.asc() for column in columns])
+
+    rows = []
+    for condition in filters:  # More than one query only for the page reaching the NULL keys
+        page_query = query.filter(condition) if condition is not None else query
+        rows += page_query.limit(limit + 1 - len(rows)).all()  # One extra row tells whether there is a next page
+        if len(rows) > limit:
+            break
+
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor([getattr(rows[-1], column.key) for column in columns])
+    return rows, next_cursor
+
+
+def paginate_partitions(query, partition, columns, limit, cursors, descending=True):
+    """
+    Returns one page per partition of a query with a single statement, as {value: (rows, next cursor)}.
+
+    partition is an expression splitting the rows (like the media type) and cursors maps each
+    wanted value to its cursor or None. ROW_NUMBER() ranks rows within their partition, so
+    every partition gets a page of its own however many rows the others have.
+    """
+    conditions = []
+    for value, cursor in cursors.items():
+        condition = partition == value
+        if cursor:
+            condition = and_(condition, or_(*keyset_filters(columns, decode_cursor(cursor, columns), descending)))
+        conditions.append(condition)
+
+    order = [column.desc() if descending else column.asc() for column in columns]
+    rank = func.row_number().over(partition_by=partition, order_by=order)
+    ranked = query.add_columns(partition.label("partition_value"), rank.label("partition_rank"))\
+                  .filter(or_(*conditions)).subquery()
+    rows = query.session.query(ranked)\
+                .filter(ranked.c.partition_rank <= limit + 1)\
+                .order_by(ranked.c.partition_value, ranked.c.partition_rank).all()
+
+    pages = {value: ([], None) for value in cursors}
+    for row in rows:
+        pages[row.partition_value][0].append(row)
+    for value, (partition_rows, _) in pages.items():
+        if len(partition_rows) > limit:
+            del partition_rows[limit:]
+            last_row = partition_rows[-1]
+            pages[value] = partition_rows, encode_cursor([getattr(last_row, column.key) for column in columns])
+    return pages
+
+
+def paginate_request(query, columns, request, descending=True, default_limit=DEFAULT_LIMIT):
+    """Paginates a query using the 'limit' and 'cursor' query parameters of the request."""
+    return paginate(query, columns,
+                    get_limit(request.args.get('limit'), default_limit),
+                    request.args.get('cursor'),
+                    descending)
+
+
+def next_cursor_headers(next_cursor):
+    """Response headers pointing the client to the next page, if there is one."""
+    return {NEXT_CURSOR_HEADER: next_cursor} if next_cursor else {}
@@ -0,0 +1,107 @@
+import math
+import time
+import bcrypt
+import redis
+
+# Work factors outside of this range are either too weak to be useful
+# or too slow for an interactive login, so calibration never leaves it.
+MIN_ROUNDS = 10
+MAX_ROUNDS = 16
+
+# Work factors bcrypt itself accepts, the bounds of a pinned BCRYPT_ROUNDS
+BCRYPT_MIN_ROUNDS = 4
+BCRYPT_MAX_ROUNDS = 31
+
+CALIBRATION_KEY = "bcrypt:rounds"  # No expiry: a new cost is only picked by recalibrate_rounds()
+
+
+def calibrate_rounds(target_ms, min_rounds=MIN_ROUNDS, max_rounds=MAX_ROUNDS):
+    """Picks the highest bcrypt work factor whose hash time stays within target_ms."""
+    sample = b"calibration-password"
+    elapsed_ms = None
+    for _ in range(3):  # Best of three to ignore scheduling noise
+        start = time.perf_counter()
+        bcrypt.hashpw(sample, bcrypt.gensalt(min_rounds))
+        took = (time.perf_counter() - start) * 1000
+        elapsed_ms = took if elapsed_ms is None else min(elapsed_ms, took)
+
+    # Every extra round doubles the hashing time
+    extra_rounds = math.floor(math.log2(target_ms / elapsed_ms)) if elapsed_ms > 0 else 0
+    return max(min_rounds, min(max_rounds, min_rounds + extra_rounds))
+
+
+def parse_pinned_rounds(value):
+    """Validates a pinned work factor, so a typo stops the worker at startup instead of failing every login."""
+    try:
+        rounds = int(value)
+    except (TypeError, ValueError):
+        raise ValueError(f"BCRYPT_ROUNDS must be an integer, got {value!r}")
+    if not BCRYPT_MIN_ROUNDS <= rounds <= BCRYPT_MAX_ROUNDS:
+        raise ValueError(f"BCRYPT_ROUNDS must be between {BCRYPT_MIN_ROUNDS} and {BCRYPT_MAX_ROUNDS}, got {rounds}")
+    return rounds
+
+
+def get_deployment_rounds(redis_client: redis.Redis, pinned_rounds=None, target_ms=250):
+    """
+    Returns the work factor used for new password hashes.
+
+    A pinned value from the configuration always wins. Otherwise the first worker
+    to start calibrates and shares the result through Redis. The shared value never
+    expires, so workers started later don't calibrate a cost of their own.
+    """
+    if pinned_rounds:
+        return parse_pinned_rounds(pinned_rounds)
+
+    try:
+        shared_rounds = redis_client.get(CALIBRATION_KEY)
+        if shared_rounds:
+            return int(shared_rounds.decode('utf-8'))
+
+        rounds = calibrate_rounds(target_ms)
+        redis_client.set(CALIBRATION_KEY, rounds, nx=True)
+        return int(redis_client.get(CALIBRATION_KEY).decode('utf-8'))
+    except redis.RedisError:
+        return calibrate_rounds(target_ms)
+
+
+def recalibrate_rounds(redis_client: redis.Redis, target_ms=250):
+    """Calibrates again, after a hardware change for instance, and shares the new cost with all workers."""
+    rounds = calibrate_rounds(target_ms)
+    redis_client.set(CALIBRATION_KEY, rounds)
+    return rounds
+
+
+def get_current_rounds(redis_client: redis.Redis, rounds, pinned=False):
+    """
+    Returns the work factor for new hashes at this moment.
+
+    The shared value is read on every call instead of once per worker, so that after
+    a recalibration all workers rehash to the same cost on login rather than back and
+    forth. rounds, the cost the worker started with, is used when it is pinned or when
+    Redis is unavailable.
+    """
+    if pinned:
+        return rounds
+    try:
+        shared_rounds = redis_client.get(CALIBRATION_KEY)
+    except redis.RedisError:
+        return rounds
+    return int(shared_rounds.decode('utf-8')) if shared_rounds else rounds
+
+
+def hash_password(password, rounds):
+    """Hashes a password with the given bcrypt work factor."""
+    return bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt(rounds)).decode('utf-8')
+
+
+def check_password(password, hashed_password):
+    """Checks a password against a stored bcrypt hash."""
+    return bcrypt.checkpw(password.encode('utf-8'), hashed_password.encode('utf-8'))
+
+
+def get_password_rounds(hashed_password):
+    """Extracts the work factor from a stored bcrypt hash ($2b$12$...)."""
+    try:
+        return int(hashed_password.split('$')[2])
+    except (IndexError, ValueError):
+        return None
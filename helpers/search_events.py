@@ -0,0 +1,63 @@
+"""
+Change events for the search index.
+
+After committing, write paths publish the ids of the media, companies or users
+they changed on the Redis channel 'search:events'. Events carry no data: the search
+gateway reads the current rows itself (a missing row means it was deleted), so
+events can be applied in any order and more than once. Pub/sub does not keep
+messages for subscribers that are away, which is why the index is also rebuilt
+periodically.
+
+Every event also increments the generation counter of its type,
+search:generation:{media,company,user}, and carries the new value. Search results
+cached under an older generation are no longer used, and the index tells from the
+generations it has applied whether it already reflects a write.
+"""
+import json
+import logging
+import redis
+
+SEARCH_EVENTS_CHANNEL = "search:events"
+MEDIA = "media"
+COMPANY = "company"
+USER = "user"
+EVENT_TYPES = (MEDIA, COMPANY, USER)
+
+logger = logging.getLogger(__name__)
+
+
+def generation_key(event_type):
+    return f"search:generation:{event_type}"
+
+
+def get_generations(redis_client: redis.Redis):
+    """Returns the current generation of every event type."""
+    values = redis_client.mget([generation_key(event_type) for event_type in EVENT_TYPES])
+    return {event_type: int(value or 0) for event_type, value in zip(EVENT_TYPES, values)}
+
+
+def publish_search_event(redis_client: redis.Redis, event_type, ids):
+    """Tells the search gateways that the given media, companies or users changed. Redis errors are only logged."""
+    ids = [int(object_id) for object_id in ids]
+    if not ids:
+        return
+    try:
+        generation = redis_client.incr(generation_key(event_type))
+        redis_client.publish(SEARCH_EVENTS_CHANNEL,
+                             json.dumps({"type": event_type, "ids": ids, "generation": generation}))
+    except redis.RedisError as e:
+        # The index picks the change up on its next rebuild
+        logger.warning(f"Could not publish search event for {event_type} {ids}: {e}")
+
+
+def parse_search_event(data):
+    """Returns (type, ids, generation) of a published event. Raises ValueError if it is malformed."""
+    try:
+        event = json.loads(data)
+        event_type, ids = event["type"], [int(object_id) for object_id in event["ids"]]
+        generation = int(event.get("generation", 0))
+    except (KeyError, TypeError, ValueError) as e:  # JSONDecodeError is a ValueError
+        raise ValueError(f"Malformed search event: {e}")
+    if event_type not in EVENT_TYPES:
+        raise ValueError(f"Unknown search event type: {event_type}")
+    return event_type, ids, generation
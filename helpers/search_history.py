@@ -0,0 +1,145 @@
+"""
+Per-user search history kept in Redis.
+
+The latest searches of a user are the sorted set search:history:{user id}, with
+the query as member and the time of its last search as score, so searching the
+same text again moves it to the top instead of adding an entry. Recording a
+search is one pipeline: ZADD, then ZREMRANGEBYRANK keeping the newest
+HISTORY_SIZE, then XADD to the stream 'search:history'.
+
+The stream is written behind to the SearchHistory table by the search worker,
+which reads it through a consumer group like the views stream (helpers/views.py):
+a batch is one INSERT ... ON DUPLICATE KEY UPDATE and one DELETE trimming the
+history of its users, and entries that keep failing end up in 'search:history:dead'.
+MySQL is the durable copy. A history missing from Redis, after a Redis restart
+for instance, is loaded back from it on the next read.
+"""
+import datetime
+import logging
+import redis
+from sqlalchemy import select, delete, func
+from sqlalchemy.dialects.mysql import insert
+from ..database.searchHistory import SearchHistory
+from ..database.users import Users
+from .views import ensure_group, read_batch
+
+HISTORY_STREAM = "search:history"
+HISTORY_GROUP = "search-history-writers"
+HISTORY_SIZE = 10
+MAX_QUERY_LENGTH = 255  # Length of SearchHistory.SearchQuery
+STREAM_MAX_LENGTH = 100000  # Bounds the stream while no worker is running
+
+logger = logging.getLogger(__name__)
+
+
+def history_key(user_id):
+    return f"search:history:{user_id}"
+
+
+def record_search(redis_client: redis.Redis, user_id, query, persist=True, search_time=None):
+    """Adds a search to the user's history, queueing it for MySQL if persist. Redis errors are only logged."""
+    query = query.strip()[:MAX_QUERY_LENGTH]
+    if not query:
+        return
+    search_time = search_time or datetime.datetime.now()
+    try:
+        pipe = redis_client.pipeline()
+        pipe.zadd(history_key(user_id), {query: search_time.timestamp()})
+        pipe.zremrangebyrank(history_key(user_id), 0, -HISTORY_SIZE - 1)
+        if persist:
+            pipe.xadd(HISTORY_STREAM, {"user": user_id, "query": query, "time": search_time.isoformat()},
+                      maxlen=STREAM_MAX_LENGTH, approximate=True)
+        pipe.execute()
+    except redis.RedisError as e:
+        logger.warning(f"Could not record search of user {user_id}: {e}")
+
+
+def get_history(redis_client: redis.Redis, session, user_id):
+    """Returns the user's latest searches as [(search time, query)], newest first."""
+    try:
+        entries = redis_client.zrevrange(history_key(user_id), 0, -1, withscores=True)
+        if entries:
+            return [(datetime.datetime.fromtimestamp(score), query.decode('utf-8')) for query, score in entries]
+    except redis.RedisError as e:
+        logger.warning(f"Could not read search history of user {user_id}, reading it from the database: {e}")
+
+    rows = session.query(SearchHistory.SearchTime, SearchHistory.SearchQuery)\
+                  .filter(SearchHistory.IdUser == user_id, SearchHistory.SearchTime.isnot(None),
+                          SearchHistory.SearchQuery.isnot(None))\
+                  .order_by(SearchHistory.SearchTime.desc()).limit(HISTORY_SIZE).all()
+    history = sorted(((search_time, query) for search_time, query in rows), reverse=True)
+    if history:
+        try:
+            pipe = redis_client.pipeline()
+            # GT keeps the time of a search recorded while the history was being loaded
+            pipe.zadd(history_key(user_id), {query: search_time.timestamp() for search_time, query in history}, gt=True)
+            pipe.zremrangebyrank(history_key(user_id), 0, -HISTORY_SIZE - 1)
+            pipe.execute()
+        except redis.RedisError as e:
+            logger.warning(f"Could not restore search history of user {user_id}: {e}")
+    return history
+
+
+def ensure_history_group(redis_client: redis.Redis):
+    ensure_group(redis_client, HISTORY_STREAM, HISTORY_GROUP)
+
+
+def write_history(session, searches):
+    """
+    Upserts {(user id, query): search time} into SearchHistory in one statement, then
+    deletes all but the newest HISTORY_SIZE entries of those users in another.
+    """
+    if not searches:
+        return
+
+    user_ids = list({user_id for user_id, _ in searches})
+    existing_users = {user_id for user_id, in session.query(Users.IdUser).filter(Users.IdUser.in_(user_ids))}
+    # Searches of users deleted in the meantime are dropped, they would fail the whole batch
+    searches = {key: value for key, value in searches.items() if key[0] in existing_users}
+    if not searches:
+        return
+
+    statement = insert(SearchHistory).values([
+        {"IdUser": user_id, "SearchQuery": query, "SearchTime": search_time}
+        for (user_id, query), search_time in searches.items()
+    ])
+    statement = statement.on_duplicate_key_update(
+        SearchTime=func.greatest(SearchHistory.SearchTime, statement.inserted.SearchTime)
+    )
+    session.execute(statement)
+
+    position = func.row_number().over(partition_by=SearchHistory.IdUser,
+                                      order_by=(SearchHistory.SearchTime.desc(),
+                                                SearchHistory.IdSearchHistory.desc()))
+    ranked = select(SearchHistory.IdSearchHistory, position.label("history_position"))\
+        .where(SearchHistory.IdUser.in_(existing_users)).subquery()
+    session.execute(delete(SearchHistory).where(SearchHistory.IdSearchHistory.in_(
+        select(ranked.c.IdSearchHistory).where(ranked.c.history_position > HISTORY_SIZE))),
+        execution_options={"synchronize_session": False})
+    session.commit()
+
+
+def flush_history(redis_client: redis.Redis, session, consumer, batch_size=500):
+    """Writes one batch of queued searches to the database. Returns the number of events processed."""
+    entries = read_batch(redis_client, HISTORY_STREAM, HISTORY_GROUP, consumer, batch_size)
+    if not entries:
+        return 0
+
+    searches = {}
+    for entry_id, fields in entries:
+        if not fields:  # Deleted from the stream after it was delivered
+            continue
+        try:
+            key = (int(fields[b"user"]), fields[b"query"].decode('utf-8'))
+            search_time = datetime.datetime.fromisoformat(fields[b"time"].decode('utf-8'))
+        except (KeyError, ValueError) as e:
+            logger.error(f"Dropping malformed search history event {entry_id}: {e}")
+            continue
+        searches[key] = max(searches.get(key, search_time), search_time)
+
+    write_history(session, searches)
+
+    entry_ids = [entry_id for entry_id, _ in entries]
+    redis_client.xack(HISTORY_STREAM, HISTORY_GROUP, *entry_ids)
+    redis_client.xdel(HISTORY_STREAM, *entry_ids)
+    return len(entries)
@@ -0,0 +1,310 @@
+import itertools
+import os
+import threading
+import time
+from collections import deque
+from functools import wraps
+import redis
+from flask import Flask, g, has_app_context, jsonify
+from flask.globals import app_ctx
+from sqlalchemy import create_engine, event, exc, text
+from sqlalchemy.orm import Session as BaseSession, scoped_session, sessionmaker
+from sqlalchemy.pool import QueuePool
+
+
+def app_context_id():
+    """Identifies the current Flask application context (one per request)."""
+    return id(app_ctx._get_current_object())
+
+
+class PoolWaitStats:
+    """Rolling statistics of connection checkout wait times for one pool."""
+
+    def __init__(self, logger=None, warning_ms=100, window=1000):
+        self.logger = logger
+        self.warning_ms = warning_ms
+        self.waits = deque(maxlen=window)  # Latest wait times, in milliseconds
+        self.total = 0
+        self.slow = 0
+        self.lock = threading.Lock()
+
+    def record(self, wait_ms, pool):
+        with self.lock:
+            self.waits.append(wait_ms)
+            self.total += 1
+            if wait_ms > self.warning_ms:
+                self.slow += 1
+        if wait_ms > self.warning_ms and self.logger:
+            self.logger.warning(f"Waited {wait_ms:.1f} ms for a database connection "
+                                f"(checked out: {pool.checkedout()}, overflow: {pool.overflow()})")
+
+    def summary(self):
+        with self.lock:
+            waits = sorted(self.waits)
+            total, slow = self.total, self.slow
+        return {
+            "count": total,
+            "slow": slow,
+            "warning_ms": self.warning_ms,
+            "avg_ms": round(sum(waits) / len(waits), 3) if waits else 0,
+            "p95_ms": round(waits[min(len(waits) - 1, int(len(waits) * 0.95))], 3) if waits else 0,
+            "max_ms": round(waits[-1], 3) if waits else 0,
+        }
+
+
+class TimedQueuePool(QueuePool):
+    """QueuePool that measures how long each checkout had to wait for a connection."""
+
+    wait_stats = None
+
+    def _do_get(self):
+        start = time.perf_counter()
+        try:
+            return super()._do_get()
+        finally:
+            waited = time.perf_counter() - start
+            if self.wait_stats:
+                self.wait_stats.record(waited * 1000, self)
+            if has_app_context():
+                g.db_checkout_time = g.get('db_checkout_time', 0.0) + waited
+                g.db_checkouts = g.get('db_checkouts', 0) + 1
+
+    def recreate(self):
+        pool = super().recreate()
+        pool.wait_stats = self.wait_stats  # Keep statistics when the engine is disposed
+        return pool
+
+
+def monitor_pool(engine, logger, warning_ms):
+    """Starts collecting checkout wait statistics, logging checkouts slower than warning_ms."""
+    engine.pool.wait_stats = PoolWaitStats(logger, warning_ms)
+
+
+def get_pool_stats(engine, router=None):
+    """Returns the current state of the engine's connection pool in this worker process."""
+    pool = engine.pool
+    stats = {
+        "pid": os.getpid(),  # Every gunicorn worker has its own pool
+        "size": pool.size(),
+        "checked_in": pool.checkedin(),
+        "checked_out": pool.checkedout(),
+        "overflow": pool.overflow(),
+        "timeout": pool.timeout(),
+    }
+    if getattr(pool, 'wait_stats', None):
+        stats["waits"] = pool.wait_stats.summary()
+    if router and router.engines:
+        stats["replicas"] = [
+            dict(get_pool_stats(replica), healthy=router.health.get(replica, (None, 0))[0])
+            for replica in router.engines
+        ]
+    return stats
+
+
+def register_pool_route(app: Flask, engine, router=None):
+    """Adds GET /internal/pool, reporting get_pool_stats of the worker that serves the request."""
+    @app.get("/internal/pool")
+    def internal_pool_stats():
+        """
+Reports database connection pool usage of the worker that served the request.
+
+Not exposed through the proxy, meant for monitoring inside the service network.
+---
+tags:
+  - Internal
+responses:
+  200:
+    description: Pool statistics (size, checked out and overflow connections, checkout wait times, replicas).
+"""
+        return jsonify(get_pool_stats(engine, router)), 200
+
+
+class ReplicaRouter:
+    """
+    Chooses read replicas for read-only requests.
+
+    Replicas are health checked at most every health_interval seconds and skipped
+    while they are down. The check runs on a background thread, so a hung replica
+    never holds up a request: until its first check succeeds, and from the first
+    connection error a request gets, a replica is skipped. After a user commits a
+    write, their reads stay on the primary for sticky_seconds, so they always see
+    their own changes.
+    """
+
+    def __init__(self, engines, redis_client: redis.Redis = None, sticky_seconds=5, health_interval=10, logger=None):
+        self.engines = engines
+        self.redis_client = redis_client
+        self.sticky_seconds = sticky_seconds
+        self.health_interval = health_interval
+        self.logger = logger
+        self.health = {}  # engine -> (healthy, checked at)
+        self.probing = set()  # Engines whose health check is running
+        self.lock = threading.Lock()
+        self._counter = itertools.count()
+
+        for engine in engines:
+            event.listen(engine, "handle_error", self._on_engine_error)
+
+    def _on_engine_error(self, context):
+        # No connection means it could not be opened at all
+        if (context.is_disconnect or context.connection is None) and context.engine is not None:
+            self.health[context.engine] = (False, time.monotonic())
+
+    def probe(self, engine):
+        try:
+            with engine.connect() as connection:
+                connection.execute(text("SELECT 1"))
+            healthy = True
+        except exc.SQLAlchemyError as e:
+            healthy = False
+            if self.logger:
+                self.logger.warning(f"Read replica {engine.url!r} is unavailable, using primary: {e}")
+        finally:
+            with self.lock:
+                self.probing.discard(engine)
+        self.health[engine] = (healthy, time.monotonic())
+
+    def is_healthy(self, engine):
+        """Returns the latest known health of a replica, starting a check in the background if it is stale."""
+        healthy, checked_at = self.health.get(engine, (None, 0))
+        if healthy is None or time.monotonic() - checked_at >= self.health_interval:
+            with self.lock:
+                start = engine not in self.probing
+                self.probing.add(engine)
+            if start:
+                threading.Thread(target=self.probe, args=(engine,), daemon=True, name="replica-health").start()
+        return bool(healthy)
+
+    def pick(self):
+        """Returns the next healthy replica (round-robin), or None to use the primary."""
+        for _ in range(len(self.engines)):
+            engine = self.engines[next(self._counter) % len(self.engines)]
+            if self.is_healthy(engine):
+                return engine
+        return None
+
+    def mark_write(self, user_id):
+        if self.redis_client and self.engines:
+            try:
+                self.redis_client.setex(f"db:sticky:{user_id}", self.sticky_seconds, 1)
+            except redis.RedisError:
+                pass
+
+    def is_sticky(self, user_id):
+        if not self.redis_client:
+            return False
+        try:
+            return bool(self.redis_client.exists(f"db:sticky:{user_id}"))
+        except redis.RedisError:
+            return True  # Can't tell if user has fresh writes, so stay safe
+
+
+class RoutingSession(BaseSession):
+    """
+    Session that sends the reads of read-only requests to a replica and everything else to the primary.
+
+    Once the session has written anything, its reads stay on the primary for the rest of the request.
+    """
+
+    def get_bind(self, mapper=None, clause=None, **kw):
+        router = self.info.get('router')
+        if (router and router.engines and self.info.get('read_only') and not self.info.get('wrote')
+                and not self._flushing and not getattr(clause, 'is_dml', False)):
+            if 'replica' not in self.info:
+                self.info['replica'] = router.pick()  # Same replica for the whole request
+            if self.info['replica'] is not None:
+                return self.info['replica']
+        return super().get_bind(mapper, clause=clause, **kw)
+
+
+def read_only(f):
+    """Marks a route as read-only, so its queries can be served by a read replica."""
+    @wraps(f)
+    def decorated_function(user, session, *args, **kwargs):
+        router = session.info.get('router')
+        if router and router.engines and not router.is_sticky(user.IdUser):
+            session.info['read_only'] = True
+        return f(user, session, *args, **kwargs)
+    return decorated_function
+
+
+def create_request_session(app: Flask, engine, router: ReplicaRouter = None):
+    """
+    Creates a session registry scoped to the Flask application context.
+
+    Every Session() call during a request returns the same session. The session
+    checks out a pooled connection only when its first statement runs, and it is
+    always removed (returning the connection) when the context is torn down.
+    Requests that never touch the database never touch the pool either.
+    """
+    session_factory = sessionmaker(bind=engine, class_=RoutingSession, info={'router': router})
+    Session = scoped_session(session_factory, scopefunc=app_context_id)
+
+    @event.listens_for(session_factory, "after_flush")
+    def remember_flush(session, flush_context):
+        session.info['has_writes'] = True
+        session.info['wrote'] = True  # Unlike has_writes, kept after commit
+
+    @event.listens_for(session_factory, "do_orm_execute")
+    def remember_dml(orm_execute_state):
+        if orm_execute_state.is_insert or orm_execute_state.is_update or orm_execute_state.is_delete:
+            orm_execute_state.session.info['has_writes'] = True
+            orm_execute_state.session.info['wrote'] = True
+
+    @event.listens_for(session_factory, "after_commit")
+    def make_user_sticky(session):
+        if session.info.pop('has_writes', False) and router and 'user_id' in session.info:
+            router.mark_write(session.info['user_id'])
+
+    @app.after_request
+    def report_db_checkout_time(response):
+        if 'db_checkouts' in g:
+            response.headers.add(
+                'Server-Timing',
+                f'db-checkout;dur={g.db_checkout_time * 1000:.2f};desc="{g.db_checkouts} checkout(s)"'
+            )
+        return response
+
+    @app.teardown_appcontext
+    def remove_session(exception=None):
+        Session.remove()
+
+    return Session
+
+
+def create_engines(app: Flask, redis_client: redis.Redis = None):
+    """
+    Creates the primary engine and the router of the read replicas from the DB_* environment
+    variables. Returns (engine, router). Pool settings apply per gunicorn worker, so the pools
+    of all workers and services together have to stay below MySQL max_connections.
+    """
+    db_user = os.getenv("DB_USER")
+    db_password = os.getenv("DB_PASSWORD")
+    db_host = os.getenv("DB_HOST")
+    db_name = os.getenv("DB_NAME")
+    database_url = f"mysql+pymysql://{db_user}:{db_password}@{db_host}/{db_name}"
+
+    pool_options = {
+        "poolclass": TimedQueuePool,
+        "pool_size": int(os.getenv("DB_POOL_SIZE") or 2),
+        "max_overflow": int(os.getenv("DB_POOL_MAX_OVERFLOW") or 3),
+        "pool_recycle": int(os.getenv("DB_POOL_RECYCLE") or 1800),  # Below MySQL wait_timeout
+        "pool_pre_ping": (os.getenv("DB_POOL_PRE_PING") or "true").lower() == "true",
+        "pool_timeout": int(os.getenv("DB_POOL_TIMEOUT") or 10),
+    }
+    pool_wait_warning_ms = int(os.getenv("DB_POOL_WAIT_WARNING_MS") or 100)
+    engine = create_engine(database_url, **pool_options)
+    monitor_pool(engine, app.logger, pool_wait_warning_ms)
+
+    # Optional read replicas for read-only routes (comma-separated SQLAlchemy URLs)
+    replica_engines = []
+    for replica_url in (os.getenv("DB_REPLICA_URLS") or "").split(","):
+        if replica_url.strip():
+            replica_engine = create_engine(replica_url.strip(), **pool_options)
+            monitor_pool(replica_engine, app.logger, pool_wait_warning_ms)
+            replica_engines.append(replica_engine)
+    router = ReplicaRouter(replica_engines, redis_client,
+                           sticky_seconds=int(os.getenv("DB_REPLICA_STICKY_SECONDS") or 5),
+                           health_interval=int(os.getenv("DB_REPLICA_HEALTH_INTERVAL") or 10),
+                           logger=app.logger)
+    return engine, router
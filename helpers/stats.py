@@ -0,0 +1,233 @@
+"""
+Denormalized per-media counters.
+
+Likes, dislikes and total views of a media are kept in the Redis hash
+media:{id}:stats and updated incrementally by the write paths, so reading them is
+a single HGETALL instead of aggregate queries. A missing hash is rebuilt from the
+source tables, and reconcile_media_stats recomputes all of them to correct any
+drift. Unique viewers are counted separately, see viewers.py.
+
+Counts read from the database can't be stored blindly: a write committed while
+they were read would be missing from them, or counted twice once its increment
+lands. So a write calls begin_media_stats_update() before it commits, which bumps
+the version of the media's counters in media:{id}:stats:writes and marks the
+write as pending, and increment_media_stats() after, which clears the mark. Counts
+read from the database are only stored if the version is the one read before
+them and no write is pending, checked atomically by a script.
+"""
+import logging
+import redis
+from redis.commands.core import Script
+from sqlalchemy import func
+from sqlalchemy.orm import Session as BaseSession
+from ..database.media import Media
+from ..database.ratings import Ratings
+from ..database.ratingTypes import RatingTypes
+from ..database.viewHistory import ViewHistory
+from .viewers import rebuild_viewer_hlls
+
+STATS_FIELDS = ("likes", "dislikes", "views")
+STATS_TTL = 24 * 60 * 60  # Unused hashes expire, and are rebuilt from the database when needed
+WRITES_TTL = 5 * 60  # A write that never calls increment_media_stats() stops blocking rebuilds after this
+
+# Ends a write. Only increments existing hashes: a partially created hash would hide the real counts
+INCREMENT_SCRIPT = """
+if tonumber(redis.call('HGET', KEYS[2], 'pending') or '0') > 0 then
+    redis.call('HINCRBY', KEYS[2], 'pending', -1)
+end
+if redis.call('EXISTS', KEYS[1]) == 0 then
+    return 0
+end
+for i = 1, #ARGV, 2 do
+    redis.call('HINCRBY', KEYS[1], ARGV[i], ARGV[i + 1])
+end
+return 1
+"""
+
+# ARGV: version read before the counts, TTL, 1 to replace an existing hash, then field, value, ...
+STORE_SCRIPT = """
+local version = redis.call('HGET', KEYS[2], 'version') or '0'
+if version ~= ARGV[1] or tonumber(redis.call('HGET', KEYS[2], 'pending') or '0') > 0 then
+    return 0
+end
+if ARGV[3] == '0' and redis.call('EXISTS', KEYS[1]) == 1 then
+    return 0
+end
+redis.call('DEL', KEYS[1])
+for i = 4, #ARGV, 2 do
+    redis.call('HSET', KEYS[1], ARGV[i], ARGV[i + 1])
+end
+redis.call('EXPIRE', KEYS[1], ARGV[2])
+return 1
+"""
+
+# Loaded into Redis on first use, whatever the client
+increment_script = Script(None, INCREMENT_SCRIPT.encode('utf-8'))
+store_script = Script(None, STORE_SCRIPT.encode('utf-8'))
+
+logger = logging.getLogger(__name__)
+
+
+def stats_key(media_id):
+    return f"media:{media_id}:stats"
+
+
+def writes_key(media_id):
+    return f"media:{media_id}:stats:writes"
+
+
+def compute_media_stats(session, media_ids):
+    """Counts likes, dislikes and views of the given media from the source tables."""
+    stats = {media_id: dict.fromkeys(STATS_FIELDS, 0) for media_id in media_ids}
+    if not stats:
+        return stats
+
+    ratings = session.query(Ratings.IdMedia, RatingTypes.RatingFactor, func.count(Ratings.IdRating))\
+                     .join(Ratings.rating_types)\
+                     .filter(Ratings.IdMedia.in_(stats.keys()), RatingTypes.RatingFactor.in_((1, -1)))\
+                     .group_by(Ratings.IdMedia, RatingTypes.RatingFactor).all()
+    for media_id, rating_factor, count in ratings:
+        stats[media_id]["likes" if rating_factor == 1 else "dislikes"] = int(count)
+
+    views = session.query(ViewHistory.IdMedia, func.sum(ViewHistory.ViewCount))\
+                   .filter(ViewHistory.IdMedia.in_(stats.keys()))\
+                   .group_by(ViewHistory.IdMedia).all()
+    for media_id, total_views in views:
+        stats[media_id]["views"] = int(total_views or 0)
+
+    return stats
+
+
+def get_stats_versions(redis_client: redis.Redis, media_ids):
+    """Returns the write version of the counters of every media, to read before counting from the database."""
+    pipe = redis_client.pipeline(transaction=False)
+    for media_id in media_ids:
+        pipe.hget(writes_key(media_id), "version")
+    return {media_id: (version or b"0").decode('utf-8') for media_id, version in zip(media_ids, pipe.execute())}
+
+
+def store_media_stats(redis_client: redis.Redis, stats, versions, replace=False):
+    """
+    Stores counters counted from the database, as {media id: counters}, given the versions read before counting.
+
+    Counters of media written since, or being written, are skipped. Existing hashes are only replaced if replace.
+    """
+    pipe = redis_client.pipeline(transaction=False)
+    for media_id, counters in stats.items():
+        args = [versions[media_id], STATS_TTL, int(replace)]
+        for field, value in counters.items():
+            args.extend((field, value))
+        store_script(keys=[stats_key(media_id), writes_key(media_id)], args=args, client=pipe)
+    pipe.execute()
+
+
+def get_media_stats(redis_client: redis.Redis, session, media_id):
+    """Returns the counters of a media, rebuilding them from the database if they are not cached."""
+    try:
+        pipe = redis_client.pipeline()
+        pipe.hgetall(stats_key(media_id))
+        pipe.hget(writes_key(media_id), "version")
+        cached, version = pipe.execute()
+        if cached:
+            stats = dict.fromkeys(STATS_FIELDS, 0)
+            stats.update({field.decode('utf-8'): int(value) for field, value in cached.items()})
+            return stats
+    except redis.RedisError as e:
+        logger.warning(f"Could not read stats of media {media_id} from Redis: {e}")
+        return compute_media_stats(session, [media_id])[media_id]
+
+    # Counted in a transaction of its own on the primary: the request's transaction may have taken
+    # its snapshot before the version was read, and a replica may not have the latest writes yet
+    with BaseSession(bind=session.bind) as counting_session:
+        stats = compute_media_stats(counting_session, [media_id])
+    try:
+        store_media_stats(redis_client, stats, {media_id: (version or b"0").decode('utf-8')})
+    except redis.RedisError as e:
+        logger.warning(f"Could not store stats of media {media_id} in Redis: {e}")
+    return stats[media_id]
+
+
+def begin_media_stats_update(redis_client: redis.Redis, media_ids):
+    """
+    Marks a write changing the counters of the media as pending. Call it before the write commits,
+    then increment_media_stats() for every media once it has committed, or without deltas if it failed.
+    """
+    try:
+        pipe = redis_client.pipeline(transaction=False)
+        for media_id in media_ids:
+            pipe.hincrby(writes_key(media_id), "version", 1)
+            pipe.hincrby(writes_key(media_id), "pending", 1)
+            pipe.expire(writes_key(media_id), WRITES_TTL)
+        pipe.execute()
+    except redis.RedisError as e:
+        logger.warning(f"Could not mark stats of media {', '.join(map(str, media_ids))} as being updated: {e}")
+
+
+def increment_media_stats(redis_client: redis.Redis, media_id, **deltas):
+    """
+    Applies counter changes of a committed write, e.g. likes=1, dislikes=-1, and ends the write.
+
+    Hashes that are not cached are left alone; they are rebuilt from the
+    database, which already includes the write, on the next read.
+    """
+    args = []
+    for field, delta in deltas.items():
+        if delta:
+            args.extend((field, delta))
+    try:
+        increment_script(keys=[stats_key(media_id), writes_key(media_id)], args=args, client=redis_client)
+    except redis.RedisError as e:
+        # The cached counters can't be trusted anymore, so drop them
+        logger.warning(f"Could not update stats of media {media_id} in Redis: {e}")
+        delete_media_stats(redis_client, media_id)
+
+
+def cancel_media_stats_update(redis_client: redis.Redis, media_ids):
+    """Ends writes started with begin_media_stats_update() that failed to commit."""
+    for media_id in media_ids:
+        increment_media_stats(redis_client, media_id)
+
+
+def rating_deltas(old_factor=None, new_factor=None):
+    """Counter changes for replacing a rating of old_factor with one of new_factor (None for no rating)."""
+    deltas = {"likes": 0, "dislikes": 0}
+    for factor, delta in ((old_factor, -1), (new_factor, 1)):
+        if factor == 1:
+            deltas["likes"] += delta
+        elif factor == -1:
+            deltas["dislikes"] += delta
+    return deltas
+
+
+def delete_media_stats(redis_client: redis.Redis, media_id):
+    try:
+        redis_client.delete(stats_key(media_id))
+    except redis.RedisError:
+        pass
+
+
+def reconcile_media_stats(redis_client: redis.Redis, session, batch_size=1000):
+    """Recomputes the counters of every media from the source tables. Returns the number of media reconciled."""
+    reconciled = 0
+    last_id = 0
+    while True:
+        media_ids = [media_id for media_id, in session.query(Media.IdMedia)
+                                                    .filter(Media.IdMedia > last_id)
+                                                    .order_by(Media.IdMedia).limit(batch_size)]
+        if not media_ids:
+            return reconciled
+        versions = get_stats_versions(redis_client, media_ids)
+        session.rollback()  # Count from a snapshot taken after reading the versions
+        store_media_stats(redis_client, compute_media_stats(session, media_ids), versions, replace=True)
+        session.rollback()  # Don't keep a long transaction (and its snapshot) open between batches
+        reconciled += len(media_ids)
+        last_id = media_ids[-1]
+
+
+if __name__ == "__main__":
+    from .. import app, Session, redis_client
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+    with app.app_context():  # Sessions are scoped to the application context
+        logger.info(f"Reconciled stats of {reconcile_media_stats(redis_client, Session())} media")
+        rebuild_viewer_hlls(redis_client, Session())
+        logger.info("Rebuilt unique viewer counts")
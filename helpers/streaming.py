@@ -0,0 +1,98 @@
+from flask import Flask, Response, stream_with_context
+from .pagination import paginate
+
+STREAM_BATCH_SIZE = 500
+
+STREAM_FORMATS = {
+    'ndjson': 'application/x-ndjson',  # One JSON object per line
+    'json': 'application/json',  # Same body as the non-streamed listing
+}
+
+
+class StreamFormatError(ValueError):
+    """Raised when the client asks for a stream format that is not supported."""
+
+
+def get_stream_format(request):
+    """Returns the format from the 'stream' query parameter, or None for a regular response."""
+    stream_format = request.args.get('stream')
+    if not stream_format:
+        return None
+    if stream_format not in STREAM_FORMATS:
+        raise StreamFormatError(f"Stream must be one of: {', '.join(STREAM_FORMATS)}")
+    return stream_format
+
+
+def iterate_in_batches(query, columns, batch_size=STREAM_BATCH_SIZE, descending=True):
+    """
+    Yields every row of a query, fetching batch_size rows at a time.
+
+    Every batch is a keyset page of its own, so unlike iterate_streamed no cursor or
+    transaction has to stay open between batches: long jobs (like building an
+    index) can end their transaction after each one. Rows of finished batches are
+    not referenced anymore, so memory stays flat.
+    """
+    cursor = None
+    while True:
+        rows, cursor = paginate(query, columns, batch_size, cursor, descending)
+        yield rows
+        if not cursor:
+            return
+
+
+def iterate_streamed(query, columns, batch_size=STREAM_BATCH_SIZE, descending=True):
+    """
+    Yields every row of a column query in batches of batch_size, from one server-side cursor.
+
+    The cursor gets a connection of its own (from the engine the session would read from),
+    since pymysql can't run other queries on a connection while an unbuffered result is
+    open: the session stays free for the queries of each batch, like loading its tags.
+    """
+    statement = query.order_by(*[column.desc() if descending else column.asc() for column in columns]).statement
+    with query.session.get_bind(clause=statement).connect() as connection:
+        result = connection.execution_options(yield_per=batch_size).execute(statement)
+        yield from result.partitions()
+
+
+def stream_query(app: Flask, query, columns, serialize, stream_format, descending=True, batch_size=STREAM_BATCH_SIZE):
+    """
+    Streams all rows of a column query as NDJSON or as a JSON array.
+
+    serialize turns a batch of rows into a list of dicts, so it can load related
+    data (like tags) for the whole batch at once.
+
+    Rows are read from a server-side cursor and every batch is serialized and written
+    as one chunk, so neither the rows nor the JSON text of the whole listing are ever
+    held in memory at once. The request context (and its session) stays alive until
+    the last chunk is sent.
+
+    Status and headers are sent with the first chunk, so an error after it can't become
+    a 500: an NDJSON stream ends with an {"error": ...} line, and a JSON array stream
+    is aborted, so the client sees a failed transfer instead of a valid looking array.
+    """
+    def generate():
+        first = True
+        if stream_format == 'json':
+            yield '['
+        try:
+            for rows in iterate_streamed(query, columns, batch_size, descending):
+                items = [app.json.dumps(item) for item in serialize(rows)]
+                if not items:
+                    continue
+                if stream_format == 'ndjson':
+                    yield '\n'.join(items) + '\n'
+                else:
+                    yield ('' if first else ',') + ','.join(items)
+                first = False
+        except Exception as e:
+            app.logger.exception(f"Error streaming response: {e}")
+            if stream_format == 'json':
+                raise  # The server drops the connection before the end of the chunked body
+            yield app.json.dumps({'error': 'Error streaming response'}) + '\n'
+            return
+        if stream_format == 'json':
+            yield ']'
+
+    return Response(stream_with_context(generate()),
+                    mimetype=STREAM_FORMATS[stream_format],
+                    headers={'X-Accel-Buffering': 'no'})  # Don't let nginx buffer the whole body
@@ -0,0 +1,205 @@
+"""
+Search-as-you-type suggestions kept in Redis.
+
+Media titles, company names and popular past queries are entries of the sorted
+set suggest:lex, all with score 0, so ZRANGEBYLEX returns the entries starting
+with a prefix in O(log n). An entry is the normalized text, a NUL byte, then the
+reference of what it suggests ("media:12", "company:3" or "query:cat videos").
+Every word of a title starts an entry of its own, so "algo" also suggests
+"Introduction to Algorithms".
+
+The displayed text of a reference is kept in the hash suggest:labels and its
+popularity in the sorted set suggest:popularity: total views for media,
+subscribers for companies and number of searches for queries. A query becomes a
+suggestion once it has been searched SUGGEST_QUERY_MIN_COUNT times.
+
+Lookups run as one Lua script and never touch the database. Only the first
+SUGGEST_CANDIDATES entries of a prefix are ranked by popularity, which keeps a
+one-letter prefix as cheap as a long one.
+"""
+import logging
+import re
+import redis
+from redis.commands.core import Script
+from sqlalchemy import func
+from ..database.media import Media
+from ..database.companies import Companies
+from ..database.subscribers import Subscribers
+from .stats import compute_media_stats
+from .search_events import MEDIA, COMPANY
+from .streaming import iterate_in_batches
+
+LEX_KEY = "suggest:lex"
+LABELS_KEY = "suggest:labels"
+POPULARITY_KEY = "suggest:popularity"
+QUERY = "query"
+SUGGEST_CANDIDATES = 200
+SUGGEST_QUERY_MIN_COUNT = 3
+MAX_TEXT_LENGTH = 100  # Longer texts are cut, longer queries are not remembered
+MAX_WORD_ENTRIES = 8  # Words of a title after this one don't start entries
+
+SUGGEST_SCRIPT = """
+local members = redis.call('ZRANGEBYLEX', KEYS[1], ARGV[1], ARGV[2], 'LIMIT', 0, ARGV[3])
+local seen = {}
+local suggestions = {}
+for _, member in ipairs(members) do
+    local separator = string.find(member, '\\0', 1, true)
+    local ref = string.sub(member, separator + 1)
+    if not seen[ref] then
+        seen[ref] = true
+        local label = redis.call('HGET', KEYS[2], ref)
+        if label then
+            table.insert(suggestions, {ref, label, redis.call('ZSCORE', KEYS[3], ref) or '0'})
+        end
+    end
+end
+return suggestions
+"""
+suggest_script = Script(None, SUGGEST_SCRIPT.encode('utf-8'))  # Loaded into Redis on first use, whatever the client
+
+logger = logging.getLogger(__name__)
+
+
+def normalize(text):
+    """Lowercases text and collapses everything but letters and digits into single spaces."""
+    return " ".join(re.findall(r"\w+", (text or "").lower()))[:MAX_TEXT_LENGTH]
+
+
+def make_ref(kind, object_id):
+    return f"{kind}:{object_id}"
+
+
+def entries(text, ref):
+    """Members of suggest:lex for a text: one per word the text can be completed from."""
+    words = normalize(text).split(" ")
+    return [f"{' '.join(words[i:])}\0{ref}" for i in range(min(len(words), MAX_WORD_ENTRIES)) if words[i]]
+
+
+def remove_entries(pipe, ref, label):
+    members = entries(label.decode('utf-8'), ref)
+    if members:
+        pipe.zrem(LEX_KEY, *members)
+
+
+def add_suggestion(pipe, kind, object_id, label):
+    ref = make_ref(kind, object_id)
+    members = entries(label, ref)
+    if members:
+        pipe.zadd(LEX_KEY, dict.fromkeys(members, 0))
+        pipe.hset(LABELS_KEY, ref, label)
+
+
+def update_suggestion(redis_client: redis.Redis, kind, object_id, label):
+    """Adds or renames the suggestion of a media or company. Redis errors are only logged."""
+    ref = make_ref(kind, object_id)
+    try:
+        old_label = redis_client.hget(LABELS_KEY, ref)
+        pipe = redis_client.pipeline()
+        if old_label is not None:
+            remove_entries(pipe, ref, old_label)
+        add_suggestion(pipe, kind, object_id, label)
+        pipe.execute()
+    except redis.RedisError as e:
+        logger.warning(f"Could not update suggestion {ref}: {e}")
+
+
+def remove_suggestions(redis_client: redis.Redis, kind, object_ids):
+    """Removes the suggestions of deleted media or companies. Redis errors are only logged."""
+    refs = [make_ref(kind, object_id) for object_id in object_ids]
+    if not refs:
+        return
+    try:
+        labels = redis_client.hmget(LABELS_KEY, refs)
+        pipe = redis_client.pipeline()
+        for ref, label in zip(refs, labels):
+            if label is not None:
+                remove_entries(pipe, ref, label)
+        pipe.hdel(LABELS_KEY, *refs)
+        pipe.zrem(POPULARITY_KEY, *refs)
+        pipe.execute()
+    except redis.RedisError as e:
+        logger.warning(f"Could not remove suggestions {refs}: {e}")
+
+
+def add_popularity(redis_client: redis.Redis, kind, amounts):
+    """Adds {object id: amount} to the popularity of media or companies. Redis errors are only logged."""
+    try:
+        pipe = redis_client.pipeline(transaction=False)
+        for object_id, amount in amounts.items():
+            pipe.zincrby(POPULARITY_KEY, amount, make_ref(kind, object_id))
+        pipe.execute()
+    except redis.RedisError as e:
+        logger.warning(f"Could not update popularity of {kind} suggestions: {e}")
+
+
+def record_query(redis_client: redis.Redis, text):
+    """Counts a search, and makes it a suggestion once it is popular enough. Redis errors are only logged."""
+    query = normalize(text)
+    if not query or len(text) > MAX_TEXT_LENGTH:
+        return
+    ref = make_ref(QUERY, query)
+    try:
+        count = redis_client.zincrby(POPULARITY_KEY, 1, ref)
+        if count >= SUGGEST_QUERY_MIN_COUNT:
+            pipe = redis_client.pipeline()
+            add_suggestion(pipe, QUERY, query, query)
+            pipe.execute()
+    except redis.RedisError as e:
+        logger.warning(f"Could not record search query: {e}")
+
+
+def suggest(redis_client: redis.Redis, prefix, limit=10):
+    """Returns up to limit suggestions completing the prefix, most popular first."""
+    prefix = normalize(prefix).encode('utf-8')
+    if not prefix:
+        return []
+    # Members are compared as bytes, and no UTF-8 text contains the byte 0xff
+    rows = suggest_script(keys=[LEX_KEY, LABELS_KEY, POPULARITY_KEY],
+                          args=[b"[" + prefix, b"[" + prefix + b"\xff", SUGGEST_CANDIDATES], client=redis_client)
+    suggestions = []
+    for ref, label, popularity in rows:
+        kind, _, object_id = ref.decode('utf-8').partition(":")
+        suggestions.append({
+            "type": kind,
+            "id": int(object_id) if kind != QUERY else None,
+            "text": label.decode('utf-8'),
+            "popularity": float(popularity),
+        })
+    suggestions.sort(key=lambda suggestion: suggestion["popularity"], reverse=True)
+    return suggestions[:limit]
+
+
+def rebuild_suggestions(redis_client: redis.Redis, session, batch_size=1000):
+    """
+    Adds every media and company to the suggestions with its current popularity.
+    Past queries are kept. Removed media and companies are not cleaned up here.
+    """
+    query = session.query(Media.IdMedia, Media.NameV)
+    for rows in iterate_in_batches(query, (Media.IdMedia,), batch_size, descending=False):
+        stats = compute_media_stats(session, [media_id for media_id, _ in rows])
+        pipe = redis_client.pipeline()
+        for media_id, name in rows:
+            add_suggestion(pipe, MEDIA, media_id, name)
+            pipe.zadd(POPULARITY_KEY, {make_ref(MEDIA, media_id): stats[media_id]["views"]})
+        pipe.execute()
+        session.rollback()  # Don't keep a long transaction open between batches
+
+    query = session.query(Companies.IdCompany, Companies.Name)
+    for rows in iterate_in_batches(query, (Companies.IdCompany,), batch_size, descending=False):
+        subscribers = dict(session.query(Subscribers.IdCompany, func.count(Subscribers.IdSubscriber))
+                                  .filter(Subscribers.IdCompany.in_([company_id for company_id, _ in rows]))
+                                  .group_by(Subscribers.IdCompany).all())
+        pipe = redis_client.pipeline()
+        for company_id, name in rows:
+            add_suggestion(pipe, COMPANY, company_id, name)
+            pipe.zadd(POPULARITY_KEY, {make_ref(COMPANY, company_id): subscribers.get(company_id, 0)})
+        pipe.execute()
+        session.rollback()
+
+
+if __name__ == "__main__":
+    from .. import app, Session, redis_client
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+    with app.app_context():  # Sessions are scoped to the application context
+        rebuild_suggestions(redis_client, Session())
+        logger.info("Rebuilt search suggestions")
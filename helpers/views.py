@@ -0,0 +1,218 @@
+"""
+Write-behind buffering of video views.
+
+Opening a video only appends an event to the Redis stream 'views'. The video
+worker reads the stream through a consumer group and writes each batch with one
+upsert (INSERT ... ON DUPLICATE KEY UPDATE on MySQL, ON CONFLICT on SQLite and
+PostgreSQL). Entries are acknowledged only after the batch is committed, so
+every view is written at least once: a batch that fails, or whose worker dies,
+is retried by the next flush. An entry delivered
+MAX_DELIVERIES times without being acknowledged is moved to the stream's
+dead-letter stream ('views:dead') so that it can't block the ones behind it.
+
+Workers use stable consumer names and delete their consumer when they stop, so
+the group doesn't collect one consumer per restart.
+"""
+import datetime
+import logging
+from collections import defaultdict
+import redis
+from sqlalchemy import case
+from sqlalchemy.dialects import mysql, postgresql, sqlite
+from ..database.media import Media
+from ..database.viewHistory import ViewHistory
+from .stats import begin_media_stats_update, increment_media_stats, cancel_media_stats_update
+from .viewers import add_viewer
+from .suggest import add_popularity
+from .search_events import MEDIA
+
+VIEWS_STREAM = "views"
+VIEWS_GROUP = "view-writers"
+CLAIM_IDLE_MS = 60 * 1000  # Entries pending this long belong to a worker that died
+MAX_DELIVERIES = 5  # Entries failing this many times are dead-lettered
+CONSUMER_IDLE_MS = 60 * 60 * 1000  # Consumers idle this long, with nothing pending, belong to a stopped worker
+UPSERT_DIALECTS = {'mysql': mysql.insert, 'postgresql': postgresql.insert, 'sqlite': sqlite.insert}
+
+logger = logging.getLogger(__name__)
+
+
+def record_view(redis_client: redis.Redis, user_id, media_id, company_id, view_time=None):
+    """
+    Queues a view of a media by a user and counts the user as a viewer.
+    Raises redis.RedisError if the event could not be queued.
+    """
+    view_time = view_time or datetime.datetime.now()
+    pipe = redis_client.pipeline(transaction=False)
+    pipe.xadd(VIEWS_STREAM, {"user": user_id, "media": media_id, "time": view_time.isoformat()})
+    add_viewer(pipe, user_id, media_id, company_id, view_time.date())
+    pipe.execute()
+
+
+def ensure_group(redis_client: redis.Redis, stream, group):
+    try:
+        redis_client.xgroup_create(stream, group, id="0", mkstream=True)
+    except redis.ResponseError as e:
+        if "BUSYGROUP" not in str(e):  # Group already exists
+            raise
+
+
+def ensure_views_group(redis_client: redis.Redis):
+    ensure_group(redis_client, VIEWS_STREAM, VIEWS_GROUP)
+
+
+def remove_consumer(redis_client: redis.Redis, stream, group, consumer):
+    """
+    Deletes a stopped worker's consumer from the group. A consumer with pending entries is
+    kept, since deleting it would drop them: another worker claims them, and the consumer
+    is removed later by remove_idle_consumers. Returns whether it was deleted.
+    """
+    if redis_client.xpending_range(stream, group, min="-", max="+", count=1, consumername=consumer):
+        return False
+    redis_client.xgroup_delconsumer(stream, group, consumer)
+    return True
+
+
+def remove_idle_consumers(redis_client: redis.Redis, stream, group, idle_ms=CONSUMER_IDLE_MS):
+    """Deletes the consumers left by workers that were killed, once their pending entries were claimed."""
+    removed = []
+    for consumer in redis_client.xinfo_consumers(stream, group):
+        if consumer["pending"] == 0 and consumer["idle"] >= idle_ms:
+            redis_client.xgroup_delconsumer(stream, group, consumer["name"])
+            removed.append(consumer["name"])
+    return removed
+
+
+def aggregate_views(events):
+    """Merges view events into {(user id, media id): [view count, last view time]}."""
+    views = {}
+    for user_id, media_id, view_time in events:
+        key = (user_id, media_id)
+        if key in views:
+            views[key][0] += 1
+            views[key][1] = max(views[key][1], view_time)
+        else:
+            views[key] = [1, view_time]
+    return views
+
+
+def upsert_views(session, rows):
+    """Builds an upsert of ViewHistory rows adding up view counts, in the dialect of the session's database."""
+    dialect = session.get_bind().dialect.name
+    if dialect not in UPSERT_DIALECTS:
+        raise NotImplementedError(f"No upsert for the {dialect} dialect")
+
+    statement = UPSERT_DIALECTS[dialect](ViewHistory).values(rows)
+    new = statement.inserted if dialect == 'mysql' else statement.excluded
+    values = {
+        "ViewCount": ViewHistory.ViewCount + new.ViewCount,
+        "ViewTime": case((ViewHistory.ViewTime >= new.ViewTime, ViewHistory.ViewTime), else_=new.ViewTime),
+    }
+    if dialect == 'mysql':
+        return statement.on_duplicate_key_update(**values)
+    return statement.on_conflict_do_update(index_elements=[ViewHistory.IdUser, ViewHistory.IdMedia], set_=values)
+
+
+def write_views(session, redis_client: redis.Redis, views):
+    """Upserts aggregated views into ViewHistory in one statement and updates the media counters."""
+    if not views:
+        return
+
+    media_ids = list({media_id for _, media_id in views})
+    existing_media = {media_id for media_id, in session.query(Media.IdMedia).filter(Media.IdMedia.in_(media_ids))}
+    # Views of media deleted in the meantime are dropped, they would fail the whole batch
+    views = {key: value for key, value in views.items() if key[1] in existing_media}
+    if not views:
+        return
+
+    statement = upsert_views(session, [
+        {"IdUser": user_id, "IdMedia": media_id, "ViewCount": count, "ViewTime": view_time}
+        for (user_id, media_id), (count, view_time) in views.items()
+    ])
+    views_per_media = defaultdict(int)
+    for (_, media_id), (count, _) in views.items():
+        views_per_media[media_id] += count
+
+    begin_media_stats_update(redis_client, views_per_media)
+    try:
+        session.execute(statement)
+        session.commit()
+    except Exception:
+        cancel_media_stats_update(redis_client, views_per_media)
+        raise
+    for media_id, count in views_per_media.items():
+        increment_media_stats(redis_client, media_id, views=count)
+    add_popularity(redis_client, MEDIA, views_per_media)
+
+
+def dead_letter_key(stream):
+    return f"{stream}:dead"
+
+
+def dead_letter(redis_client: redis.Redis, stream, group, consumer, entries):
+    """
+    Moves the entries already delivered MAX_DELIVERIES times to the dead-letter stream,
+    acknowledging them. Returns the other entries.
+    """
+    pending = redis_client.xpending_range(stream, group, min=entries[0][0], max=entries[-1][0],
+                                          count=len(entries), consumername=consumer)
+    deliveries = {item["message_id"]: item["times_delivered"] for item in pending}
+    dead = [(entry_id, fields) for entry_id, fields in entries if deliveries.get(entry_id, 0) > MAX_DELIVERIES]
+    if not dead:
+        return entries
+
+    pipe = redis_client.pipeline()
+    for entry_id, fields in dead:
+        logger.error(f"Dead-lettering {stream} entry {entry_id} after {deliveries[entry_id]} deliveries: {fields}")
+        pipe.xadd(dead_letter_key(stream), dict(fields or {}, id=entry_id))
+    dead_ids = {entry_id for entry_id, _ in dead}
+    pipe.xack(stream, group, *dead_ids)
+    pipe.xdel(stream, *dead_ids)
+    pipe.execute()
+    return [entry for entry in entries if entry[0] not in dead_ids]
+
+
+def read_batch(redis_client: redis.Redis, stream, group, consumer, batch_size):
+    """
+    Returns the next batch of stream entries for this consumer, retrying unacknowledged ones first.
+    Entries that were retried too often are dead-lettered instead of returned.
+    """
+    while True:
+        # Our own entries from a flush that failed
+        entries = redis_client.xreadgroup(group, consumer, {stream: "0"}, count=batch_size)
+        entries = entries[0][1] if entries else []
+        if not entries:
+            # Entries left behind by a worker that died
+            _, entries, *_ = redis_client.xautoclaim(stream, group, consumer, CLAIM_IDLE_MS,
+                                                     start_id="0-0", count=batch_size)
+        if not entries:
+            break
+        entries = dead_letter(redis_client, stream, group, consumer, entries)
+        if entries:
+            return entries
+
+    entries = redis_client.xreadgroup(group, consumer, {stream: ">"}, count=batch_size)
+    return entries[0][1] if entries else []
+
+
+def flush_views(redis_client: redis.Redis, session, consumer, batch_size=500):
+    """Writes one batch of queued views to the database. Returns the number of events processed."""
+    entries = read_batch(redis_client, VIEWS_STREAM, VIEWS_GROUP, consumer, batch_size)
+    if not entries:
+        return 0
+
+    events = []
+    for entry_id, fields in entries:
+        if not fields:  # Deleted from the stream after it was delivered
+            continue
+        try:
+            events.append((int(fields[b"user"]), int(fields[b"media"]),
+                           datetime.datetime.fromisoformat(fields[b"time"].decode('utf-8'))))
+        except (KeyError, ValueError) as e:
+            logger.error(f"Dropping malformed view event {entry_id}: {e}")
+
+    write_views(session, redis_client, aggregate_views(events))
+
+    entry_ids = [entry_id for entry_id, _ in entries]
+    redis_client.xack(VIEWS_STREAM, VIEWS_GROUP, *entry_ids)
+    redis_client.xdel(VIEWS_STREAM, *entry_ids)
+    return len(entries)
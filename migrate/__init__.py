@@ -0,0 +1,23 @@
+#!/usr/bin/env python3
+from dotenv import load_dotenv
+from sqlalchemy import create_engine
+from sqlalchemy.orm import declarative_base
+import os
+
+load_dotenv()
+
+# Only the models and an engine: running the migrations doesn't start a gateway,
+# so it needs neither Redis nor Flask, and the user gateway's bcrypt calibration doesn't run
+db_user = os.getenv("DB_USER")
+db_password = os.getenv("DB_PASSWORD")
+db_host = os.getenv("DB_HOST")
+db_name = os.getenv("DB_NAME")
+
+DATABASE_URL = f"mysql+pymysql://{db_user}:{db_password}@{db_host}/{db_name}"
+engine = create_engine(DATABASE_URL, pool_pre_ping=True)
+Base = declarative_base()
+
+from .database import accessLevels, comments, companies, \
+    media, mediaTagsConnector, ratings, ratingTypes, searchHistory, \
+    subscribers, tags, userRoles, users, viewHistory, mediaPreview, \
+    logos, reports, schemaVersion
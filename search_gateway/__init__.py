@@ -3,9 +3,9 @@ from flask import Flask
 from flasgger import Swagger
 import redis
 from dotenv import load_dotenv
-from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker, declarative_base
+from sqlalchemy.orm import declarative_base
 import os
+from .helpers.sessions import create_engines, create_request_session, register_pool_route
 
 load_dotenv()
 
@@ -48,22 +48,18 @@ redis_db = int(os.getenv("REDIS_DB") or 0)
 
 redis_client = redis.Redis(host=redis_host, port=redis_port, db=redis_db, username=redis_username, password=redis_password)
 
-# Database connection
-db_user = os.getenv("DB_USER")
-db_password = os.getenv("DB_PASSWORD")
-db_host = os.getenv("DB_HOST")
-db_name = os.getenv("DB_NAME")
+# Database connection pools (DB_POOL_*) and optional read replicas (DB_REPLICA_*)
+engine, replica_router = create_engines(app, redis_client)
 
-DATABASE_URL = f"mysql+pymysql://{db_user}:{db_password}@{db_host}/{db_name}"
-engine = create_engine(DATABASE_URL)
-Session = sessionmaker(bind=engine)
+# One session per request, connection is returned on app context teardown
+Session = create_request_session(app, engine, replica_router)
 Base = declarative_base()
 
 from .database import accessLevels, comments, companies, \
     media, mediaTagsConnector, ratings, ratingTypes, searchHistory, \
     subscribers, tags, userRoles, users, viewHistory, mediaPreview, \
-    logos, reports
-Base.metadata.create_all(engine)
+    logos, reports, schemaVersion
+# Schema is created and migrated by database.migrations, once per deploy
 
 # Configuration for uploads
 # UPLOAD_FOLDER = 'uploads'  # Directory to store uploaded files
@@ -85,6 +81,32 @@ ALLOWED_EXTENSIONS = ALLOWED_VIDEO_EXTENSIONS.union(ALLOWED_AUDIO_EXTENSIONS)  #
 # os.makedirs(LOGO_FOLDER, exist_ok=True)  # Create the logo directory if it doesn't exist
 # app.config['MAX_CONTENT_LENGTH'] = None  # Disable limit in Flask
 
+# Every worker keeps an in-memory index of media and companies, see search/index.py
+app.config['SEARCH_INDEX_ENABLED'] = (os.getenv("SEARCH_INDEX_ENABLED") or "true").lower() == "true"
+app.config['SEARCH_INDEX_REBUILD_INTERVAL'] = int(os.getenv("SEARCH_INDEX_REBUILD_INTERVAL") or 3600)  # Seconds
+# Typo tolerance: minimum trigram similarity (0-1) and how many names a fuzzy query may score
+app.config['SEARCH_FUZZY_CUTOFF'] = float(os.getenv("SEARCH_FUZZY_CUTOFF") or 0.3)
+app.config['SEARCH_FUZZY_MAX_CANDIDATES'] = int(os.getenv("SEARCH_FUZZY_MAX_CANDIDATES") or 1000)
+# Ranking of indexed results, see search/scoring.py. Half life in days, refresh interval in seconds
+app.config['SEARCH_SCORE_WEIGHTS'] = (os.getenv("SEARCH_SCORE_WEIGHTS")
+                                     or "relevance=1,recency=0.2,popularity=0.3,tags=0.5")
+app.config['SEARCH_RECENCY_HALF_LIFE_DAYS'] = float(os.getenv("SEARCH_RECENCY_HALF_LIFE_DAYS") or 30)
+app.config['SEARCH_POPULARITY_REFRESH_INTERVAL'] = int(os.getenv("SEARCH_POPULARITY_REFRESH_INTERVAL") or 300)
+# Seconds a page of search results is cached in Redis, 0 disables the cache, see search/cache.py
+app.config['SEARCH_CACHE_TTL'] = int(os.getenv("SEARCH_CACHE_TTL") or 300)
+# Users, media and companies can be searched concurrently, see search/fanout.py. Off by default:
+# it only pays off when statements wait on the network (measure with benchmarks/fanout.py --latency-ms)
+app.config['SEARCH_FANOUT_ENABLED'] = (os.getenv("SEARCH_FANOUT_ENABLED") or "false").lower() == "true"
+app.config['SEARCH_FANOUT_WORKERS'] = int(os.getenv("SEARCH_FANOUT_WORKERS") or 4)
+app.config['SEARCH_FANOUT_TIMEOUT'] = float(os.getenv("SEARCH_FANOUT_TIMEOUT") or 2.0)  # Seconds per search
+# Search history lives in Redis and is written behind to MySQL by search/worker.py
+app.config['SEARCH_HISTORY_PERSIST'] = (os.getenv("SEARCH_HISTORY_PERSIST") or "true").lower() == "true"
+app.config['SEARCH_HISTORY_FLUSH_INTERVAL'] = float(os.getenv("SEARCH_HISTORY_FLUSH_INTERVAL") or 2)  # Seconds
+app.config['SEARCH_HISTORY_FLUSH_BATCH_SIZE'] = int(os.getenv("SEARCH_HISTORY_FLUSH_BATCH_SIZE") or 500)
+
 @app.route("/")
 def home():
     return "<h1>Hello World from search routes!</h1>"
+
+
+register_pool_route(app, engine, replica_router)
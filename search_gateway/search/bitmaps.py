@@ -0,0 +1,119 @@
+"""
+Compressed bitmaps of media ids, for tag filters.
+
+Like a Roaring bitmap, a Bitmap splits ids into chunks of 65536 by their high
+bits and only keeps the chunks that have members. A chunk is a Python int used
+as a bit set, so AND, OR and AND NOT run chunk by chunk as big-integer operations
+in C: combining tags that cover a million media takes a few milliseconds, and a
+tag costs at most 8 KB per chunk it has media in.
+
+Changing one bit copies its chunk, which is fine for the media of a change event.
+Build large bitmaps at once with Bitmap.of().
+"""
+import sys
+from functools import reduce
+from typing import NamedTuple, Tuple
+
+CHUNK_BITS = 16
+CHUNK_BYTES = (1 << CHUNK_BITS) // 8
+LOW_MASK = (1 << CHUNK_BITS) - 1
+
+
+class Bitmap:
+    __slots__ = ("chunks",)
+
+    def __init__(self, chunks=None):
+        self.chunks = chunks if chunks is not None else {}  # high bits -> int whose set bits are the low bits
+
+    @classmethod
+    def of(cls, ids):
+        """Builds a bitmap from any number of ids in one pass."""
+        buffers = {}
+        for value in ids:
+            high, low = value >> CHUNK_BITS, value & LOW_MASK
+            buffer = buffers.get(high)
+            if buffer is None:
+                buffer = buffers[high] = bytearray(CHUNK_BYTES)
+            buffer[low >> 3] |= 1 << (low & 7)
+        return cls({high: int.from_bytes(buffer, "little") for high, buffer in buffers.items()})
+
+    def add(self, value):
+        high = value >> CHUNK_BITS
+        self.chunks[high] = self.chunks.get(high, 0) | (1 << (value & LOW_MASK))
+
+    def discard(self, value):
+        high = value >> CHUNK_BITS
+        bits = self.chunks.get(high, 0) & ~(1 << (value & LOW_MASK))
+        if bits:
+            self.chunks[high] = bits
+        else:
+            self.chunks.pop(high, None)
+
+    def __contains__(self, value):
+        return (self.chunks.get(value >> CHUNK_BITS, 0) >> (value & LOW_MASK)) & 1 == 1
+
+    def __and__(self, other):
+        smaller, larger = sorted((self.chunks, other.chunks), key=len)
+        chunks = {}
+        for high, bits in smaller.items():
+            common = bits & larger.get(high, 0)
+            if common:
+                chunks[high] = common
+        return Bitmap(chunks)
+
+    def __or__(self, other):
+        chunks = dict(self.chunks)
+        for high, bits in other.chunks.items():
+            chunks[high] = chunks.get(high, 0) | bits
+        return Bitmap(chunks)
+
+    def __sub__(self, other):
+        chunks = {}
+        for high, bits in self.chunks.items():
+            rest = bits & ~other.chunks.get(high, 0)
+            if rest:
+                chunks[high] = rest
+        return Bitmap(chunks)
+
+    def __len__(self):
+        return sum(bits.bit_count() for bits in self.chunks.values())
+
+    def __bool__(self):
+        return bool(self.chunks)
+
+    def __iter__(self):
+        """Yields the ids in ascending order."""
+        for high in sorted(self.chunks):
+            bits, base = self.chunks[high], high << CHUNK_BITS
+            while bits:
+                lowest = bits & -bits
+                yield base + lowest.bit_length() - 1
+                bits ^= lowest
+
+    def memory_usage(self):
+        return sys.getsizeof(self.chunks) + sum(sys.getsizeof(bits) for bits in self.chunks.values())
+
+
+class TagFilter(NamedTuple):
+    """Media having any (or all) of tag_ids and none of exclude_ids. Empty tuples don't filter."""
+    tag_ids: Tuple[int, ...] = ()
+    match_all: bool = False
+    exclude_ids: Tuple[int, ...] = ()
+
+    @classmethod
+    def of(cls, tag_ids=(), match_all=False, exclude_ids=()):
+        return cls(tuple(sorted(set(tag_ids))), match_all, tuple(sorted(set(exclude_ids))))
+
+    def apply(self, candidates: Bitmap, tag_bitmaps):
+        """Returns the candidates passing the filter, given the bitmap of the media of every tag."""
+        empty = Bitmap()
+        if self.tag_ids:
+            bitmaps = [tag_bitmaps.get(tag_id, empty) for tag_id in self.tag_ids]
+            if self.match_all:
+                # Smallest first, so every step handles as few chunks as possible
+                candidates = reduce(Bitmap.__and__, sorted(bitmaps, key=lambda bitmap: len(bitmap.chunks)), candidates)
+            else:
+                candidates = candidates & reduce(Bitmap.__or__, bitmaps)
+        for tag_id in self.exclude_ids:
+            candidates = candidates - tag_bitmaps.get(tag_id, empty)
+        return candidates
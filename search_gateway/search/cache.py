@@ -0,0 +1,149 @@
+"""
+Redis cache of search result pages.
+
+A page of one result type is cached under a fingerprint of everything it depends
+on: the type, the search text (trimmed and lowercased, every search path ignores
+case), the tag filter for media, the limit, the cursor and the fuzzy option. Only the
+ids and the next cursor are kept. Cards are loaded again on every hit, so names are
+current and fields that depend on the user can be added to them.
+
+Entries are never deleted. The generation of the type the page is made of
+(helpers/search_events.py) is part of the key, so a single write makes every page
+of its type unreachable at once, and the stale entries expire SEARCH_CACHE_TTL
+seconds after they were stored. A page the in-memory index answered is only
+stored once the index has applied the writes of that generation, so a change event
+still on its way to this worker can't be cached as current.
+
+Hits, misses and the time taken to answer each are counted for all workers in the
+hash search:cache:stats.
+"""
+import hashlib
+import json
+import logging
+import time
+import redis
+from ..helpers.search_events import MEDIA, COMPANY, USER, get_generations
+
+STATS_KEY = "search:cache:stats"
+# Result type -> type of the change events that invalidate it
+EVENT_TYPES = {"user": USER, "video": MEDIA, "audio": MEDIA, "company": COMPANY}
+
+logger = logging.getLogger(__name__)
+
+
+def fingerprint(result_type, text, tag_filter, limit, cursor, fuzzy):
+    tags = list(tag_filter) if EVENT_TYPES[result_type] == MEDIA else []  # A TagFilter has its ids sorted
+    parameters = [result_type, (text or "").strip().lower(), tags, limit, cursor, fuzzy]
+    return hashlib.sha1(json.dumps(parameters).encode('utf-8')).hexdigest()
+
+
+class SearchCache:
+    def __init__(self, redis_client: redis.Redis, ttl):
+        self.redis_client = redis_client
+        self.ttl = ttl  # Seconds, 0 disables the cache
+
+    def get_generations(self):
+        """Returns the current generations, or None if the cache is disabled or Redis is unavailable."""
+        if not self.ttl:
+            return None
+        try:
+            return get_generations(self.redis_client)
+        except redis.RedisError as e:
+            logger.warning(f"Search cache unavailable: {e}")
+            return None
+
+    def key(self, result_type, generations, page_fingerprint):
+        return f"search:cache:{result_type}:{generations[EVENT_TYPES[result_type]]}:{page_fingerprint}"
+
+    def get_many(self, keys):
+        """Returns the (ids, next cursor) stored under each key, None for those not stored."""
+        try:
+            values = self.redis_client.mget(keys)
+        except redis.RedisError as e:
+            logger.warning(f"Could not read search cache: {e}")
+            return [None] * len(keys)
+        entries = []
+        for value in values:
+            entry = json.loads(value) if value is not None else None
+            entries.append((entry["ids"], entry["next_cursor"]) if entry else None)
+        return entries
+
+    def set(self, key, ids, next_cursor):
+        try:
+            self.redis_client.set(key, json.dumps({"ids": ids, "next_cursor": next_cursor}), ex=self.ttl)
+        except redis.RedisError as e:
+            logger.warning(f"Could not write search cache: {e}")
+
+    def record(self, timings):
+        """Counts hits and misses, given as (hit, seconds taken to answer) pairs."""
+        try:
+            pipe = self.redis_client.pipeline(transaction=False)
+            for hit, seconds in timings:
+                outcome = "hits" if hit else "misses"
+                pipe.hincrby(STATS_KEY, outcome, 1)
+                pipe.hincrbyfloat(STATS_KEY, f"{outcome}_seconds", seconds)
+            pipe.execute()
+        except redis.RedisError as e:
+            logger.warning(f"Could not record search cache statistics: {e}")
+
+    def get_stats(self):
+        stats = {field.decode('utf-8'): float(value)
+                 for field, value in self.redis_client.hgetall(STATS_KEY).items()}
+        hits, misses = int(stats.get("hits", 0)), int(stats.get("misses", 0))
+        average_hit = stats.get("hits_seconds", 0) / hits if hits else None
+        average_miss = stats.get("misses_seconds", 0) / misses if misses else None
+        saved = average_miss - average_hit if hits and misses else None
+        return {
+            "enabled": bool(self.ttl),
+            "ttl": self.ttl,
+            "hits": hits,
+            "misses": misses,
+            "hit_ratio": round(hits / (hits + misses), 4) if hits + misses else None,
+            "average_hit_ms": round(1000 * average_hit, 3) if average_hit is not None else None,
+            "average_miss_ms": round(1000 * average_miss, 3) if average_miss is not None else None,
+            # Estimated from the averages: what the hits would have cost as misses
+            "saved_ms_per_hit": round(1000 * saved, 3) if saved is not None else None,
+            "saved_seconds": round(hits * saved, 3) if saved is not None else None,
+        }
+
+    def cached_pages(self, generations, fingerprints, load_cards, search, is_current):
+        """
+        Returns {result type: (cards, next cursor)} for the result types of fingerprints, from the cache when possible.
+
+        load_cards(result type, ids) returns the cards of cached ids. search(result types)
+        computes the pages that were not cached, in one go, as {result type: (cards, next
+        cursor, answered by the index)}. is_current(event type, generation) tells whether the
+        index has applied the writes of a generation.
+        """
+        if not fingerprints:
+            return {}
+        if generations is None:
+            return {result_type: (cards, next_cursor) for result_type, (cards, next_cursor, _)
+                    in search(list(fingerprints)).items()}
+
+        started = time.perf_counter()
+        keys = {result_type: self.key(result_type, generations, page_fingerprint)
+                for result_type, page_fingerprint in fingerprints.items()}
+        entries = dict(zip(keys, self.get_many(list(keys.values()))))
+        lookup_seconds = (time.perf_counter() - started) / max(len(keys), 1)
+
+        pages, timings = {}, []
+        for result_type, entry in entries.items():
+            if entry is not None:
+                started = time.perf_counter()
+                ids, next_cursor = entry
+                pages[result_type] = load_cards(result_type, ids), next_cursor
+                timings.append((True, lookup_seconds + time.perf_counter() - started))
+
+        missed = [result_type for result_type, entry in entries.items() if entry is None]
+        if missed:
+            started = time.perf_counter()
+            for result_type, (cards, next_cursor, from_index) in search(missed).items():
+                pages[result_type] = cards, next_cursor
+                event_type = EVENT_TYPES[result_type]
+                if not from_index or is_current(event_type, generations[event_type]):
+                    self.set(keys[result_type], [card[0] for card in cards], next_cursor)  # Cards start with their id
+            search_seconds = (time.perf_counter() - started) / len(missed)
+            timings += [(False, lookup_seconds + search_seconds)] * len(missed)
+        self.record(timings)
+        return pages
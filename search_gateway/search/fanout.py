@@ -0,0 +1,93 @@
+"""
+Concurrent execution of the independent per-type searches of /search.
+
+Searching users, media and companies one after another on the request's
+connection makes a search as slow as the sum of its parts. With fan-out, each
+part runs on a thread of a small per-worker pool, in an application context of
+its own, so it gets its own session and pooled connection (or replica, for
+read-only requests). A search therefore needs up to one connection per part on
+top of the request's: size DB_POOL_SIZE and DB_POOL_MAX_OVERFLOW for it.
+
+Parts still running after SEARCH_FANOUT_TIMEOUT seconds are left out of the
+response, which is flagged as partial. A thread can't be interrupted, so MySQL
+is also told to stop the statements of a part at that time (max_execution_time),
+which frees the thread and its connection for the next search. The limit is set
+on a connection the part holds until it has been reset, so it never reaches
+another request through the pool.
+"""
+import logging
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait
+from flask import Flask
+from sqlalchemy import text
+from sqlalchemy.orm import Session as BaseSession
+
+logger = logging.getLogger(__name__)
+
+
+class FanOut:
+    def __init__(self, app: Flask, session_factory, workers=4, timeout=2.0, enabled=True):
+        self.app = app
+        self.Session = session_factory
+        self.workers = workers
+        self.timeout = timeout  # Seconds
+        self.enabled = enabled
+        self.lock = threading.Lock()
+        self.executor = None
+        self.pid = None
+
+    def get_executor(self):
+        """Returns the thread pool of this process, creating it after a fork."""
+        with self.lock:
+            if self.pid != os.getpid():
+                self.pid = os.getpid()  # Threads don't survive a fork, so a forked worker needs its own pool
+                self.executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="search-fanout")
+            return self.executor
+
+    def call(self, task, read_only):
+        with self.app.app_context():  # Sessions are scoped to the application context
+            session = self.Session()
+            session.info['read_only'] = read_only
+            engine = session.get_bind()  # The replica of a read-only request
+            if engine.dialect.name != "mysql":
+                return task(session)
+
+            # A session would return its connection to the pool on rollback, before the reset
+            with engine.connect() as connection:
+                connection.execute(text("SET SESSION max_execution_time = :ms"), {"ms": int(self.timeout * 1000)})
+                try:
+                    with BaseSession(bind=connection) as part_session:
+                        return task(part_session)
+                finally:
+                    connection.rollback()  # A statement stopped by the time limit leaves the transaction failed
+                    connection.execute(text("SET SESSION max_execution_time = DEFAULT"))
+
+    def run(self, tasks, session):
+        """
+        Runs tasks, {name: function(session) returning a dict}, and merges the dicts they return.
+
+        Returns the merged dict and the names of the tasks that timed out. Errors of a task
+        are raised. With fan-out disabled, or a single task, tasks run one after another on
+        the request's session without a time limit.
+        """
+        results = {}
+        if not self.enabled or len(tasks) < 2:
+            for task in tasks.values():
+                results.update(task(session))
+            return results, []
+
+        read_only = session.info.get('read_only', False)
+        executor = self.get_executor()
+        futures = {name: executor.submit(self.call, task, read_only) for name, task in tasks.items()}
+        done, _ = wait(futures.values(), timeout=self.timeout)
+        timed_out = []
+        for name, future in futures.items():
+            if future in done:
+                results.update(future.result())
+            else:
+                future.cancel()  # Only stops it if it hasn't started yet
+                timed_out.append(name)
+        if timed_out:
+            logger.warning(f"Search timed out after {self.timeout} s for: {', '.join(timed_out)}")
+        return results, timed_out
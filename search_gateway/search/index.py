@@ -0,0 +1,589 @@
+"""
+In-memory inverted index of media and companies, and trigram index of names.
+
+Every gunicorn worker of the search gateway keeps its own copy, so /search can
+answer text queries about media and companies without MySQL. The index is built
+with a bulk scan when the worker serves its first search, then kept current by the
+change events of helpers/search_events.py, and rebuilt from scratch every
+SEARCH_INDEX_REBUILD_INTERVAL seconds to recover events missed while Redis was
+unreachable. Until the first build is done, searches go to MySQL.
+
+Terms are interned and numbered. The posting list of a term is two arrays, the
+sorted ids of the documents containing it and how often they do, so a document
+costs a few bytes per distinct term instead of a Python object per posting.
+Documents match when they contain every word of the query. Their tf-idf score is
+combined with recency, popularity and tag overlap (search/scoring.py), and only
+the best limit + 1 of a query are selected, with a heap rather than by sorting
+every match. Tag filters (any, all or none of a set of tags) and the media type
+are bitmaps of media ids (search/bitmaps.py), combined before the text matches are
+checked against them.
+
+Queries that match nothing fall back to the trigram indexes of media titles,
+company names and user display names, so mistyped names are still found. Names
+are ranked by the Dice coefficient of their trigram set and the query's, and
+only those at or above SEARCH_FUZZY_CUTOFF are returned. The rarest query
+trigrams pick at most SEARCH_FUZZY_MAX_CANDIDATES candidates, so the cost of a
+fuzzy query depends on that cap rather than on the number of names.
+
+The index remembers the highest generation of each event type it has applied (or
+read before a build), so the result cache can tell whether a page the index
+answered already reflects the latest writes.
+"""
+import datetime
+import heapq
+import logging
+import math
+import os
+import re
+import sys
+import threading
+import time
+from array import array
+from bisect import bisect_left
+from collections import Counter, defaultdict
+from typing import NamedTuple, FrozenSet, Optional
+import redis
+from flask import Flask
+from ..helpers.cards import (MediaCard, CompanyCard, UserCard, media_card_query, company_card_query, user_card_query,
+                             load_media_tags, make_card)
+from ..helpers.pagination import encode_cursor, decode_cursor_values, PaginationError
+from ..helpers.search_events import (SEARCH_EVENTS_CHANNEL, MEDIA, COMPANY, USER, EVENT_TYPES, parse_search_event,
+                                     get_generations)
+from ..helpers.streaming import iterate_in_batches
+from ..helpers.suggest import POPULARITY_KEY, make_ref
+from .scoring import Scorer, parse_weights, DEFAULT_WEIGHTS
+from .bitmaps import Bitmap, TagFilter
+from ..database.media import Media
+from ..database.companies import Companies
+from ..database.users import Users
+
+WORD_PATTERN = re.compile(r"\w+")
+MAX_FREQUENCY = 2 ** 16 - 1  # Frequencies are stored as unsigned shorts
+SCORE_DECIMALS = 6
+BUILD_BATCH_SIZE = 2000
+RETRY_DELAY = 5  # Seconds before subscribing again after an error
+
+logger = logging.getLogger(__name__)
+
+
+def tokenize(*texts):
+    """Splits texts into lowercase words."""
+    return [word for text in texts if text for word in WORD_PATTERN.findall(text.lower())]
+
+
+def trigrams(text):
+    """Trigrams of every word of a text, padded like pg_trgm so word starts weigh more than word ends."""
+    grams = set()
+    for word in tokenize(text):
+        padded = f"  {word} "
+        grams.update(padded[i:i + 3] for i in range(len(padded) - 2))
+    return grams
+
+
+def display_name(card: UserCard):
+    return " ".join(part for part in (card.NameUser, card.Surname) if part)
+
+
+class MediaDocument(NamedTuple):
+    card: MediaCard  # CompanyName is left empty, it is looked up when serving so renames apply at once
+    tag_ids: FrozenSet[int]
+    media_type: Optional[str]  # "video", "audio" or None for other files
+
+
+class InvertedIndex:
+    def __init__(self):
+        self.term_ids = {}  # term -> term id
+        self.postings = []  # term id -> (array of sorted document ids, array of frequencies)
+        self.documents = {}  # document id -> array of its term ids, to remove it again
+
+    def __len__(self):
+        return len(self.documents)
+
+    def add(self, document_id, words):
+        """Indexes a document, replacing its previous version. Adding ids in ascending order is fastest."""
+        self.remove(document_id)
+        term_ids = array('I')
+        for word, frequency in Counter(words).items():
+            term_id = self.term_ids.get(word)
+            if term_id is None:
+                term_id = len(self.postings)
+                self.term_ids[sys.intern(word)] = term_id
+                self.postings.append((array('I'), array('H')))
+            document_ids, frequencies = self.postings[term_id]
+            position = bisect_left(document_ids, document_id)
+            document_ids.insert(position, document_id)
+            frequencies.insert(position, min(frequency, MAX_FREQUENCY))
+            term_ids.append(term_id)
+        self.documents[document_id] = term_ids
+
+    def remove(self, document_id):
+        term_ids = self.documents.pop(document_id, None)
+        if term_ids is None:
+            return
+        for term_id in term_ids:
+            document_ids, frequencies = self.postings[term_id]
+            position = bisect_left(document_ids, document_id)
+            if position < len(document_ids) and document_ids[position] == document_id:
+                del document_ids[position]
+                del frequencies[position]
+
+    def search(self, words):
+        """Returns {document id: score} of the documents containing every word."""
+        posting_lists = []
+        for word in dict.fromkeys(words):
+            term_id = self.term_ids.get(word)
+            if term_id is None or not self.postings[term_id][0]:
+                return {}
+            posting_lists.append(self.postings[term_id])
+        if not posting_lists:
+            return {}
+
+        # Start from the rarest term and look the candidates up in the longer lists
+        posting_lists.sort(key=lambda posting: len(posting[0]))
+        document_count = len(self.documents)
+        document_ids, frequencies = posting_lists[0]
+        idf = math.log(1 + document_count / len(document_ids))
+        scores = {document_id: frequency * idf for document_id, frequency in zip(document_ids, frequencies)}
+        for document_ids, frequencies in posting_lists[1:]:
+            idf = math.log(1 + document_count / len(document_ids))
+            matched = {}
+            for document_id, score in scores.items():
+                position = bisect_left(document_ids, document_id)
+                if position < len(document_ids) and document_ids[position] == document_id:
+                    matched[document_id] = score + frequencies[position] * idf
+            scores = matched
+            if not scores:
+                break
+        return {document_id: round(score, SCORE_DECIMALS) for document_id, score in scores.items()}
+
+    def memory_usage(self):
+        """Approximate size in bytes of the terms, posting lists and document term lists."""
+        size = sys.getsizeof(self.term_ids) + sys.getsizeof(self.postings) + sys.getsizeof(self.documents)
+        size += sum(sys.getsizeof(term) for term in self.term_ids)
+        size += sum(sys.getsizeof(ids) + sys.getsizeof(frequencies) for ids, frequencies in self.postings)
+        size += sum(sys.getsizeof(term_ids) for term_ids in self.documents.values())
+        return size
+
+
+class TrigramIndex(InvertedIndex):
+    """Inverted index whose terms are the trigrams of a name, see trigrams()."""
+
+    def add_name(self, document_id, name):
+        self.add(document_id, trigrams(name))
+
+    def similar(self, text, cutoff, max_candidates):
+        """Returns {document id: Dice coefficient} of the names at least cutoff similar to the text."""
+        query = trigrams(text)
+        posting_lists = sorted((self.postings[self.term_ids[gram]][0] for gram in query if gram in self.term_ids),
+                               key=len)
+        shared = Counter()
+        for document_ids in posting_lists:
+            room = max_candidates - len(shared)
+            if len(document_ids) <= room:
+                shared.update(document_ids)
+                continue
+            # Too common to scan: count it for the candidates found so far, and fill the remaining room
+            for document_id in list(shared):
+                position = bisect_left(document_ids, document_id)
+                if position < len(document_ids) and document_ids[position] == document_id:
+                    shared[document_id] += 1
+            for document_id in document_ids:
+                if room <= 0:
+                    break
+                if document_id not in shared:
+                    shared[document_id] = 1
+                    room -= 1
+
+        scores = {}
+        for document_id, count in shared.items():
+            score = 2 * count / (len(query) + len(self.documents[document_id]))
+            if score >= cutoff:
+                scores[document_id] = round(score, SCORE_DECIMALS)
+        return scores
+
+
+def page(scores, limit, cursor):
+    """
+    Returns one page of document ids ordered by score then id, both descending, and the next cursor.
+    A heap keeps only the limit + 1 best candidates, so a page costs O(n log limit) instead of a full sort.
+    """
+    candidates = ((score, document_id) for document_id, score in scores.items())
+    if cursor:
+        last_score, last_id = decode_cursor_values(cursor, 2)
+        if not isinstance(last_score, (int, float)) or not isinstance(last_id, int):
+            raise PaginationError("Invalid cursor")
+        candidates = (candidate for candidate in candidates if candidate < (last_score, last_id))
+    ranked = heapq.nlargest(limit + 1, candidates)
+
+    next_cursor = None
+    if len(ranked) > limit:
+        ranked = ranked[:limit]
+        next_cursor = encode_cursor(list(ranked[-1]))
+    return [document_id for _, document_id in ranked], next_cursor
+
+
+class SearchIndex:
+    def __init__(self, app: Flask, session_factory, redis_client: redis.Redis, video_extensions, audio_extensions,
+                 rebuild_interval=3600, enabled=True, fuzzy_cutoff=0.3, max_candidates=1000, scorer=None,
+                 popularity_interval=300):
+        self.app = app
+        self.Session = session_factory
+        self.redis_client = redis_client
+        self.video_extensions = video_extensions
+        self.audio_extensions = audio_extensions
+        self.rebuild_interval = rebuild_interval
+        self.enabled = enabled
+        self.fuzzy_cutoff = fuzzy_cutoff
+        self.max_candidates = max_candidates
+        self.scorer = scorer or Scorer(parse_weights(DEFAULT_WEIGHTS))
+        self.popularity_interval = popularity_interval
+
+        self.lock = threading.Lock()  # Held while reading or changing the structures below
+        self.media_index = InvertedIndex()
+        self.media = {}  # IdMedia -> MediaDocument
+        self.media_names = TrigramIndex()
+        self.tag_bitmaps = {}  # IdTag -> Bitmap of its media
+        self.type_bitmaps = {}  # "video" or "audio" -> Bitmap of those media
+        self.company_index = InvertedIndex()
+        self.company_names = TrigramIndex()
+        self.companies = {}  # IdCompany -> CompanyCard
+        self.user_names = TrigramIndex()
+        self.users = {}  # IdUser -> UserCard, active users only
+        self.generations = dict.fromkeys(EVENT_TYPES, 0)  # Event type -> highest generation applied
+        # IdMedia or IdCompany -> part of the score that doesn't depend on the query, see search/scoring.py
+        self.media_priors = {}
+        self.company_priors = {}
+        self.max_popularity = {MEDIA: 0.0, COMPANY: 0.0}
+        self.scored_at = datetime.datetime.now()  # Recency is measured from this time
+        self.ready = False
+
+        self.thread = None
+        self.pid = None
+        self.stats = {"build_seconds": None, "built_at": None, "scored_at": None, "memory_bytes": None,
+                      "events_applied": 0, "queries": 0, "query_seconds": 0.0}
+
+    def start(self):
+        """Starts building and maintaining the index in the background, once per process."""
+        if not self.enabled or (self.thread and self.pid == os.getpid()):
+            return
+        with self.lock:
+            if self.thread and self.pid == os.getpid():
+                return
+            self.pid = os.getpid()  # A forked worker needs its own thread, threads don't survive a fork
+            self.thread = threading.Thread(target=self.run, name="search-index", daemon=True)
+            self.thread.start()
+
+    def run(self):
+        while True:
+            pubsub = self.redis_client.pubsub(ignore_subscribe_messages=True)
+            try:
+                # Subscribe before building, so changes made during the build are applied after it
+                pubsub.subscribe(SEARCH_EVENTS_CHANNEL)
+                self.build()
+                next_build = time.monotonic() + self.rebuild_interval
+                next_refresh = time.monotonic() + self.popularity_interval
+                while True:
+                    message = pubsub.get_message(timeout=1.0)
+                    if message and message["type"] == "message":
+                        self.apply_event(message["data"])
+                    if time.monotonic() >= next_build:
+                        self.build()
+                        next_build = time.monotonic() + self.rebuild_interval
+                        next_refresh = time.monotonic() + self.popularity_interval
+                    elif time.monotonic() >= next_refresh:
+                        self.refresh_priors()
+                        next_refresh = time.monotonic() + self.popularity_interval
+            except Exception as e:
+                # Events may have been missed, so the index is built again after subscribing
+                logger.exception(f"Search index error, retrying in {RETRY_DELAY} s: {e}")
+                time.sleep(RETRY_DELAY)
+            finally:
+                pubsub.close()
+
+    def media_type(self, path):
+        extension = os.path.splitext(path or "")[1][1:].lower()
+        if extension in self.video_extensions:
+            return "video"
+        if extension in self.audio_extensions:
+            return "audio"
+        return None
+
+    def load_media(self, session, rows):
+        """Turns media card rows (with VideoPath as an extra column) into documents and their words."""
+        tags = load_media_tags(session, [row.IdMedia for row in rows])
+        documents = []
+        for row in rows:
+            card = make_card(MediaCard, row)._replace(CompanyName=None)
+            media_tags = tags.get(card.IdMedia, [])
+            document = MediaDocument(card, frozenset(tag.IdTag for tag in media_tags), self.media_type(row.VideoPath))
+            words = tokenize(card.NameV, card.DescriptionV, *[tag.TagName for tag in media_tags])
+            documents.append((document, words))
+        return documents
+
+    def load_popularity(self):
+        """Returns the popularity of every media and company, from the counters of the search suggestions."""
+        popularity = {MEDIA: {}, COMPANY: {}}
+        for ref, score in self.redis_client.zscan_iter(POPULARITY_KEY, count=10000):
+            kind, _, object_id = ref.decode('utf-8').partition(":")
+            if kind in popularity:
+                popularity[kind][int(object_id)] = score
+        return popularity
+
+    def compute_priors(self, media, companies):
+        """Returns the priors of the given media and companies, the highest popularities and the time they are for."""
+        popularity = self.load_popularity()
+        max_popularity = {kind: max(values.values(), default=0.0) for kind, values in popularity.items()}
+        now = datetime.datetime.now()
+        media_priors = {media_id: self.scorer.prior(document.card.UploadTime, popularity[MEDIA].get(media_id, 0),
+                                                    max_popularity[MEDIA], now)
+                        for media_id, document in media.items()}
+        company_priors = {company_id: self.scorer.prior(None, popularity[COMPANY].get(company_id, 0),
+                                                        max_popularity[COMPANY], now)
+                          for company_id in companies}
+        return media_priors, company_priors, max_popularity, now
+
+    def refresh_priors(self):
+        """Scores popularity and recency again. Runs on the index thread, the only one changing the documents."""
+        media_priors, company_priors, max_popularity, scored_at = self.compute_priors(self.media, self.companies)
+        with self.lock:
+            self.media_priors, self.company_priors = media_priors, company_priors
+            self.max_popularity, self.scored_at = max_popularity, scored_at
+        self.stats["scored_at"] = time.time()
+
+    def load_priors(self, kind, documents):
+        """Returns the priors of changed documents, given as (id, upload time) pairs."""
+        if not documents:
+            return {}
+        scores = self.redis_client.zmscore(POPULARITY_KEY, [make_ref(kind, object_id) for object_id, _ in documents])
+        return {object_id: self.scorer.prior(upload_time, score or 0, self.max_popularity[kind], self.scored_at)
+                for (object_id, upload_time), score in zip(documents, scores)}
+
+    def update_bitmaps(self, document: MediaDocument, operation):
+        """Adds a media to (or discards it from) the bitmaps of its tags and type. Call with the lock held."""
+        for tag_id in document.tag_ids:
+            operation(self.tag_bitmaps.setdefault(tag_id, Bitmap()), document.card.IdMedia)
+        if document.media_type:
+            operation(self.type_bitmaps.setdefault(document.media_type, Bitmap()), document.card.IdMedia)
+
+    def build(self):
+        """Builds a new index from a bulk scan and swaps it in."""
+        started = time.perf_counter()
+        media_index, media_names, media = InvertedIndex(), TrigramIndex(), {}
+        company_index, company_names, companies = InvertedIndex(), TrigramIndex(), {}
+        user_names, users = TrigramIndex(), {}
+        tag_members, type_members = defaultdict(list), defaultdict(list)
+        generations = get_generations(self.redis_client)  # Writes of these generations are committed already
+        with self.app.app_context():  # Sessions are scoped to the application context
+            session = self.Session()
+            media_query = media_card_query(session).add_columns(Media.VideoPath)
+            for rows in iterate_in_batches(media_query, (Media.IdMedia,), BUILD_BATCH_SIZE, descending=False):
+                for document, words in self.load_media(session, rows):
+                    media[document.card.IdMedia] = document
+                    media_index.add(document.card.IdMedia, words)
+                    media_names.add_name(document.card.IdMedia, document.card.NameV)
+                    for tag_id in document.tag_ids:
+                        tag_members[tag_id].append(document.card.IdMedia)
+                    type_members[document.media_type].append(document.card.IdMedia)
+                session.rollback()  # Don't keep a long transaction open between batches
+            for rows in iterate_in_batches(company_card_query(session), (Companies.IdCompany,),
+                                           BUILD_BATCH_SIZE, descending=False):
+                for row in rows:
+                    card = make_card(CompanyCard, row)
+                    companies[card.IdCompany] = card
+                    company_index.add(card.IdCompany, tokenize(card.Name))
+                    company_names.add_name(card.IdCompany, card.Name)
+                session.rollback()
+            for rows in iterate_in_batches(user_card_query(session).filter(Users.IsActive), (Users.IdUser,),
+                                           BUILD_BATCH_SIZE, descending=False):
+                for row in rows:
+                    card = make_card(UserCard, row)
+                    users[card.IdUser] = card
+                    user_names.add_name(card.IdUser, display_name(card))
+                session.rollback()
+
+        tag_bitmaps = {tag_id: Bitmap.of(media_ids) for tag_id, media_ids in tag_members.items()}
+        type_bitmaps = {media_type: Bitmap.of(media_ids) for media_type, media_ids in type_members.items()
+                        if media_type}
+        media_priors, company_priors, max_popularity, scored_at = self.compute_priors(media, companies)
+        with self.lock:
+            self.media_priors, self.company_priors = media_priors, company_priors
+            self.max_popularity, self.scored_at = max_popularity, scored_at
+            self.media_index, self.media_names, self.media = media_index, media_names, media
+            self.tag_bitmaps, self.type_bitmaps = tag_bitmaps, type_bitmaps
+            self.company_index, self.company_names, self.companies = company_index, company_names, companies
+            self.user_names, self.users = user_names, users
+            for event_type, generation in generations.items():
+                self.generations[event_type] = max(self.generations[event_type], generation)
+            self.ready = True
+        build_seconds = time.perf_counter() - started
+        memory = sum(index.memory_usage() for index in (media_index, media_names, company_index, company_names,
+                                                        user_names, *tag_bitmaps.values(), *type_bitmaps.values()))
+        self.stats.update(build_seconds=round(build_seconds, 3), built_at=time.time(), scored_at=time.time(),
+                          memory_bytes=memory)
+        documents = len(media) + len(companies) + len(users)
+        logger.info(f"Search index built in {build_seconds:.2f} s: {len(media)} media, {len(companies)} companies, "
+                    f"{len(users)} users, {memory / max(documents, 1):.0f} bytes per document")
+
+    def apply_event(self, data):
+        """Reloads the media or companies named by a change event, dropping those that no longer exist."""
+        try:
+            event_type, ids, generation = parse_search_event(data)
+        except ValueError as e:
+            logger.error(f"Ignoring search event: {e}")
+            return
+
+        with self.app.app_context():
+            session = self.Session()
+            if event_type == MEDIA:
+                rows = media_card_query(session).add_columns(Media.VideoPath).filter(Media.IdMedia.in_(ids)).all()
+                documents = self.load_media(session, rows)
+                priors = self.load_priors(MEDIA, [(document.card.IdMedia, document.card.UploadTime)
+                                                  for document, _ in documents])
+                with self.lock:
+                    for media_id in ids:
+                        old_document = self.media.pop(media_id, None)
+                        if old_document:
+                            self.update_bitmaps(old_document, Bitmap.discard)
+                        self.media_priors.pop(media_id, None)
+                        self.media_index.remove(media_id)
+                        self.media_names.remove(media_id)
+                    for document, words in documents:
+                        self.media[document.card.IdMedia] = document
+                        self.media_index.add(document.card.IdMedia, words)
+                        self.media_names.add_name(document.card.IdMedia, document.card.NameV)
+                        self.update_bitmaps(document, Bitmap.add)
+                    self.media_priors.update(priors)
+            elif event_type == COMPANY:
+                cards = [make_card(CompanyCard, row)
+                         for row in company_card_query(session).filter(Companies.IdCompany.in_(ids))]
+                priors = self.load_priors(COMPANY, [(card.IdCompany, None) for card in cards])
+                with self.lock:
+                    for company_id in ids:
+                        self.companies.pop(company_id, None)
+                        self.company_priors.pop(company_id, None)
+                        self.company_index.remove(company_id)
+                        self.company_names.remove(company_id)
+                    for card in cards:
+                        self.companies[card.IdCompany] = card
+                        self.company_index.add(card.IdCompany, tokenize(card.Name))
+                        self.company_names.add_name(card.IdCompany, card.Name)
+                    self.company_priors.update(priors)
+            elif event_type == USER:
+                cards = [make_card(UserCard, row)
+                         for row in user_card_query(session).filter(Users.IdUser.in_(ids), Users.IsActive)]
+                with self.lock:
+                    for user_id in ids:
+                        self.users.pop(user_id, None)
+                        self.user_names.remove(user_id)
+                    for card in cards:
+                        self.users[card.IdUser] = card
+                        self.user_names.add_name(card.IdUser, display_name(card))
+            session.rollback()
+        with self.lock:
+            self.generations[event_type] = max(self.generations[event_type], generation)
+        self.stats["events_applied"] += 1
+
+    def can_search(self, text):
+        return self.ready and bool(tokenize(text))
+
+    def record_query(self, started):
+        self.stats["queries"] += 1
+        self.stats["query_seconds"] += time.perf_counter() - started
+
+    def media_card(self, media_id):
+        """MediaCard of an indexed media with the current name of its company. Call with the lock held."""
+        card = self.media[media_id].card
+        company = self.companies.get(card.IdCompany)
+        return card._replace(CompanyName=company.Name if company else None)
+
+    def is_current(self, event_type, generation):
+        """Whether the index has applied the writes of the given type up to that generation."""
+        return self.generations[event_type] >= generation
+
+    def get_cards(self, event_type, ids):
+        """Returns the cards of the given ids in order, or None unless the index has every one of them."""
+        if not self.ready:
+            return None
+        with self.lock:
+            documents = {MEDIA: self.media, COMPANY: self.companies, USER: self.users}[event_type]
+            if not all(object_id in documents for object_id in ids):
+                return None
+            if event_type == MEDIA:
+                return [self.media_card(media_id) for media_id in ids]
+            return [documents[object_id] for object_id in ids]
+
+    def search_media(self, text, media_type, tag_filter: TagFilter, limit, cursor=None, fuzzy=True):
+        """
+        Returns a page of MediaCards matching the text and the tag filter and the next cursor, or None if the
+        index can't answer. If no media contains every word, media with a similar title are returned instead.
+        """
+        if not self.can_search(text):
+            return None
+        started = time.perf_counter()
+        tag_ids = set(tag_filter.tag_ids)
+
+        def tag_overlap(media_id):
+            return len(self.media[media_id].tag_ids & tag_ids) / len(tag_ids) if tag_ids else 0.0
+
+        with self.lock:
+            allowed = tag_filter.apply(self.type_bitmaps.get(media_type, Bitmap()), self.tag_bitmaps)
+            scores = {media_id: score for media_id, score in self.media_index.search(tokenize(text)).items()
+                      if media_id in allowed}
+            if not scores and fuzzy:
+                scores = {media_id: score for media_id, score
+                          in self.media_names.similar(text, self.fuzzy_cutoff, self.max_candidates).items()
+                          if media_id in allowed}
+            best = max(scores.values(), default=0)
+            scores = {media_id: self.scorer.score(score, best, self.media_priors.get(media_id, 0.0),
+                                                  tag_overlap(media_id))
+                      for media_id, score in scores.items()}
+            media_ids, next_cursor = page(scores, limit, cursor)
+            cards = [self.media_card(media_id) for media_id in media_ids]
+        self.record_query(started)
+        return cards, next_cursor
+
+    def search_companies(self, text, limit, cursor=None, fuzzy=True):
+        """
+        Returns a page of CompanyCards matching the text and the next cursor, or None if the index can't answer.
+        If no company name contains every word, similar names are returned instead.
+        """
+        if not self.can_search(text):
+            return None
+        started = time.perf_counter()
+        with self.lock:
+            scores = self.company_index.search(tokenize(text))
+            if not scores and fuzzy:
+                scores = self.company_names.similar(text, self.fuzzy_cutoff, self.max_candidates)
+            best = max(scores.values(), default=0)
+            scores = {company_id: self.scorer.score(score, best, self.company_priors.get(company_id, 0.0))
+                      for company_id, score in scores.items()}
+            company_ids, next_cursor = page(scores, limit, cursor)
+            cards = [self.companies[company_id] for company_id in company_ids]
+        self.record_query(started)
+        return cards, next_cursor
+
+    def search_similar_users(self, text, limit, cursor=None):
+        """Returns a page of UserCards with a display name similar to the text, or None if the index can't answer."""
+        if not self.can_search(text):
+            return None
+        started = time.perf_counter()
+        with self.lock:
+            user_ids, next_cursor = page(self.user_names.similar(text, self.fuzzy_cutoff, self.max_candidates),
+                                         limit, cursor)
+            cards = [self.users[user_id] for user_id in user_ids]
+        self.record_query(started)
+        return cards, next_cursor
+
+    def get_stats(self):
+        with self.lock:
+            documents = len(self.media) + len(self.companies) + len(self.users)
+            stats = dict(self.stats, ready=self.ready, generations=dict(self.generations),
+                         score_weights=getattr(self.scorer, "weights", None),
+                         media=len(self.media), companies=len(self.companies), users=len(self.users),
+                         tags=len(self.tag_bitmaps),
+                         terms=len(self.media_index.term_ids) + len(self.company_index.term_ids),
+                         trigrams=len(self.media_names.term_ids) + len(self.company_names.term_ids)
+                         + len(self.user_names.term_ids))
+        stats["bytes_per_document"] = round(stats["memory_bytes"] / documents) if stats["memory_bytes"] and documents else None
+        stats["average_query_ms"] = round(1000 * stats.pop("query_seconds") / stats["queries"], 3) if stats["queries"] else None
+        return stats
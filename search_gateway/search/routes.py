@@ -1,23 +1,137 @@
 import datetime
 from .. import app, redis_client, Session, ALLOWED_VIDEO_EXTENSIONS, ALLOWED_AUDIO_EXTENSIONS
-from ..helpers.functions import token_required, after_token_required
+from ..helpers.functions import token_required, cached_token_required
+from ..helpers.sessions import read_only
+from ..helpers.pagination import (paginate, paginate_partitions, next_cursor_headers, get_limit, encode_cursor,
+                                  decode_cursor_values, PaginationError)
+from ..helpers.cards import (media_card_query, company_card_query, user_card_query, make_card, serialize_media_cards,
+                             serialize_company_card, serialize_user_card, MediaCard, CompanyCard, UserCard)
+from ..helpers.fulltext import text_search
+from ..helpers.suggest import suggest, record_query
+from ..helpers.search_history import record_search, get_history
+from ..helpers.search_events import MEDIA, COMPANY
+from .index import SearchIndex
+from .scoring import Scorer, parse_weights
+from .bitmaps import TagFilter
+from .cache import SearchCache, EVENT_TYPES, fingerprint
+from .fanout import FanOut
 from ..database.users import Users
 from ..database.media import Media
 from ..database.tags import Tags
 from ..database.companies import Companies
-from ..database.searchHistory import SearchHistory
 from flask import Flask, jsonify, request
-from sqlalchemy import func, or_, and_
+from sqlalchemy import func, or_, and_, case
 
 app: Flask
 
+MAX_SUGGESTIONS = 50
+
+search_index = SearchIndex(app, Session, redis_client, ALLOWED_VIDEO_EXTENSIONS, ALLOWED_AUDIO_EXTENSIONS,
+                           rebuild_interval=app.config['SEARCH_INDEX_REBUILD_INTERVAL'],
+                           enabled=app.config['SEARCH_INDEX_ENABLED'],
+                           fuzzy_cutoff=app.config['SEARCH_FUZZY_CUTOFF'],
+                           max_candidates=app.config['SEARCH_FUZZY_MAX_CANDIDATES'],
+                           scorer=Scorer(parse_weights(app.config['SEARCH_SCORE_WEIGHTS']),
+                                         app.config['SEARCH_RECENCY_HALF_LIFE_DAYS']),
+                           popularity_interval=app.config['SEARCH_POPULARITY_REFRESH_INTERVAL'])
+search_cache = SearchCache(redis_client, app.config['SEARCH_CACHE_TTL'])
+fan_out = FanOut(app, Session, workers=app.config['SEARCH_FANOUT_WORKERS'], timeout=app.config['SEARCH_FANOUT_TIMEOUT'],
+                 enabled=app.config['SEARCH_FANOUT_ENABLED'])
+
+
+def search_user_page(session, text, limit, cursor, fuzzy):
+    """Returns a page of UserCards, the next cursor and whether the in-memory index answered."""
+    query, key, descending = text_search(
+        user_card_query(session).filter(Users.IsActive),
+        (Users.NameUser, Users.Surname, Users.LoginUser, Users.Email), text, (Users.IdUser,), descending=False)
+    try:
+        rows, next_cursor = paginate(query, key, limit, cursor, descending)
+    except PaginationError:
+        if not fuzzy:
+            raise
+        rows, next_cursor = [], None  # Cursor of a page of similar names, which has another shape
+    if not rows and fuzzy:
+        similar_page = search_index.search_similar_users(text, limit, cursor)
+        if similar_page is not None:
+            return *similar_page, True
+    return [make_card(UserCard, row) for row in rows], next_cursor, False
+
+
+def search_media_pages(session, text, tag_filter: TagFilter, limit, cursors, fuzzy):
+    """
+    Returns {media type: (MediaCards, next cursor, whether the in-memory index answered)} for the media
+    types of cursors. Types the index can't answer are read from MySQL together, with a single query.
+    """
+    pages = {}
+    for media_type, cursor in cursors.items():
+        index_page = search_index.search_media(text, media_type, tag_filter, limit, cursor, fuzzy)
+        if index_page is not None:
+            pages[media_type] = *index_page, True
+    cursors = {media_type: cursor for media_type, cursor in cursors.items() if media_type not in pages}
+    if not cursors:
+        return pages
+
+    query, key, _ = text_search(media_card_query(session), (Media.NameV, Media.DescriptionV), text,
+                                (Media.UploadTime, Media.IdMedia))
+    # EXISTS instead of a join, so a media with several matching tags is returned once
+    if tag_filter.tag_ids and tag_filter.match_all:
+        query = query.filter(*[Media.tags.any(Tags.IdTag == tag_id) for tag_id in tag_filter.tag_ids])
+    elif tag_filter.tag_ids:
+        query = query.filter(Media.tags.any(Tags.IdTag.in_(tag_filter.tag_ids)))
+    if tag_filter.exclude_ids:
+        query = query.filter(~Media.tags.any(Tags.IdTag.in_(tag_filter.exclude_ids)))
+    kind = case((or_(*[Media.VideoPath.ilike(f"%{ext}") for ext in ALLOWED_VIDEO_EXTENSIONS]), "video"),
+                (or_(*[Media.VideoPath.ilike(f"%{ext}") for ext in ALLOWED_AUDIO_EXTENSIONS]), "audio"))
+    for media_type, (rows, next_cursor) in paginate_partitions(query, kind, key, limit, cursors).items():
+        pages[media_type] = [make_card(MediaCard, row) for row in rows], next_cursor, False
+    return pages
+
+
+def search_company_page(session, text, limit, cursor, fuzzy):
+    """Returns a page of CompanyCards, the next cursor and whether the in-memory index answered."""
+    index_page = search_index.search_companies(text, limit, cursor, fuzzy)
+    if index_page is not None:
+        return *index_page, True
+
+    query, key, descending = text_search(company_card_query(session), (Companies.Name,), text,
+                                         (Companies.IdCompany,), descending=False)
+    rows, next_cursor = paginate(query, key, limit, cursor, descending)
+    return [make_card(CompanyCard, row) for row in rows], next_cursor, False
+
+
+def load_cards(session, result_type, ids):
+    """Returns the cards of cached result ids in order, leaving out those deleted since."""
+    event_type = EVENT_TYPES[result_type]
+    cards = search_index.get_cards(event_type, ids)
+    if cards is not None:
+        return cards
+    if event_type == MEDIA:
+        rows = media_card_query(session).filter(Media.IdMedia.in_(ids)).all()
+        card_type = MediaCard
+    elif event_type == COMPANY:
+        rows = company_card_query(session).filter(Companies.IdCompany.in_(ids)).all()
+        card_type = CompanyCard
+    else:
+        rows = user_card_query(session).filter(Users.IdUser.in_(ids), Users.IsActive).all()
+        card_type = UserCard
+    cards = {row[0]: make_card(card_type, row) for row in rows}
+    return [cards[object_id] for object_id in ids if object_id in cards]
+
 
 @app.post('/search')
 @token_required(app, redis_client, Session)
-@after_token_required
+@read_only
 def search(user, session):
     """
     Searches for data across users, videos, audio (if implemented), and companies.
+
+    Results matching the search text are ordered by relevance. Media and companies
+    also rank higher when recent, popular or having more of the requested tags.
+    Without search text, videos and audio are ordered by upload time and users and
+    companies by id.
+    If a type has no exact match, names similar to the search text are returned,
+    ordered by similarity, so mistyped names are still found.
+    Result ids are cached for a few minutes, until media, companies or users change.
     ---
     tags:
       - Search
@@ -41,9 +155,27 @@ def search(user, session):
                 items:
                   type: integer
                 description: IDs of tags to filter videos by.
+              tag_mode:
+                type: string
+                enum: ["any", "all"]
+                description: Return media having any (default) or all of the tags.
+              exclude_tags:
+                type: array
+                items:
+                  type: integer
+                description: IDs of tags the returned media must not have.
               request:
                 type: string
                 description: The search text.
+              limit:
+                type: integer
+                description: Maximum number of results per type (default 50, at most 200).
+              cursor:
+                type: object
+                description: Cursors from next_cursor of the previous page, by result type.
+              fuzzy:
+                type: boolean
+                description: When nothing matches the search text exactly, return similarly named results instead (default true).
     responses:
       200:
         description: Search results.
@@ -68,41 +200,36 @@ def search(user, session):
                   type: array
                   items:
                     type: object # Define company object properties
+                next_cursor:
+                  type: object
+                  description: Cursor of the next page for each result type that has more results.
+                partial:
+                  type: boolean
+                  description: True if some result types took too long and were left out.
+                timed_out:
+                  type: array
+                  items:
+                    type: string
+                  description: Result types left out because they took too long.
+      400:
+        description: Invalid request, tags, limit or cursor.
       500:
         description: Internal server error.
     """
+    search_index.start()
     try:
         data = request.get_json()
         if not data:
             return jsonify({'message': 'No data provided'}), 400
         search_types = data.get('type', [])
         tag_ids = data.get('tags', [])
+        tag_mode = data.get('tag_mode', 'any')
+        exclude_tag_ids = data.get('exclude_tags', [])
         search_text = data.get('request', '')
 
-        # Adding search_text to database
-        existing_search = session.query(SearchHistory).filter_by(SearchQuery=search_text).first()
-        user_searches = session.query(SearchHistory).filter_by(IdUser=user.IdUser).order_by(SearchHistory.SearchTime.desc()).all()
-        count_of_searches = len(user_searches)
-
-        if count_of_searches >= 10 and not existing_search:
-            while count_of_searches >= 10:
-                search_to_remove = user_searches[0]
-                session.delete(search_to_remove)
-                session.commit()
-                session.flush()
-                count_of_searches -= 1
-
-        if len(search_text) != 0:
-            if not existing_search:
-                search = SearchHistory(
-                    IdUser=user.IdUser,
-                    SearchQuery=search_text,
-                    SearchTime=datetime.datetime.now()
-                )
-                session.add(search)
-            else:
-                existing_search.SearchTime = datetime.datetime.now()
-            session.commit()
+        if isinstance(search_text, str) and search_text.strip():
+            record_search(redis_client, user.IdUser, search_text, persist=app.config['SEARCH_HISTORY_PERSIST'])
+            record_query(redis_client, search_text)
 
         if not isinstance(search_types, list):
             return jsonify({'message': 'Type must be a list'}), 400
@@ -113,92 +240,170 @@ def search(user, session):
         if not all(isinstance(x, int) for x in tag_ids):
             return jsonify({'message': 'Tags must be integer'}), 400
 
+        if tag_mode not in ('any', 'all'):
+            return jsonify({'message': 'Tag mode must be "any" or "all"'}), 400
+
+        if not isinstance(exclude_tag_ids, list) or not all(isinstance(x, int) for x in exclude_tag_ids):
+            return jsonify({'message': 'Excluded tags must be a list of integers'}), 400
+
+        tag_filter = TagFilter.of(tag_ids, tag_mode == 'all', exclude_tag_ids)
+
+        limit = get_limit(data.get('limit'))
+        fuzzy = data.get('fuzzy', True)
+        if not isinstance(fuzzy, bool):
+            return jsonify({'message': 'Fuzzy must be a boolean'}), 400
+        cursors = data.get('cursor') or {}
+        if not isinstance(cursors, dict):
+            return jsonify({'message': 'Cursor must be an object'}), 400
+
         results = {
             "user": [],
             "video": [],
             "audio": [],
-            "company": []
+            "company": [],
+            "next_cursor": {}
         }
 
         if not search_types:
             search_types = ["user", "video", "audio", "company"] # Search all types
 
-        if "user" in search_types:
-            user_results = session.query(Users).filter(
-                or_(
-                    Users.NameUser.ilike(f"%{search_text}%"),
-                    Users.Surname.ilike(f"%{search_text}%"),
-                    Users.LoginUser.ilike(f"%{search_text}%"),
-                    Users.Email.ilike(f"%{search_text}%")
-                ),
-                Users.IsActive
-            ).all()
-            results["user"] = [{
-                "user_id": user.IdUser,
-                "name": user.NameUser + " " + user.Surname,
-                "email": user.Email} for user in user_results]
-
-        if "video" in search_types or "audio" in search_types:
-            media_query = session.query(Media).filter(
-                or_(
-                    Media.NameV.ilike(f"%{search_text}%"),
-                    Media.DescriptionV.ilike(f"%{search_text}%")
-                ))
-
-            if tag_ids:
-                media_query = media_query.join(Media.tags).filter(Tags.IdTag.in_(tag_ids))
-
-            # Splitting into video and audio
-            media_results = media_query.all()
-
-            if "video" in search_types:
-                video_results = media_query.filter(or_(*[Media.VideoPath.ilike(f"%{ext}") for ext in ALLOWED_VIDEO_EXTENSIONS])).all()
-                results["video"] = [{
-                    "id": video.IdMedia,
-                    "name": video.NameV,
-                    "description": video.DescriptionV,
-                    "upload_time": video.UploadTime.isoformat(),
-                    "company_id": video.companies.IdCompany,
-                    "company_name": video.companies.Name} for video in video_results]
-
-            if "audio" in search_types:
-                audio_results = media_query.filter(or_(*[Media.VideoPath.ilike(f"%{ext}") for ext in ALLOWED_AUDIO_EXTENSIONS])).all()
-                results["audio"] = [{
-                    "id": audio.IdMedia,
-                    "name": audio.NameV,
-                    "description": audio.DescriptionV,
-                    "upload_time": audio.UploadTime.isoformat(),
-                    "company_id": audio.companies.IdCompany,
-                    "company_name": audio.companies.Name} for audio in audio_results]
-
-        if "company" in search_types:
-            company_results = session.query(Companies).filter(Companies.Name.ilike(f"%{search_text}%")).all()
-            results["company"] = [{
-                "company_id": company.IdCompany,
-                "name": company.Name,
-                "about": company.About} for company in company_results]
+        timed_out = []
+
+        def search_pages(result_types):
+            # Independent searches, run concurrently on sessions of their own
+            tasks = {}
+            if "user" in result_types:
+                tasks["user"] = lambda task_session: {"user": search_user_page(
+                    task_session, search_text, limit, cursors.get("user"), fuzzy)}
+            media_cursors = {t: cursors.get(t) for t in ("video", "audio") if t in result_types}
+            if media_cursors:
+                tasks["media"] = lambda task_session: search_media_pages(
+                    task_session, search_text, tag_filter, limit, media_cursors, fuzzy)
+            if "company" in result_types:
+                tasks["company"] = lambda task_session: {"company": search_company_page(
+                    task_session, search_text, limit, cursors.get("company"), fuzzy)}
+            pages, _ = fan_out.run(tasks, session)
+            timed_out.extend(result_type for result_type in result_types if result_type not in pages)
+            return pages
+
+        fingerprints = {t: fingerprint(t, search_text, tag_filter, limit, cursors.get(t), fuzzy)
+                        for t in ("user", "video", "audio", "company") if t in search_types}
+        pages = search_cache.cached_pages(search_cache.get_generations(), fingerprints,
+                                          lambda result_type, ids: load_cards(session, result_type, ids),
+                                          search_pages, search_index.is_current)
+
+        for result_type, (cards, next_cursor) in pages.items():
+            if result_type == "user":
+                results["user"] = [serialize_user_card(card) for card in cards]
+            elif result_type == "company":
+                results["company"] = [serialize_company_card(card) for card in cards]
+            else:
+                results[result_type] = serialize_media_cards(session, cards, with_tags=False)
+            results["next_cursor"][result_type] = next_cursor
+
+        # Only keep cursors of the types that have another page
+        results["next_cursor"] = {k: v for k, v in results["next_cursor"].items() if v}
+        results["partial"] = bool(timed_out)
+        results["timed_out"] = timed_out
 
         return jsonify(results), 200
 
+    except PaginationError as e:
+        return jsonify({'message': str(e)}), 400
     except Exception as e:
         app.logger.exception(f"Search error: {e}")
         return jsonify({'message': 'Internal server error'}), 500
 
 
+@app.get('/search/suggest')
+@cached_token_required(app, redis_client, Session)
+def get_search_suggestions(user_id):
+    """
+    Suggests completions of a partly typed search, for search-as-you-type.
+
+    Completes media titles, company names and popular past searches from any of
+    their words, most popular first. Served from Redis only: nothing is written,
+    and unlike POST /search the query is not added to the search history.
+    ---
+    tags:
+      - Search
+    security:
+      - bearerAuth: []
+    parameters:
+      - in: query
+        name: q
+        type: string
+        required: true
+        description: The text typed so far.
+      - in: query
+        name: limit
+        type: integer
+        description: Maximum number of suggestions (default 10, at most 50).
+    responses:
+      200:
+        description: Suggestions, most popular first.
+        content:
+          application/json:
+            schema:
+              type: array
+              items:
+                type: object
+                properties:
+                  type:
+                    type: string
+                    enum: ["media", "company", "query"]
+                  id:
+                    type: integer
+                    description: ID of the media or company, null for past searches.
+                  text:
+                    type: string
+                  popularity:
+                    type: number
+                    description: Total views of a media, subscribers of a company or number of searches.
+      400:
+        description: Invalid limit.
+      500:
+        description: Internal server error.
+    """
+    try:
+        limit = get_limit(request.args.get('limit'), default=10)
+        return jsonify(suggest(redis_client, request.args.get('q', ''), min(limit, MAX_SUGGESTIONS))), 200
+    except PaginationError as e:
+        return jsonify({'message': str(e)}), 400
+    except Exception as e:
+        app.logger.exception(f"Error suggesting searches: {e}")
+        return jsonify({'message': 'Internal server error'}), 500
+
+
 @app.get('/search/history')
 @token_required(app, redis_client, Session)
-@after_token_required
+@read_only
 def get_search_history(user, session):
     """
     Retrieves the search history for the current user.
+
+    Lists the last 10 distinct searches, newest first, from Redis.
     ---
     security:
       - bearerAuth: []
     tags:
       - Search
+    parameters:
+      - in: query
+        name: limit
+        type: integer
+        description: Maximum number of items to return (default 50, at most 200).
+      - in: query
+        name: cursor
+        type: string
+        description: Value of the X-Next-Cursor header from the previous page.
     responses:
       200:
         description: Search history retrieved successfully.
+        headers:
+          X-Next-Cursor:
+            type: string
+            description: Cursor of the next page. Missing on the last page.
         content:
           application/json:
             schema:
@@ -206,9 +411,6 @@ def get_search_history(user, session):
               items:
                 type: object
                 properties:
-                  IdSearchHistory:
-                    type: integer
-                    description: The ID of the search history entry.
                   SearchQuery:
                     type: string
                     description: The search query.
@@ -216,22 +418,71 @@ def get_search_history(user, session):
                     type: string
                     format: date-time
                     description: The time of the search in ISO 8601 format.
+      400:
+        description: Invalid limit or cursor.
       500:
         description: Internal server error.
     """
     try:
-        search_history = session.query(SearchHistory).filter_by(IdUser=user.IdUser).order_by(SearchHistory.SearchTime.desc()).all()
+        limit = get_limit(request.args.get('limit'))
+        history = get_history(redis_client, session, user.IdUser)  # At most HISTORY_SIZE entries
+        cursor = request.args.get('cursor')
+        if cursor:
+            search_time, query = decode_cursor_values(cursor, 2)
+            try:
+                after = (datetime.datetime.fromisoformat(search_time), str(query))
+            except (TypeError, ValueError):
+                raise PaginationError("Invalid cursor")
+            history = [entry for entry in history if entry < after]
 
-        history_list = []
-        for history_entry in search_history:
-            history_list.append({
-                "IdSearchHistory": history_entry.IdSearchHistory,
-                "SearchQuery": history_entry.SearchQuery,
-                "SearchTime": history_entry.SearchTime.isoformat() if history_entry.SearchTime else None
-            })
+        next_cursor = encode_cursor(history[limit - 1]) if len(history) > limit else None
+        history_list = [{
+            "SearchQuery": query,
+            "SearchTime": search_time.isoformat()
+        } for search_time, query in history[:limit]]
 
-        return jsonify(history_list), 200
+        return jsonify(history_list), 200, next_cursor_headers(next_cursor)
 
+    except PaginationError as e:
+        return jsonify({'message': str(e)}), 400
     except Exception as e:
         app.logger.exception(f"Error retrieving search history: {e}")
         return jsonify({'message': 'Internal server error'}), 500
+
+
+@app.get("/internal/search-index")
+def internal_search_index_stats():
+    """
+Reports the in-memory search index of the worker that served the request.
+
+Not exposed through the proxy, meant for monitoring inside the service network.
+---
+tags:
+  - Internal
+responses:
+  200:
+    description: Index statistics (build time, documents, terms, memory per document, events applied, query latency).
+"""
+    return jsonify(search_index.get_stats()), 200
+
+
+@app.get("/internal/search-cache")
+def internal_search_cache_stats():
+    """
+Reports the hit ratio of the search result cache, for all workers.
+
+Not exposed through the proxy, meant for monitoring inside the service network.
+---
+tags:
+  - Internal
+responses:
+  200:
+    description: Cache statistics (hits, misses, hit ratio, average latency of hits and misses, estimated time saved).
+  500:
+    description: Internal server error.
+"""
+    try:
+        return jsonify(search_cache.get_stats()), 200
+    except Exception as e:
+        app.logger.exception(f"Error reading search cache statistics: {e}")
+        return jsonify({'message': 'Internal server error'}), 500
@@ -0,0 +1,59 @@
+"""
+Ranking of the media and companies found by the in-memory index.
+
+The score of a result is a weighted sum of components between 0 and 1:
+
+    relevance   its tf-idf (or name similarity) score divided by the best one of the query
+    recency     0.5 ** (age in days / SEARCH_RECENCY_HALF_LIFE_DAYS), from UploadTime, 0 for companies
+    popularity  log(1 + p) / log(1 + highest p), p being the total views of a media or the
+                subscribers of a company, as counted for the search suggestions
+    tags        the share of the requested tags the media has
+
+Recency and popularity don't depend on the query. They are computed for every
+document when the index is built and every SEARCH_POPULARITY_REFRESH_INTERVAL
+seconds, against the time of that refresh, so a query only adds relevance and
+tags, and scores don't move between the pages of a search. Weights come from
+SEARCH_SCORE_WEIGHTS; SearchIndex accepts any other object with the methods of
+Scorer to rank differently.
+"""
+import math
+
+COMPONENTS = ("relevance", "recency", "popularity", "tags")
+DEFAULT_WEIGHTS = "relevance=1,recency=0.2,popularity=0.3,tags=0.5"
+SCORE_DECIMALS = 6  # Rounded, so a score read into a cursor compares equal to the one computed again
+
+
+def parse_weights(text):
+    """Parses "component=weight,..." into {component: weight}. Components left out weigh 0."""
+    weights = dict.fromkeys(COMPONENTS, 0.0)
+    for item in text.split(","):
+        if not item.strip():
+            continue
+        name, _, value = item.partition("=")
+        name = name.strip()
+        if name not in weights:
+            raise ValueError(f"Unknown score component: {name}")
+        weights[name] = float(value)
+    return weights
+
+
+class Scorer:
+    def __init__(self, weights, recency_half_life_days=30):
+        self.weights = weights
+        self.recency_half_life_days = recency_half_life_days
+
+    def prior(self, upload_time, popularity, max_popularity, now):
+        """Part of the score that doesn't depend on the query."""
+        score = 0.0
+        if upload_time is not None:
+            age_days = max((now - upload_time).total_seconds(), 0) / 86400
+            score += self.weights["recency"] * 0.5 ** (age_days / self.recency_half_life_days)
+        if max_popularity > 0:
+            score += self.weights["popularity"] * math.log1p(max(popularity, 0)) / math.log1p(max_popularity)
+        return score
+
+    def score(self, relevance, best_relevance, prior, tag_overlap=0.0):
+        """Score of a document for a query, tag_overlap being the share of the requested tags it has."""
+        relevance = relevance / best_relevance if best_relevance > 0 else 0.0
+        return round(self.weights["relevance"] * relevance + prior + self.weights["tags"] * tag_overlap,
+                     SCORE_DECIMALS)
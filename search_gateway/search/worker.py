@@ -0,0 +1,45 @@
+"""
+Background worker of the search gateway.
+
+Writes the searches queued in Redis to the SearchHistory table every
+SEARCH_HISTORY_FLUSH_INTERVAL seconds, see helpers/search_history.py.
+Run it next to the gateway (see the search-worker service in docker-compose.yaml):
+
+    python -m search_gateway.search.worker
+"""
+import logging
+import os
+import socket
+import time
+from .. import app, Session, redis_client
+from ..helpers.search_history import ensure_history_group, flush_history
+
+logger = logging.getLogger(__name__)
+
+
+def run():
+    consumer = f"{socket.gethostname()}-{os.getpid()}"
+    interval = app.config['SEARCH_HISTORY_FLUSH_INTERVAL']
+    batch_size = app.config['SEARCH_HISTORY_FLUSH_BATCH_SIZE']
+    logger.info(f"Search worker {consumer} started, flushing search history every {interval} s")
+
+    group_ready = False
+    while True:
+        processed = 0
+        with app.app_context():  # Sessions are scoped to the application context
+            try:
+                if not group_ready:
+                    ensure_history_group(redis_client)
+                    group_ready = True
+                processed = flush_history(redis_client, Session(), consumer, batch_size)
+            except Exception as e:
+                # Unacknowledged searches stay pending and are retried on the next flush
+                logger.exception(f"Error flushing search history: {e}")
+
+        if processed < batch_size:  # Keep going without waiting while there is a backlog
+            time.sleep(interval)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+    run()
@@ -0,0 +1,174 @@
+"""
+Shared fixtures.
+
+Gateways are imported as packages from the repository root (their database and
+helpers symlinks resolve as in the containers) and run against an in-memory
+SQLite database and fakeredis, so the tests need neither MySQL nor a Redis server.
+Every test gets empty tables and an empty Redis. From the repository root:
+
+    pip install -r user_gateway/requirements.txt -r tests/requirements.txt
+    python -m pytest tests
+"""
+import datetime
+import importlib
+import os
+import secrets
+import sys
+from contextlib import contextmanager
+from typing import NamedTuple
+
+import fakeredis
+import pytest
+import redis
+from flask import Flask
+from sqlalchemy import create_engine, event, inspect
+from sqlalchemy.pool import StaticPool
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Read by the gateways when they are imported
+os.environ.update({
+    "SECRET_KEY": "test-secret-key-of-at-least-32-bytes",
+    "TOKEN_TIMEOUT": "30",
+    "BCRYPT_ROUNDS": "4",  # Pinned, so importing the user gateway doesn't calibrate
+    "SEARCH_INDEX_ENABLED": "false",  # Tests of the in-memory index build it themselves
+    "SEARCH_CACHE_TTL": "0",
+    "SEARCH_FANOUT_ENABLED": "false",
+})
+redis.Redis = fakeredis.FakeRedis  # Clients created at import share one fake server
+
+
+class Gateway(NamedTuple):
+    app: Flask
+    package: object
+    engine: object
+
+    def module(self, name):
+        """Returns a module of the gateway package, like "video.routes" or "database.media"."""
+        return importlib.import_module(f"{self.package.__name__}.{name}")
+
+    def session(self):
+        return self.package.Session()
+
+
+def load_gateway(name):
+    """Imports a gateway with its routes and binds it to a new, empty SQLite database."""
+    app = importlib.import_module(f"{name}.app").app
+    package = sys.modules[name]
+    engine = create_engine("sqlite://", poolclass=StaticPool, connect_args={"check_same_thread": False})
+    package.Base.metadata.create_all(engine)
+    package.Session.session_factory.configure(bind=engine)
+    package.redis_client.flushall()
+    return Gateway(app, package, engine)
+
+
+@pytest.fixture
+def user_gateway():
+    return load_gateway("user_gateway")
+
+
+@pytest.fixture
+def video_gateway():
+    return load_gateway("video_gateway")
+
+
+@pytest.fixture
+def company_gateway():
+    return load_gateway("company_gateway")
+
+
+@pytest.fixture
+def search_gateway():
+    return load_gateway("search_gateway")
+
+
+@contextmanager
+def count_statements(engine):
+    """Collects the SQL statements run on the engine inside the block."""
+    statements = []
+
+    def record(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    event.listen(engine, "before_cursor_execute", record)
+    try:
+        yield statements
+    finally:
+        event.remove(engine, "before_cursor_execute", record)
+
+
+def auth_headers(gateway: Gateway, user_id):
+    """Logs a user in the way token_required expects: a token known to Redis."""
+    token = secrets.token_urlsafe(16)
+    gateway.package.redis_client.set(f"token:{token}", user_id)
+    gateway.package.redis_client.set(f"user:{user_id}:token", token)
+    return {"Authorization": f"Bearer {token}"}
+
+
+class Seeder:
+    """Adds rows through a gateway's models, committing after each helper."""
+
+    def __init__(self, gateway: Gateway):
+        self.gateway = gateway
+        self.models = {name: getattr(gateway.module(f"database.{module}"), name) for module, name in (
+            ("users", "Users"), ("companies", "Companies"), ("media", "Media"), ("tags", "Tags"),
+            ("comments", "Comments"), ("reports", "Reports"), ("accessLevels", "AccessLevels"),
+            ("userRoles", "UserRoles"), ("viewHistory", "ViewHistory"),
+            ("ratingTypes", "RatingTypes"), ("ratings", "Ratings"), ("subscribers", "Subscribers"),
+            ("logos", "CompanyLogo"), ("mediaTagsConnector", "MediaTagsConnector"),
+        )}
+        self.counter = 0
+
+    def add(self, model, **values):
+        """Inserts a row and returns the first column of its primary key."""
+        with self.gateway.app.app_context():
+            session = self.gateway.session()
+            row = self.models[model](**values)
+            session.add(row)
+            session.commit()
+            return inspect(row).identity[0]
+
+    def user(self, **values):
+        self.counter += 1
+        values = dict({"Email": f"user{self.counter}@example.com", "LoginUser": f"user{self.counter}",
+                       "NameUser": "Test", "Surname": f"User {self.counter}", "Password": "-",
+                       "IsActive": True}, **values)
+        return self.add("Users", **values)
+
+    def company(self, name="Company"):
+        return self.add("Companies", Name=name)
+
+    def tag(self):
+        self.counter += 1
+        return self.add("Tags", TagName=f"tag {self.counter}")
+
+    def media(self, company_id, tag_ids=(), extension="mp4", upload_time=None, name=None):
+        self.counter += 1
+        with self.gateway.app.app_context():
+            session = self.gateway.session()
+            tags = session.query(self.models["Tags"]).filter(self.models["Tags"].IdTag.in_(tag_ids)).all()
+            media = self.models["Media"](
+                NameV=name or f"media {self.counter}", DescriptionV="", IdCompany=company_id, tags=tags,
+                VideoPath=f"media{self.counter}.{extension}",
+                UploadTime=upload_time or datetime.datetime.now() - datetime.timedelta(minutes=self.counter))
+            session.add(media)
+            session.commit()
+            return inspect(media).identity[0]
+
+    def access_level(self, name, level):
+        return self.add("AccessLevels", AccessName=name, AccessLevel=level)
+
+    def role(self, user_id, company_id, access_level_id):
+        self.add("UserRoles", IdUser=user_id, IdCompany=company_id, IdAccessLevel=access_level_id)
+
+    def comment(self, user_id, media_id):
+        self.counter += 1
+        return self.add("Comments", IdUser=user_id, IdMedia=media_id, TextComment=f"comment {self.counter}",
+                        Date=datetime.datetime.now() - datetime.timedelta(minutes=self.counter))
+
+    def report(self, user_id, comment_id):
+        return self.add("Reports", IdUser=user_id, IdComment=comment_id, ReportReason="spam",
+                        ReportTime=datetime.datetime.now())
+
+    def view(self, user_id, media_id):
+        self.add("ViewHistory", IdUser=user_id, IdMedia=media_id, ViewTime=datetime.datetime.now(), ViewCount=1)
@@ -0,0 +1,155 @@
+"""Deleting a company queues it, and the video worker removes every row and Redis key of it, resuming after errors."""
+import datetime
+
+import pytest
+from conftest import Seeder, auth_headers, load_gateway
+
+
+@pytest.fixture
+def gateways(company_gateway):
+    worker = load_gateway("video_gateway")  # Runs the deletion, against the same database and Redis
+    worker.package.Session.session_factory.configure(bind=company_gateway.engine)
+    return company_gateway, worker
+
+
+def seed_reference_data(seeder):
+    seeder.add("CompanyLogo", LogoPath="logos/default.png")  # The placeholder logo, kept
+    seeder.add("RatingTypes", IdRatingType=1, NameRating="Like", RatingFactor=1)
+
+
+def seed_company(gateway, seeder, name, user_id):
+    """A company with two media and every kind of row and Redis key that depends on them."""
+    stats, viewers, suggest = (gateway.module(f"helpers.{name}") for name in ("stats", "viewers", "suggest"))
+    redis_client = gateway.package.redis_client
+    logo_id = seeder.add("CompanyLogo", LogoPath=f"logos/{name}.png")
+    company_id = seeder.add("Companies", Name=name, IdCompanyLogo=logo_id)
+    seeder.role(user_id, company_id, seeder.access_level("Owner", 5))
+    seeder.add("Subscribers", IdCompany=company_id, IdUser=user_id)
+    suggest.update_suggestion(redis_client, "company", company_id, name)
+    redis_client.pfadd(viewers.company_viewers_key(company_id), user_id)
+
+    media_ids = []
+    for _ in range(2):
+        media_id = seeder.media(company_id, [seeder.tag()])
+        seeder.report(user_id, seeder.comment(user_id, media_id))
+        seeder.add("Ratings", IdUser=user_id, IdMedia=media_id, IdRatingType=1, RatingTime=datetime.datetime.now())
+        seeder.view(user_id, media_id)
+        with gateway.app.app_context():
+            stats.get_media_stats(redis_client, gateway.session(), media_id)  # Caches the counters
+        redis_client.pfadd(viewers.media_viewers_key(media_id), user_id)
+        suggest.update_suggestion(redis_client, "media", media_id, f"{name} video")
+        media_ids.append(media_id)
+    return company_id, media_ids
+
+
+def redis_keys(gateway, company_id, media_ids):
+    stats, viewers = gateway.module("helpers.stats"), gateway.module("helpers.viewers")
+    keys = [viewers.company_viewers_key(company_id)]
+    keys += [key for media_id in media_ids for key in (stats.stats_key(media_id), viewers.media_viewers_key(media_id))]
+    return keys
+
+
+def suggestion_labels(gateway, company_id, media_ids):
+    suggest = gateway.module("helpers.suggest")
+    refs = [f"company:{company_id}"] + [f"media:{media_id}" for media_id in media_ids]
+    return gateway.package.redis_client.hmget(suggest.LABELS_KEY, refs)
+
+
+def rows(gateway, company_id, media_ids):
+    """Number of rows of each table that belong to the company."""
+    models = Seeder(gateway).models
+    counts = {}
+    with gateway.app.app_context():
+        session = gateway.session()
+        for name in ("Comments", "Ratings", "ViewHistory", "MediaTagsConnector", "Media"):
+            model = models[name]
+            counts[name] = session.query(model).filter(model.IdMedia.in_(media_ids)).count()
+        comment_ids = [comment_id for comment_id, in session.query(models["Comments"].IdComment)
+                       .filter(models["Comments"].IdMedia.in_(media_ids))]
+        counts["Reports"] = session.query(models["Reports"]).filter(models["Reports"].IdComment.in_(comment_ids)).count()
+        for name in ("Companies", "UserRoles", "Subscribers"):
+            counts[name] = session.query(models[name]).filter(models[name].IdCompany == company_id).count()
+    return counts
+
+
+def test_deleted_company_leaves_nothing_behind(gateways):
+    company, worker = gateways
+    redis_client = company.package.redis_client
+    seeder = Seeder(company)
+    seed_reference_data(seeder)
+    admin_id = seeder.user()
+    seeder.role(admin_id, None, seeder.access_level("Admin", 10))
+    company_id, media_ids = seed_company(company, seeder, "doomed", seeder.user())
+    other_id, other_media_ids = seed_company(company, seeder, "kept", seeder.user())
+    before = rows(company, other_id, other_media_ids)
+    with company.app.app_context():
+        Media = seeder.models["Media"]
+        video_paths = {path for path, in company.session().query(Media.VideoPath).filter(Media.IdMedia.in_(media_ids))}
+
+    client = company.app.test_client()
+    response = client.delete(f"/company/{company_id}", headers=auth_headers(company, admin_id))
+    assert (response.status_code, response.get_json()["total"]) == (202, 2)
+    assert rows(company, company_id, media_ids)["Media"] == 2  # Nothing is deleted by the request
+    progress = client.get(f"/company/{company_id}/deletion", headers=auth_headers(company, admin_id)).get_json()
+    assert progress["status"] == "queued"
+
+    deletion = worker.module("helpers.deletion")
+    with worker.app.app_context():
+        assert deletion.delete_queued_companies(worker.session(), redis_client, batch_size=1) == 1
+        assert deletion.delete_queued_companies(worker.session(), redis_client, batch_size=1) == 1
+        assert deletion.delete_queued_companies(worker.session(), redis_client, batch_size=1) == 0  # The company
+
+    assert set(rows(company, company_id, media_ids).values()) == {0}
+    assert not redis_client.exists(*redis_keys(company, company_id, media_ids))
+    assert suggestion_labels(company, company_id, media_ids) == [None] * 3
+    assert not redis_client.smembers(deletion.COMPANY_DELETION_QUEUE)
+    removed = {path.decode() for path in redis_client.lrange(deletion.FILE_REMOVAL_QUEUE, 0, -1)}
+    assert removed == video_paths | {"logos/doomed.png"}
+    progress = client.get(f"/company/{company_id}/deletion", headers=auth_headers(company, admin_id)).get_json()
+    assert (progress["status"], progress["total"], progress["deleted"]) == ("done", 2, 2)
+
+    # The other company keeps its media, their rows, counters and suggestions, and the tags are shared
+    assert rows(company, other_id, other_media_ids) == before
+    assert redis_client.exists(*redis_keys(company, other_id, other_media_ids)) == 5
+    assert None not in suggestion_labels(company, other_id, other_media_ids)
+    with company.app.app_context():
+        assert company.session().query(seeder.models["Tags"]).count() == 4
+
+
+def test_failed_deletion_is_retried_where_it_stopped(gateways, monkeypatch):
+    company, worker = gateways
+    redis_client = company.package.redis_client
+    seeder = Seeder(company)
+    seed_reference_data(seeder)
+    company_id, media_ids = seed_company(company, seeder, "doomed", seeder.user())
+    deletion = worker.module("helpers.deletion")
+    with company.app.app_context():
+        deletion.queue_company_deletion(company.session(), redis_client, company_id)
+
+    delete_media_batch, calls = deletion.delete_media_batch, []
+
+    def fail_second_batch(session, redis_client, media_ids):
+        calls.append(media_ids)
+        if len(calls) == 2:
+            session.execute(deletion.delete(deletion.Comments))  # Partly done when it fails
+            raise RuntimeError("lost the database")
+        return delete_media_batch(session, redis_client, media_ids)
+
+    monkeypatch.setattr(deletion, "delete_media_batch", fail_second_batch)
+
+    def run_worker():
+        with worker.app.app_context():
+            deletion.delete_queued_companies(worker.session(), redis_client, batch_size=1)
+
+    run_worker()
+    run_worker()
+    progress = deletion.get_progress(redis_client, "company", company_id)
+    assert (progress["status"], progress["deleted"], progress["error"]) == ("failed", 1, "lost the database")
+    assert rows(company, company_id, media_ids)["Comments"] == 1  # The failed batch was rolled back
+
+    run_worker()  # The second media again
+    run_worker()  # The company
+    assert calls == [[media_ids[0]], [media_ids[1]], [media_ids[1]]]
+    assert set(rows(company, company_id, media_ids).values()) == {0}
+    progress = deletion.get_progress(redis_client, "company", company_id)
+    assert (progress["status"], progress["deleted"]) == ("done", 2) and "error" not in progress
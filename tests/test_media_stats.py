@@ -0,0 +1,69 @@
+"""The cached media counters neither lose nor double count a write that races a rebuild from the database."""
+from conftest import Seeder
+
+
+def setup(gateway):
+    seeder = Seeder(gateway)
+    user_id = seeder.user()
+    media_id = seeder.media(seeder.company())
+    seeder.view(user_id, media_id)
+    return seeder, user_id, media_id
+
+
+def cached_views(gateway, media_id):
+    stats = gateway.module("helpers.stats")
+    value = gateway.package.redis_client.hget(stats.stats_key(media_id), "views")
+    return int(value) if value is not None else None
+
+
+def test_write_during_rebuild_is_not_lost(video_gateway):
+    stats = video_gateway.module("helpers.stats")
+    redis_client = video_gateway.package.redis_client
+    seeder, user_id, media_id = setup(video_gateway)
+
+    with video_gateway.app.app_context():
+        # A reader misses the cache and counts from the database...
+        versions = stats.get_stats_versions(redis_client, [media_id])
+        counted = stats.compute_media_stats(video_gateway.session(), [media_id])
+
+    # ...while a write commits, finding no hash to increment
+    stats.begin_media_stats_update(redis_client, [media_id])
+    seeder.view(seeder.user(), media_id)
+    stats.increment_media_stats(redis_client, media_id, views=1)
+
+    stats.store_media_stats(redis_client, counted, versions)
+    assert cached_views(video_gateway, media_id) is None  # The stale count was not stored
+
+    with video_gateway.app.app_context():
+        assert stats.get_media_stats(redis_client, video_gateway.session(), media_id)["views"] == 2
+    assert cached_views(video_gateway, media_id) == 2
+
+
+def test_write_committed_before_rebuild_is_not_counted_twice(video_gateway):
+    stats = video_gateway.module("helpers.stats")
+    redis_client = video_gateway.package.redis_client
+    seeder, user_id, media_id = setup(video_gateway)
+
+    # A write commits, and a reader rebuilds before the write's increment runs
+    stats.begin_media_stats_update(redis_client, [media_id])
+    seeder.view(seeder.user(), media_id)
+    with video_gateway.app.app_context():
+        assert stats.get_media_stats(redis_client, video_gateway.session(), media_id)["views"] == 2
+    stats.increment_media_stats(redis_client, media_id, views=1)
+
+    with video_gateway.app.app_context():
+        assert stats.get_media_stats(redis_client, video_gateway.session(), media_id)["views"] == 2
+
+
+def test_cached_counters_are_incremented(video_gateway):
+    stats = video_gateway.module("helpers.stats")
+    redis_client = video_gateway.package.redis_client
+    seeder, user_id, media_id = setup(video_gateway)
+
+    with video_gateway.app.app_context():
+        assert stats.get_media_stats(redis_client, video_gateway.session(), media_id)["views"] == 1
+    stats.begin_media_stats_update(redis_client, [media_id])
+    seeder.view(seeder.user(), media_id)
+    stats.increment_media_stats(redis_client, media_id, views=1)
+
+    assert cached_views(video_gateway, media_id) == 2
@@ -0,0 +1,77 @@
+"""Schema migrations: a new database ends up with the models' schema, an existing one is upgraded in place."""
+import datetime
+import importlib
+
+import pytest
+from sqlalchemy import create_engine, inspect, insert, select
+from sqlalchemy.pool import StaticPool
+
+migrations = importlib.import_module("video_gateway.database.migrations")
+Base = importlib.import_module("video_gateway").Base
+
+
+@pytest.fixture
+def engine():
+    return create_engine("sqlite://", poolclass=StaticPool, connect_args={"check_same_thread": False})
+
+
+def schema(engine):
+    inspector = inspect(engine)
+    return {table: ({column['name'] for column in inspector.get_columns(table)},
+                    {index['name'] for index in inspector.get_indexes(table)})
+            for table in inspector.get_table_names()}
+
+
+def test_new_database_gets_the_models_schema(engine):
+    assert migrations.upgrade(engine) == max(version for version, _, _ in migrations.MIGRATIONS)
+
+    reference = create_engine("sqlite://")
+    Base.metadata.create_all(reference)
+    assert schema(engine) == schema(reference)
+
+
+def test_upgrade_again_changes_nothing(engine):
+    migrations.upgrade(engine)
+    before = schema(engine)
+
+    migrations.upgrade(engine)
+    assert schema(engine) == before
+    with engine.connect() as connection:
+        versions = connection.execute(select(migrations.SchemaVersion.Version)).scalars().all()
+    assert sorted(versions) == sorted(set(versions))
+
+
+def test_baseline_database_is_upgraded_and_duplicates_merged(engine):
+    migrations.baseline.create_all(engine)
+    ratings, searches = migrations.baseline.tables['Ratings'], migrations.baseline.tables['SearchHistory']
+    first, last = datetime.datetime(2024, 1, 1), datetime.datetime(2024, 6, 1)
+    with engine.begin() as connection:
+        connection.execute(insert(ratings), [{"IdUser": 1, "IdMedia": 2, "IdRatingType": 1},
+                                             {"IdUser": 1, "IdMedia": 2, "IdRatingType": 2}])
+        connection.execute(insert(searches), [{"IdUser": 1, "SearchQuery": "cats", "SearchTime": last},
+                                              {"IdUser": 1, "SearchQuery": "cats", "SearchTime": first}])
+
+    migrations.upgrade(engine)
+
+    with engine.connect() as connection:
+        assert connection.execute(select(ratings.c.IdRatingType)).scalars().all() == [2]  # The latest rating
+        assert connection.execute(select(searches.c.IdSearchHistory, searches.c.SearchTime)).all() == [(2, last)]
+    assert 'ux_Ratings_IdUser_IdMedia' in schema(engine)['Ratings'][1]
+
+
+def test_tables_created_from_the_models_are_upgraded(engine):
+    # Before the baseline was frozen, migration 1 created the tables with every index of the models
+    Base.metadata.create_all(engine)
+    with engine.begin() as connection:
+        migrations.get_current_version(connection)
+        connection.execute(insert(migrations.SchemaVersion).values(
+            Version=1, Description="Create tables", AppliedAt=datetime.datetime.now()))
+
+    migrations.upgrade(engine)
+    assert migrations.upgrade(engine) == max(version for version, _, _ in migrations.MIGRATIONS)
+
+
+def test_unknown_index_name_is_an_error(engine):
+    migrations.baseline.create_all(engine)
+    with engine.begin() as connection, pytest.raises(ValueError, match="ix_Media_Renamed"):
+        migrations.create_indexes(connection, migrations.Media, {'ix_Media_Renamed'})
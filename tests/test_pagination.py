@@ -0,0 +1,36 @@
+"""Keyset pagination returns every row exactly once, in order, even when sort keys are NULL."""
+import datetime
+import pytest
+from conftest import Seeder
+
+
+@pytest.mark.parametrize("descending", [True, False])
+def test_pages_cover_rows_with_null_sort_keys(video_gateway, descending):
+    pagination = video_gateway.module("helpers.pagination")
+    Media = video_gateway.module("database.media").Media
+    seeder = Seeder(video_gateway)
+    company_id = seeder.company()
+    now = datetime.datetime(2024, 1, 1)
+    for minutes in (None, 5, None, 5, 3, None, 1):
+        media_id = seeder.media(company_id)
+        with video_gateway.app.app_context():
+            session = video_gateway.session()
+            session.query(Media).filter_by(IdMedia=media_id).update(
+                {"UploadTime": now + datetime.timedelta(minutes=minutes) if minutes is not None else None})
+            session.commit()
+
+    columns = (Media.UploadTime, Media.IdMedia)
+    with video_gateway.app.app_context():
+        query = video_gateway.session().query(Media.IdMedia, Media.UploadTime)
+        expected = [row.IdMedia for row in query.order_by(
+            *[column.desc() if descending else column.asc() for column in columns]).all()]
+
+        seen, cursor = [], None
+        while True:
+            rows, cursor = pagination.paginate(query, columns, 2, cursor, descending)
+            seen += [row.IdMedia for row in rows]
+            if not cursor:
+                break
+
+    assert seen == expected
+    assert len(seen) == 7
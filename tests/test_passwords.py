@@ -0,0 +1,78 @@
+"""bcrypt work factors: pinned values are range-checked, calibrated ones are shared by every worker."""
+import fakeredis
+import pytest
+from conftest import Seeder, auth_headers
+
+
+@pytest.fixture
+def passwords(user_gateway):
+    return user_gateway.module("helpers.passwords")
+
+
+def test_hash_round_trip(passwords):
+    hashed = passwords.hash_password("correct horse", 5)
+
+    assert passwords.check_password("correct horse", hashed)
+    assert not passwords.check_password("wrong horse", hashed)
+    assert passwords.get_password_rounds(hashed) == 5
+    assert passwords.get_password_rounds("not a hash") is None
+
+
+@pytest.mark.parametrize("value", ["3", "32", "twelve", "12.5"])
+def test_pinned_rounds_out_of_range_are_rejected(passwords, value):
+    with pytest.raises(ValueError, match="BCRYPT_ROUNDS"):
+        passwords.get_deployment_rounds(fakeredis.FakeRedis(), value)
+
+
+def test_pinned_rounds_skip_calibration(passwords, monkeypatch):
+    monkeypatch.setattr(passwords, "calibrate_rounds", lambda *args: pytest.fail("calibrated a pinned cost"))
+    redis_client = fakeredis.FakeRedis()
+
+    assert passwords.get_deployment_rounds(redis_client, "4") == 4
+    assert passwords.get_deployment_rounds(redis_client, "31") == 31
+    assert passwords.get_current_rounds(redis_client, 4, pinned=True) == 4
+
+
+def test_calibrate_rounds_stays_within_bounds(passwords):
+    assert passwords.calibrate_rounds(0.001, min_rounds=4, max_rounds=6) == 4
+    assert passwords.calibrate_rounds(10 ** 9, min_rounds=4, max_rounds=6) == 6
+
+
+def test_first_calibration_is_shared_until_recalibrated(passwords, monkeypatch):
+    redis_client = fakeredis.FakeRedis()
+    monkeypatch.setattr(passwords, "calibrate_rounds", lambda *args: 11)
+    assert passwords.get_deployment_rounds(redis_client) == 11
+
+    # A worker on faster hardware starts later and keeps the shared cost
+    monkeypatch.setattr(passwords, "calibrate_rounds", lambda *args: 13)
+    assert passwords.get_deployment_rounds(redis_client) == 11
+
+    assert passwords.recalibrate_rounds(redis_client) == 13
+    assert passwords.get_current_rounds(redis_client, 11) == 13  # Read on every call, not once per worker
+
+
+def test_calibration_without_redis_is_local(passwords, monkeypatch):
+    server = fakeredis.FakeServer()
+    server.connected = False
+    redis_client = fakeredis.FakeRedis(server=server)
+    monkeypatch.setattr(passwords, "calibrate_rounds", lambda *args: 12)
+
+    assert passwords.get_deployment_rounds(redis_client) == 12
+    assert passwords.get_current_rounds(redis_client, 12) == 12
+
+
+def test_admin_recalibrates_the_shared_cost(user_gateway, passwords, monkeypatch):
+    seeder = Seeder(user_gateway)
+    admin_id, user_id = seeder.user(), seeder.user()
+    seeder.role(admin_id, seeder.company(), seeder.access_level("Admin", 10))
+    client = user_gateway.app.test_client()
+    path = "/users/password-costs/recalibrate"
+
+    assert client.post(path, headers=auth_headers(user_gateway, user_id)).status_code == 403
+    assert client.post(path, headers=auth_headers(user_gateway, admin_id)).status_code == 409  # Pinned by the tests
+
+    monkeypatch.setitem(user_gateway.app.config, "BCRYPT_ROUNDS_PINNED", False)
+    monkeypatch.setattr(passwords, "calibrate_rounds", lambda *args: 12)
+    response = client.post(path, headers=auth_headers(user_gateway, admin_id))
+    assert (response.status_code, response.get_json()) == (200, {"target_rounds": 12})
+    assert user_gateway.package.redis_client.get(passwords.CALIBRATION_KEY) == b"12"
@@ -0,0 +1,91 @@
+"""
+List endpoints run a fixed number of SQL statements, however many rows they return.
+
+Each scenario seeds a few rows or many, calls the endpoint and counts the
+statements it ran. Lazy loading per row would make the count grow with the
+rows; eager loading and card queries keep it constant and within the bound.
+"""
+import pytest
+from conftest import Seeder, auth_headers, count_statements, load_gateway
+
+SMALL, LARGE = 2, 25
+
+
+def seed_videos(seeder, count):
+    user_id = seeder.user()
+    company_id = seeder.company()
+    tag_ids = [seeder.tag(), seeder.tag()]
+    for _ in range(count):
+        seeder.media(company_id, tag_ids)
+    return user_id, company_id
+
+
+def all_videos(seeder, count):
+    user_id, _ = seed_videos(seeder, count)
+    return "/video", user_id
+
+
+def company_videos(seeder, count):
+    user_id, company_id = seed_videos(seeder, count)
+    return f"/company/{company_id}/videos", user_id
+
+
+def recommendations(seeder, count):
+    user_id, company_id = seed_videos(seeder, count)
+    tag_id = seeder.tag()
+    for _ in range(10):  # Enough unwatched matches that neither run falls back to the cold start query
+        seeder.media(company_id, [tag_id])
+    for _ in range(count):
+        seeder.view(user_id, seeder.media(company_id, [tag_id]))
+        seeder.media(company_id, [tag_id], extension="mp3")
+    return "/video/recommendations", user_id
+
+
+def video_comments(seeder, count):
+    user_id, company_id = seed_videos(seeder, 1)
+    moderator_id = seeder.access_level("Moderator", 2)
+    seeder.role(user_id, company_id, moderator_id)
+    media_id = seeder.media(company_id)
+    for _ in range(count):
+        seeder.report(user_id, seeder.comment(seeder.user(), media_id))
+    return f"/video/{media_id}/comments", user_id
+
+
+def reports(seeder, count):
+    user_id, company_id = seed_videos(seeder, 1)
+    moderator_id = seeder.access_level("Moderator", 2)
+    seeder.role(user_id, company_id, moderator_id)
+    for _ in range(count):
+        media_id = seeder.media(company_id)
+        seeder.report(seeder.user(), seeder.comment(seeder.user(), media_id))
+    return "/reports", user_id
+
+
+# (gateway, scenario, most statements allowed, including authentication)
+SCENARIOS = [
+    ("video_gateway", all_videos, 3),
+    ("company_gateway", company_videos, 4),
+    ("video_gateway", recommendations, 11),
+    ("video_gateway", video_comments, 7),
+    ("video_gateway", reports, 6),
+]
+
+
+def run_scenario(gateway_name, scenario, count):
+    gateway = load_gateway(gateway_name)
+    path, user_id = scenario(Seeder(gateway), count)
+    with count_statements(gateway.engine) as statements:
+        response = gateway.app.test_client().get(path, headers=auth_headers(gateway, user_id))
+    assert response.status_code == 200, response.get_json()
+    return response.get_json(), statements
+
+
+@pytest.mark.parametrize("gateway_name, scenario, bound", SCENARIOS,
+                         ids=[scenario.__name__ for _, scenario, _ in SCENARIOS])
+def test_statement_count_does_not_grow_with_results(gateway_name, scenario, bound):
+    small_body, small_statements = run_scenario(gateway_name, scenario, SMALL)
+    large_body, large_statements = run_scenario(gateway_name, scenario, LARGE)
+
+    assert len(str(large_body)) > len(str(small_body))  # The larger run did return more
+    assert len(large_statements) == len(small_statements), "\n".join(large_statements)
+    assert len(large_statements) <= bound, "\n".join(large_statements)
@@ -0,0 +1,68 @@
+"""Rating a video changes the cached counters by what the write replaced, even when requests race."""
+from conftest import Seeder, auth_headers
+
+
+def setup(gateway):
+    seeder = Seeder(gateway)
+    for type_id, name, factor in ((1, "Like", 1), (2, "Dislike", -1)):
+        seeder.add("RatingTypes", IdRatingType=type_id, NameRating=name, RatingFactor=factor)
+    user_id = seeder.user()
+    media_id = seeder.media(seeder.company())
+    return gateway.app.test_client(), auth_headers(gateway, user_id), media_id
+
+
+def rate(client, headers, media_id, rating):
+    response = client.post(f"/video/{media_id}/rating", json={"rating": rating}, headers=headers)
+    return response.status_code, response.get_json()
+
+
+def test_rating_changes_counters(video_gateway):
+    client, headers, media_id = setup(video_gateway)
+
+    assert rate(client, headers, media_id, 1)[1]["likes"] == 1
+    code, body = rate(client, headers, media_id, -1)
+    assert (code, body["likes"], body["dislikes"]) == (201, 0, 1)
+    code, body = rate(client, headers, media_id, 0)
+    assert (code, body["likes"], body["dislikes"]) == (200, 0, 0)
+
+
+def race_first_rating(gateway, monkeypatch):
+    """Makes the next rating request read no rating, as if it ran before the first one committed."""
+    routes = gateway.module("video.routes")
+    get_user_rating, calls = routes.get_user_rating, []
+
+    def stale_then_current(*args, **kwargs):
+        calls.append(args)
+        return 0 if len(calls) == 1 else get_user_rating(*args, **kwargs)
+
+    monkeypatch.setattr(routes, "get_user_rating", stale_then_current)
+    return calls
+
+
+def counters(gateway, media_id):
+    with gateway.app.app_context():
+        stats = gateway.module("helpers.stats").get_media_stats(gateway.package.redis_client, gateway.session(), media_id)
+    return stats["likes"], stats["dislikes"]
+
+
+def test_double_click_is_counted_once(video_gateway, monkeypatch):
+    client, headers, media_id = setup(video_gateway)
+    assert rate(client, headers, media_id, 1)[0] == 201
+
+    calls = race_first_rating(video_gateway, monkeypatch)
+    code, body = rate(client, headers, media_id, 1)
+    assert (code, body["likes"], body["dislikes"]) == (201, 1, 0)
+    assert len(calls) == 2  # The insert failed on the unique key, the retry found the like
+
+    assert counters(video_gateway, media_id) == (1, 0)
+
+
+def test_racing_different_rating_is_applied_over_the_first(video_gateway, monkeypatch):
+    client, headers, media_id = setup(video_gateway)
+    assert rate(client, headers, media_id, 1)[0] == 201
+
+    race_first_rating(video_gateway, monkeypatch)
+    code, body = rate(client, headers, media_id, -1)
+    assert (code, body["message"], body["likes"], body["dislikes"]) == (201, "Rating updated", 0, 1)
+
+    assert counters(video_gateway, media_id) == (0, 1)
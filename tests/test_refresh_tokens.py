@@ -0,0 +1,79 @@
+"""Refresh tokens are single use: replaying one, racing on one or changing the password revokes them."""
+import pytest
+from conftest import Seeder
+
+PASSWORD = "correct horse"
+
+
+@pytest.fixture
+def setup(user_gateway):
+    passwords = user_gateway.module("helpers.passwords")
+    user_id = Seeder(user_gateway).user(LoginUser="alice", Password=passwords.hash_password(PASSWORD, 4))
+    return user_gateway.app.test_client(), user_id
+
+
+def login(client):
+    body = client.post("/profile/login", json={"username": "alice", "password": PASSWORD}).get_json()
+    return body["token"], body["refresh_token"]
+
+
+def refresh(client, refresh_token):
+    response = client.post("/profile/refresh", json={"refresh_token": refresh_token})
+    return response.status_code, response.get_json()
+
+
+def test_replayed_token_revokes_its_family_and_access_token(user_gateway, setup):
+    client, user_id = setup
+    redis_client = user_gateway.package.redis_client
+    _, first = login(client)
+
+    code, body = refresh(client, first)
+    assert code == 200
+    second, access_token = body["refresh_token"], body["token"]
+    assert client.get("/profile", headers={"Authorization": f"Bearer {access_token}"}).status_code == 200
+
+    assert refresh(client, first)[0] == 401  # Somebody kept the used token
+    assert refresh(client, second)[0] == 401  # The whole family went with it
+    assert redis_client.get(f"token:{access_token}") == b"INVALID"
+    assert redis_client.get(f"user:{user_id}:token") is None
+    assert client.get("/profile", headers={"Authorization": f"Bearer {access_token}"}).status_code == 401
+    assert not redis_client.smembers(f"user:{user_id}:refresh_families")
+
+
+def test_concurrent_rotation_of_one_token_has_one_winner(user_gateway, setup, monkeypatch):
+    client, _ = setup
+    functions = user_gateway.module("helpers.functions")
+    app, redis_client = user_gateway.app, user_gateway.package.redis_client
+    _, token = login(client)
+
+    store_refresh_token = functions.store_refresh_token
+    winners = []
+
+    def store_after_a_concurrent_rotation(*args):
+        # A second request rotates the same token between WATCH and EXEC of this one
+        monkeypatch.setattr(functions, "store_refresh_token", store_refresh_token)
+        winners.append(functions.rotate_refresh_token(app, redis_client, token))
+        store_refresh_token(*args)
+
+    monkeypatch.setattr(functions, "store_refresh_token", store_after_a_concurrent_rotation)
+    assert functions.rotate_refresh_token(app, redis_client, token) == (None, None)  # WatchError
+
+    (_, winner_token), = winners
+    assert winner_token
+    assert refresh(client, winner_token)[0] == 200  # The loser didn't store a token or revoke the family
+
+
+def test_password_change_revokes_every_family(user_gateway, setup):
+    client, user_id = setup
+    redis_client = user_gateway.package.redis_client
+    _, first = login(client)
+    access_token, second = login(client)  # Another device, another family
+    assert len(redis_client.smembers(f"user:{user_id}:refresh_families")) == 2
+
+    response = client.put(f"/users/{user_id}", json={"oldPassword": PASSWORD, "newPassword": "battery staple"},
+                          headers={"Authorization": f"Bearer {access_token}"})
+    assert response.status_code == 200, response.get_json()
+
+    assert refresh(client, first)[0] == 401
+    assert refresh(client, second)[0] == 401
+    assert not redis_client.smembers(f"user:{user_id}:refresh_families")
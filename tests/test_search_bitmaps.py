@@ -0,0 +1,58 @@
+"""Tag filter bitmaps: set operations across chunks and any/all/exclude filters."""
+import importlib
+
+bitmaps = importlib.import_module("search_gateway.search.bitmaps")
+Bitmap, TagFilter = bitmaps.Bitmap, bitmaps.TagFilter
+
+BOUNDARY = 1 << bitmaps.CHUNK_BITS  # First id of the second chunk
+
+
+def test_ids_across_chunk_boundaries():
+    ids = [0, 1, BOUNDARY - 1, BOUNDARY, BOUNDARY + 1, 5 * BOUNDARY + 7]
+    bitmap = Bitmap.of(reversed(ids))
+    assert list(bitmap) == ids and len(bitmap) == len(ids)
+    assert sorted(bitmap.chunks) == [0, 1, 5]
+    assert BOUNDARY in bitmap and BOUNDARY + 2 not in bitmap and 2 * BOUNDARY not in bitmap
+
+    added = Bitmap()
+    for value in ids:
+        added.add(value)
+    assert added.chunks == bitmap.chunks
+
+    bitmap.discard(5 * BOUNDARY + 7)
+    bitmap.discard(3 * BOUNDARY)  # Not a member
+    assert sorted(bitmap.chunks) == [0, 1]  # Emptied chunks are dropped
+    assert not Bitmap.of([7]) - Bitmap.of([7]) and not Bitmap()
+
+
+def test_set_operations_chunk_by_chunk():
+    a = Bitmap.of([1, BOUNDARY - 1, BOUNDARY, 3 * BOUNDARY])
+    b = Bitmap.of([BOUNDARY - 1, BOUNDARY + 1, 3 * BOUNDARY, 4 * BOUNDARY])
+
+    assert list(a & b) == [BOUNDARY - 1, 3 * BOUNDARY]
+    assert list(a | b) == [1, BOUNDARY - 1, BOUNDARY, BOUNDARY + 1, 3 * BOUNDARY, 4 * BOUNDARY]
+    assert list(a - b) == [1, BOUNDARY]
+    assert (Bitmap.of([BOUNDARY]) & Bitmap.of([BOUNDARY + 1])).chunks == {}  # No empty chunk kept
+    assert list(a) == [1, BOUNDARY - 1, BOUNDARY, 3 * BOUNDARY]  # Operands are left unchanged
+
+
+def test_tag_filters():
+    candidates = Bitmap.of([1, 2, 3, BOUNDARY, BOUNDARY + 1, 2 * BOUNDARY])
+    tag_bitmaps = {
+        10: Bitmap.of([1, 2, BOUNDARY, 9]),
+        20: Bitmap.of([2, BOUNDARY, 2 * BOUNDARY]),
+        30: Bitmap.of([BOUNDARY]),
+    }
+
+    def apply(**tag_filter):
+        return list(TagFilter.of(**tag_filter).apply(candidates, tag_bitmaps))
+
+    assert apply() == list(candidates)
+    assert apply(tag_ids=[10, 20]) == [1, 2, BOUNDARY, 2 * BOUNDARY]  # Id 9 is not a candidate
+    assert apply(tag_ids=[20, 10], match_all=True) == [2, BOUNDARY]
+    assert apply(tag_ids=[10, 20], exclude_ids=[30]) == [1, 2, 2 * BOUNDARY]
+    assert apply(exclude_ids=[10, 20]) == [3, BOUNDARY + 1]
+    assert apply(tag_ids=[10, 99]) == [1, 2, BOUNDARY]  # Unknown tags have no media
+    assert apply(tag_ids=[10, 99], match_all=True) == []
+    assert apply(exclude_ids=[99]) == list(candidates)
+    assert TagFilter.of([20, 10, 20], exclude_ids=[30, 30]) == TagFilter((10, 20), False, (30,))
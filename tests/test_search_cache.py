@@ -0,0 +1,85 @@
+"""Search result cache: pages are stored only when current, and a write moves every page of its type to new keys."""
+import importlib
+
+import fakeredis
+import pytest
+
+cache = importlib.import_module("search_gateway.search.cache")
+search_events = importlib.import_module("search_gateway.helpers.search_events")
+
+
+class Search:
+    """Stands in for the search of the routes, counting the result types it had to compute."""
+
+    def __init__(self, from_index=True):
+        self.from_index = from_index
+        self.calls = []
+
+    def __call__(self, result_types):
+        self.calls.append(sorted(result_types))
+        return {result_type: ([(7, "card")], "cursor", self.from_index) for result_type in result_types}
+
+
+def load_cards(result_type, ids):
+    return [(card_id, "cached card") for card_id in ids]
+
+
+@pytest.fixture
+def search_cache():
+    return cache.SearchCache(fakeredis.FakeRedis(), ttl=60)
+
+
+def pages(search_cache, search, is_current=lambda *args: True, text="cats"):
+    fingerprints = {"video": cache.fingerprint("video", text, (), 10, None, True),
+                    "company": cache.fingerprint("company", text, (), 10, None, True)}
+    return search_cache.cached_pages(search_cache.get_generations(), fingerprints, load_cards, search, is_current)
+
+
+def test_second_search_is_served_from_the_cache(search_cache):
+    search = Search()
+    assert pages(search_cache, search)["video"] == ([(7, "card")], "cursor")
+    assert pages(search_cache, search)["video"] == ([(7, "cached card")], "cursor")
+    assert pages(search_cache, search, text="  CATS ")["company"] == ([(7, "cached card")], "cursor")  # Same search
+    assert search.calls == [["company", "video"]]
+
+    stats = search_cache.get_stats()
+    assert (stats["hits"], stats["misses"]) == (4, 2)
+
+
+def test_page_is_not_stored_before_the_index_is_current(search_cache):
+    search = Search()
+    pages(search_cache, search, is_current=lambda event_type, generation: event_type != search_events.MEDIA)
+    pages(search_cache, search)
+    assert search.calls == [["company", "video"], ["video"]]  # Only the company page was stored
+
+    # Pages computed from the database don't depend on the index, they are stored anyway
+    database_search = Search(from_index=False)
+    pages(search_cache, database_search, is_current=lambda *args: False, text="dogs")
+    pages(search_cache, database_search, text="dogs")
+    assert database_search.calls == [["company", "video"]]
+
+
+def test_write_changes_the_keys_of_its_type(search_cache):
+    search = Search()
+    generations = search_cache.get_generations()
+    media_key = search_cache.key("video", generations, "page")
+    company_key = search_cache.key("company", generations, "page")
+    pages(search_cache, search)
+
+    search_events.publish_search_event(search_cache.redis_client, search_events.MEDIA, [1])
+    generations = search_cache.get_generations()
+    assert search_cache.key("video", generations, "page") != media_key
+    assert search_cache.key("company", generations, "page") == company_key
+
+    pages(search_cache, search)
+    assert search.calls == [["company", "video"], ["video"]]
+
+
+def test_disabled_cache_always_searches():
+    search_cache = cache.SearchCache(fakeredis.FakeRedis(), ttl=0)
+    search = Search()
+    assert search_cache.get_generations() is None
+    pages(search_cache, search)
+    pages(search_cache, search)
+    assert search.calls == [["company", "video"]] * 2
+    assert not search_cache.redis_client.keys("search:cache:*")
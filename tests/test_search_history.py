@@ -0,0 +1,42 @@
+"""Search history: capped per user in Redis, repeated searches move up, a lost history is loaded back capped."""
+import datetime
+from conftest import Seeder
+
+
+def test_history_keeps_the_newest_searches(search_gateway):
+    history = search_gateway.module("helpers.search_history")
+    redis_client = search_gateway.package.redis_client
+    start = datetime.datetime(2024, 1, 1)
+    for i in range(history.HISTORY_SIZE + 5):
+        history.record_search(redis_client, 1, f"query {i}", search_time=start + datetime.timedelta(minutes=i))
+    history.record_search(redis_client, 1, "  query 7 ", search_time=start + datetime.timedelta(hours=1))
+    history.record_search(redis_client, 1, "   ", search_time=start + datetime.timedelta(hours=2))
+
+    with search_gateway.app.app_context():
+        queries = [query for _, query in history.get_history(redis_client, search_gateway.session(), 1)]
+    assert queries == ["query 7"] + [f"query {i}" for i in range(14, 8, -1)] + ["query 8", "query 6", "query 5"]
+    assert len(queries) == history.HISTORY_SIZE
+    assert redis_client.zcard(history.history_key(2)) == 0
+    assert redis_client.xlen(history.HISTORY_STREAM) == history.HISTORY_SIZE + 6
+
+
+def test_lost_history_is_loaded_back_from_the_database(search_gateway):
+    history = search_gateway.module("helpers.search_history")
+    SearchHistory = search_gateway.module("database.searchHistory").SearchHistory
+    redis_client = search_gateway.package.redis_client
+    user_id = Seeder(search_gateway).user()
+    start = datetime.datetime(2024, 1, 1)
+    with search_gateway.app.app_context():
+        session = search_gateway.session()
+        session.add_all(SearchHistory(IdUser=user_id, SearchQuery=f"query {i}",
+                                      SearchTime=start + datetime.timedelta(minutes=i))
+                        for i in range(history.HISTORY_SIZE + 3))
+        session.commit()
+
+        loaded = history.get_history(redis_client, session, user_id)
+    assert [query for _, query in loaded] == [f"query {i}" for i in range(history.HISTORY_SIZE + 2, 2, -1)]
+    assert redis_client.zcard(history.history_key(user_id)) == history.HISTORY_SIZE
+
+    history.record_search(redis_client, user_id, "new", persist=False, search_time=start + datetime.timedelta(days=1))
+    assert redis_client.zrevrange(history.history_key(user_id), 0, 1) == [b"new", b"query 12"]
+    assert redis_client.zcard(history.history_key(user_id)) == history.HISTORY_SIZE
@@ -0,0 +1,106 @@
+"""In-memory search index: inverted index lookups, trigram similarity and paging by score."""
+import importlib
+
+import pytest
+
+index = importlib.import_module("search_gateway.search.index")
+pagination = importlib.import_module("search_gateway.helpers.pagination")
+
+
+def build(documents):
+    inverted = index.InvertedIndex()
+    for document_id, text in documents.items():
+        inverted.add(document_id, index.tokenize(text))
+    return inverted
+
+
+def test_search_matches_documents_with_every_word():
+    inverted = build({1: "red fox", 2: "red panda", 3: "quick red fox fox", 4: "fox"})
+
+    assert set(inverted.search(["red", "fox"])) == {1, 3}
+    assert set(inverted.search(["fox", "red", "fox"])) == {1, 3}  # Repeated words count once
+    assert inverted.search(["red", "wolf"]) == {}  # An unknown word matches nothing
+    assert inverted.search([]) == {}
+
+    scores = inverted.search(["fox"])
+    assert scores[3] > scores[1] == scores[4]  # Twice the word, twice the score
+
+
+def test_readding_a_document_replaces_it():
+    inverted = build({1: "red fox", 2: "red panda"})
+    before = inverted.search(["red"])
+
+    inverted.add(1, index.tokenize("red fox"))
+    assert len(inverted) == 2
+    assert inverted.search(["red"]) == before
+    assert list(inverted.postings[inverted.term_ids["red"]][0]) == [1, 2]  # Listed once, still sorted
+
+    inverted.add(1, index.tokenize("blue fox"))
+    assert set(inverted.search(["red"])) == {2}
+    assert set(inverted.search(["blue", "fox"])) == {1}
+
+
+def test_removed_document_is_not_found():
+    inverted = build({1: "red fox", 2: "red panda"})
+    inverted.remove(1)
+    inverted.remove(1)  # Removing twice is harmless
+
+    assert len(inverted) == 1
+    assert inverted.search(["fox"]) == {}
+    assert set(inverted.search(["red"])) == {2}
+
+
+def names(documents):
+    trigram_index = index.TrigramIndex()
+    for document_id, name in documents.items():
+        trigram_index.add_name(document_id, name)
+    return trigram_index
+
+
+def dice(a, b):
+    a, b = index.trigrams(a), index.trigrams(b)
+    return round(2 * len(a & b) / (len(a) + len(b)), index.SCORE_DECIMALS)
+
+
+def test_similar_names_above_the_cutoff():
+    trigram_index = names({1: "Jonathan", 2: "Jonathon", 3: "Johnny", 4: "Mary"})
+
+    scores = trigram_index.similar("jonatan", cutoff=0, max_candidates=100)
+    assert scores == {document_id: dice("jonatan", name) for document_id, name
+                      in ((1, "Jonathan"), (2, "Jonathon"), (3, "Johnny"))}  # Mary shares no trigram
+    assert scores[1] > scores[2] > scores[3]
+
+    cutoff = scores[2]
+    assert set(trigram_index.similar("jonatan", cutoff, max_candidates=100)) == {1, 2}  # The cutoff is inclusive
+    assert trigram_index.similar("zzz", cutoff=0, max_candidates=100) == {}
+
+
+def test_common_trigrams_dont_exceed_max_candidates():
+    trigram_index = names({document_id: "Maria" if document_id <= 10 else "Marianne" for document_id in range(1, 12)})
+
+    scores = trigram_index.similar("marianne", cutoff=0, max_candidates=3)
+    assert len(scores) == 3
+    assert scores[11] == 1.0  # Found first through the rare trigrams, so it is kept
+    assert len(trigram_index.similar("marianne", cutoff=0, max_candidates=100)) == 11
+
+
+def test_pages_continue_through_tied_scores():
+    scores = {1: 0.5, 2: 0.9, 3: 0.5, 4: 0.5, 5: 0.1, 6: 0.9}
+
+    pages, cursor = [], None
+    while True:
+        ids, cursor = index.page(scores, 2, cursor)
+        pages.append(ids)
+        if cursor is None:
+            break
+    assert pages == [[6, 2], [4, 3], [1, 5]]  # Ties are ordered by id, none skipped or repeated
+    assert index.page(scores, 6, None) == ([6, 2, 4, 3, 1, 5], None)
+    assert index.page({}, 2, None) == ([], None)
+
+
+@pytest.mark.parametrize("values", [[0.5], ["0.5", 3], [0.5, "3"]])
+def test_invalid_page_cursor(values):
+    with pytest.raises(pagination.PaginationError):
+        index.page({1: 0.5}, 2, pagination.encode_cursor(values))
+    with pytest.raises(pagination.PaginationError):
+        index.page({1: 0.5}, 2, "not a cursor")
@@ -0,0 +1,41 @@
+"""Videos and audio are searched with one query, each type paginated on its own."""
+import datetime
+from conftest import Seeder, count_statements
+
+LIMIT = 2
+
+
+def test_one_query_serves_video_and_audio(search_gateway):
+    routes = search_gateway.module("search.routes")
+    TagFilter = search_gateway.module("search.bitmaps").TagFilter
+    seeder = Seeder(search_gateway)
+    company_id = seeder.company()
+    tag_id, other_tag_id = seeder.tag(), seeder.tag()
+    start = datetime.datetime(2024, 1, 1)
+    expected = {"video": [], "audio": []}
+    for minutes in range(10):
+        extension = "mp4" if minutes % 3 else "mp3"
+        tags = [tag_id] if minutes % 2 else [other_tag_id]
+        media_id = seeder.media(company_id, tags, extension=extension,
+                                upload_time=start + datetime.timedelta(minutes=minutes))
+        if minutes % 2:
+            expected["video" if extension == "mp4" else "audio"].insert(0, media_id)  # Newest first
+    assert len(expected["video"]) > LIMIT and len(expected["audio"]) == LIMIT
+
+    with search_gateway.app.app_context():
+        session = search_gateway.session()
+        with count_statements(search_gateway.engine) as statements:
+            pages = routes.search_media_pages(session, "", TagFilter.of([tag_id]), LIMIT,
+                                              {"video": None, "audio": None}, False)
+        assert len(statements) == 1, "\n".join(statements)
+
+        video_cards, video_cursor, _ = pages["video"]
+        audio_cards, audio_cursor, _ = pages["audio"]
+        assert [card.IdMedia for card in video_cards] == expected["video"][:LIMIT]
+        assert [card.IdMedia for card in audio_cards] == expected["audio"]
+        assert video_cursor and not audio_cursor
+
+        # The next video page continues where the first one stopped
+        pages = routes.search_media_pages(session, "", TagFilter.of([tag_id]), LIMIT,
+                                          {"video": video_cursor}, False)
+        assert [card.IdMedia for card in pages["video"][0]] == expected["video"][LIMIT:2 * LIMIT]
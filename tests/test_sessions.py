@@ -0,0 +1,131 @@
+"""Request sessions: replica routing, read-your-writes stickiness and pool wait statistics."""
+import importlib
+import logging
+import time
+
+import fakeredis
+import pytest
+from flask import Flask
+from sqlalchemy import Column, Integer, String, create_engine, exc, select, update
+from sqlalchemy.orm import declarative_base
+from sqlalchemy.pool import StaticPool
+
+sessions = importlib.import_module("user_gateway.helpers.sessions")
+Base = declarative_base()
+
+
+class Item(Base):
+    __tablename__ = "Items"
+    IdItem = Column(Integer, primary_key=True)
+    Name = Column(String(50))
+
+
+class User:
+    IdUser = 7
+
+
+def sqlite_engine(**options):
+    options = options or {"poolclass": StaticPool}
+    engine = create_engine("sqlite://", connect_args={"check_same_thread": False}, **options)
+    Base.metadata.create_all(engine)
+    return engine
+
+
+@pytest.fixture
+def routing():
+    primary, replica = sqlite_engine(), sqlite_engine()
+    router = sessions.ReplicaRouter([replica], fakeredis.FakeRedis(), sticky_seconds=5)
+    router.health[replica] = (True, time.monotonic())  # Known healthy, so no background check starts
+    app = Flask(__name__)
+    Session = sessions.create_request_session(app, primary, router)
+    return app, Session, primary, replica, router
+
+
+def read_only_session(Session, user=User):
+    """The session a @read_only route gets."""
+    return sessions.read_only(lambda user, session: session)(user, Session())
+
+
+def test_read_only_requests_read_from_a_replica(routing):
+    app, Session, primary, replica, _ = routing
+    with app.app_context():
+        assert Session().get_bind() is primary  # Not marked read-only
+    with app.app_context():
+        session = read_only_session(Session)
+        assert session.get_bind(clause=select(Item)) is replica
+        session.execute(select(Item))
+
+
+def test_reads_stay_on_primary_after_a_flush(routing):
+    app, Session, primary, replica, _ = routing
+    with app.app_context():
+        session = read_only_session(Session)
+        assert session.get_bind() is replica
+        session.add(Item(Name="written"))
+        session.flush()
+        assert session.get_bind() is primary
+        assert session.get_bind(clause=select(Item)) is primary
+        session.rollback()
+        assert session.get_bind() is primary  # Until the end of the request
+
+
+def test_dml_runs_on_primary_and_keeps_reads_there(routing):
+    app, Session, primary, replica, _ = routing
+    with app.app_context():
+        session = read_only_session(Session)
+        statement = update(Item).values(Name="renamed")
+        assert session.get_bind(clause=statement) is primary
+        session.execute(statement)
+        assert session.get_bind(clause=select(Item)) is primary
+
+
+def test_sticky_user_reads_from_primary(routing):
+    app, Session, primary, replica, router = routing
+    with app.app_context():
+        session = Session()
+        session.info['user_id'] = User.IdUser
+        session.add(Item(Name="written"))
+        session.commit()  # Marks the user sticky
+    assert router.is_sticky(User.IdUser)
+
+    with app.app_context():
+        session = read_only_session(Session)
+        assert not session.info.get('read_only')
+        assert session.get_bind(clause=select(Item)) is primary
+
+    router.redis_client.delete(f"db:sticky:{User.IdUser}")
+    with app.app_context():
+        assert read_only_session(Session).get_bind(clause=select(Item)) is replica
+
+
+def test_unhealthy_replica_falls_back_to_primary(routing):
+    app, Session, primary, replica, router = routing
+    router.health[replica] = (False, time.monotonic())
+    with app.app_context():
+        assert read_only_session(Session).get_bind(clause=select(Item)) is primary
+
+
+def test_pool_records_checkout_waits(caplog):
+    engine = sqlite_engine(poolclass=sessions.TimedQueuePool, pool_size=1, max_overflow=0, pool_timeout=0.2)
+    sessions.monitor_pool(engine, logging.getLogger("pool"), warning_ms=100)
+    app = Flask(__name__)
+    Session = sessions.create_request_session(app, engine)
+
+    @app.get("/items")
+    def items():
+        Session().execute(select(Item))
+        return "ok"
+
+    sessions.register_pool_route(app, engine)
+    client = app.test_client()
+    assert "db-checkout" in client.get("/items").headers["Server-Timing"]
+
+    with engine.connect():  # Holds the only connection, so the next checkout waits and times out
+        with pytest.raises(exc.TimeoutError):
+            engine.connect()
+    assert "Waited" in caplog.text
+
+    stats = client.get("/internal/pool").get_json()
+    assert (stats["size"], stats["checked_out"]) == (1, 0)
+    assert stats["waits"]["count"] >= 3 and stats["waits"]["slow"] == 1
+    assert stats["waits"]["max_ms"] >= 200
@@ -0,0 +1,76 @@
+"""Streamed listings: every row from one server-side cursor, and no valid looking body after an error."""
+import json
+from functools import partial
+
+import pytest
+from conftest import Seeder, auth_headers
+
+
+@pytest.fixture
+def listing(video_gateway):
+    seeder = Seeder(video_gateway)
+    company_id, tag_id = seeder.company(), seeder.tag()
+    media_ids = [seeder.media(company_id, [tag_id]) for _ in range(5)]  # Newest first
+    return video_gateway, seeder, media_ids
+
+
+def stream(gateway, stream_format, serialize=None, batch_size=2):
+    streaming, cards = gateway.module("helpers.streaming"), gateway.module("helpers.cards")
+    Media = gateway.module("database.media").Media
+    with gateway.app.test_request_context():
+        session = gateway.session()
+        response = streaming.stream_query(gateway.app, cards.media_card_query(session), (Media.UploadTime, Media.IdMedia),
+                                          serialize or partial(cards.serialize_media_cards, session), stream_format,
+                                          batch_size=batch_size)
+        return response.response  # The body, generated while it's read
+
+
+def test_every_row_is_streamed_in_batches(listing):
+    gateway, _, media_ids = listing
+    chunks = list(stream(gateway, "json"))
+    assert len(chunks) == 5  # '[', three batches and ']'
+    videos = json.loads("".join(chunks))
+    assert [video["id"] for video in videos] == media_ids
+    assert all(video["tags"] for video in videos)
+
+    lines = "".join(stream(gateway, "ndjson")).splitlines()
+    assert [json.loads(line)["id"] for line in lines] == media_ids
+
+
+def failing_serializer(gateway):
+    cards = gateway.module("helpers.cards")
+    batches = []
+
+    def serialize(rows):
+        batches.append(rows)
+        if len(batches) == 2:
+            raise RuntimeError("lost the database")
+        return [cards.serialize_media_card(cards.make_card(cards.MediaCard, row)) for row in rows]
+    return serialize
+
+
+def test_ndjson_stream_ends_with_an_error_record(listing):
+    gateway, _, media_ids = listing
+    lines = "".join(stream(gateway, "ndjson", failing_serializer(gateway))).splitlines()
+    assert [json.loads(line).get("id") for line in lines[:-1]] == media_ids[:2]
+    assert json.loads(lines[-1]) == {"error": "Error streaming response"}
+
+
+def test_json_stream_is_aborted_instead_of_closed(listing):
+    gateway, _, _ = listing
+    body = stream(gateway, "json", failing_serializer(gateway))
+    assert next(body) == "["
+    assert next(body).startswith("{")
+    with pytest.raises(RuntimeError):
+        next(body)  # Never reaches the closing ']'
+
+
+def test_route_streams_the_same_videos_as_its_pages(listing):
+    gateway, seeder, media_ids = listing
+    client, headers = gateway.app.test_client(), auth_headers(gateway, seeder.user())
+    page = client.get("/video?limit=200", headers=headers).get_json()
+
+    response = client.get("/video?stream=json", headers=headers)
+    assert response.mimetype == "application/json"
+    assert response.get_json() == page
+    assert [video["id"] for video in page] == media_ids
@@ -0,0 +1,42 @@
+"""Search suggestions: normalized texts, one entry per word, most popular completions first."""
+import importlib
+
+import fakeredis
+
+suggest = importlib.import_module("search_gateway.helpers.suggest")
+
+
+def test_normalize_keeps_lowercase_words():
+    assert suggest.normalize("  Hello, WORLD!! 2024 ") == "hello world 2024"
+    assert suggest.normalize("Über-Café") == "über café"
+    assert suggest.normalize(None) == ""
+    assert len(suggest.normalize("word " * 100)) == suggest.MAX_TEXT_LENGTH
+
+
+def test_every_word_starts_an_entry():
+    assert suggest.entries("Introduction to Algorithms", "media:1") == [
+        "introduction to algorithms\0media:1",
+        "to algorithms\0media:1",
+        "algorithms\0media:1",
+    ]
+    assert suggest.entries("?!", "media:1") == []
+
+    long_title = " ".join(f"word{i}" for i in range(20))
+    members = suggest.entries(long_title, "media:2")
+    assert len(members) == suggest.MAX_WORD_ENTRIES
+    assert members[-1].startswith(f"word{suggest.MAX_WORD_ENTRIES - 1} ")
+
+
+def test_suggestions_complete_any_word_most_popular_first():
+    redis_client = fakeredis.FakeRedis()
+    suggest.update_suggestion(redis_client, "media", 1, "Introduction to Algorithms")
+    suggest.update_suggestion(redis_client, "media", 2, "Algebra basics")
+    suggest.add_popularity(redis_client, "media", {1: 5, 2: 10})
+
+    assert [s["id"] for s in suggest.suggest(redis_client, "Alg")] == [2, 1]
+    assert [s["text"] for s in suggest.suggest(redis_client, "algo")] == ["Introduction to Algorithms"]
+
+    suggest.update_suggestion(redis_client, "media", 1, "Data structures")  # Renamed
+    assert suggest.suggest(redis_client, "algo") == []
+    suggest.remove_suggestions(redis_client, "media", [2])
+    assert suggest.suggest(redis_client, "alg") == []
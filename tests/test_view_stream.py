@@ -0,0 +1,69 @@
+"""View events: poison entries are dead-lettered, views are written directly without Redis, consumers are cleaned up."""
+import datetime
+import pytest
+import redis
+from conftest import Seeder, auth_headers
+
+
+def test_poison_entry_is_dead_lettered(video_gateway):
+    views = video_gateway.module("helpers.views")
+    redis_client = video_gateway.package.redis_client
+    views.ensure_views_group(redis_client)
+    redis_client.xadd(views.VIEWS_STREAM, {"user": 1, "media": 1, "time": datetime.datetime.now().isoformat()})
+
+    def failing_write(*args):
+        raise RuntimeError("database down")
+
+    original, views.write_views = views.write_views, failing_write
+    try:
+        for _ in range(views.MAX_DELIVERIES):
+            with pytest.raises(RuntimeError):
+                with video_gateway.app.app_context():
+                    views.flush_views(redis_client, video_gateway.session(), "worker")
+    finally:
+        views.write_views = original
+
+    # The next flush moves it aside, acknowledged, and goes on with new entries
+    with video_gateway.app.app_context():
+        assert views.flush_views(redis_client, video_gateway.session(), "worker") == 0
+    dead = redis_client.xrange(views.dead_letter_key(views.VIEWS_STREAM))
+    assert len(dead) == 1 and dead[0][1][b"media"] == b"1"
+    assert redis_client.xpending(views.VIEWS_STREAM, views.VIEWS_GROUP)["pending"] == 0
+    assert redis_client.xlen(views.VIEWS_STREAM) == 0
+
+
+def test_views_are_written_directly_when_redis_is_down(video_gateway, monkeypatch):
+    routes = video_gateway.module("video.routes")
+    ViewHistory = video_gateway.module("database.viewHistory").ViewHistory
+    seeder = Seeder(video_gateway)
+    media_id, user_id = seeder.media(seeder.company()), seeder.user()
+
+    def unavailable(*args):
+        raise redis.ConnectionError("Redis is down")
+
+    monkeypatch.setattr(routes, "record_view", unavailable)
+    client = video_gateway.app.test_client()
+    for _ in range(2):  # The second view updates the row of the first
+        assert client.get(f"/video/{media_id}/get", headers=auth_headers(video_gateway, user_id)).status_code == 200
+
+    with video_gateway.app.app_context():
+        rows = video_gateway.session().query(ViewHistory.IdUser, ViewHistory.IdMedia, ViewHistory.ViewCount).all()
+    assert rows == [(user_id, media_id, 2)]
+
+
+def test_stopped_worker_removes_its_consumer(video_gateway):
+    views = video_gateway.module("helpers.views")
+    redis_client = video_gateway.package.redis_client
+    stream, group = views.VIEWS_STREAM, views.VIEWS_GROUP
+    views.ensure_views_group(redis_client)
+    redis_client.xadd(stream, {"user": 1, "media": 1, "time": datetime.datetime.now().isoformat()})
+    redis_client.xreadgroup(group, "host-0", {stream: ">"})  # Stopped before acknowledging it
+    redis_client.xreadgroup(group, "host-1", {stream: ">"})
+
+    assert views.remove_consumer(redis_client, stream, group, "host-1")
+    assert not views.remove_consumer(redis_client, stream, group, "host-0")  # Would drop its pending entry
+    assert views.remove_idle_consumers(redis_client, stream, group, idle_ms=0) == []
+
+    redis_client.xautoclaim(stream, group, "host-2", 0, start_id="0-0")  # Another worker takes the entry over
+    assert views.remove_idle_consumers(redis_client, stream, group, idle_ms=0) == [b"host-0"]
+    assert [consumer["name"] for consumer in redis_client.xinfo_consumers(stream, group)] == [b"host-2"]
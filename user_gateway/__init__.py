@@ -3,15 +3,16 @@ from flask import Flask
 from flasgger import Swagger
 import redis
 from dotenv import load_dotenv
-from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker, declarative_base
+from sqlalchemy.orm import declarative_base
 import os
+from .helpers.sessions import create_engines, create_request_session, register_pool_route
 
 load_dotenv()
 
 app: Flask = Flask(__name__)
 app.config["SECRET_KEY"] = os.getenv("SECRET_KEY")
 app.config["TOKEN_TIMEOUT"] = os.getenv("TOKEN_TIMEOUT")
+app.config["REFRESH_TOKEN_TIMEOUT"] = os.getenv("REFRESH_TOKEN_TIMEOUT") or 43200  # 30 days
 swagger_template = {
     "uiversion": 3,
     "openapi": "3.0.3",
@@ -48,22 +49,26 @@ redis_db = int(os.getenv("REDIS_DB") or 0)
 
 redis_client = redis.Redis(host=redis_host, port=redis_port, db=redis_db, username=redis_username, password=redis_password)
 
-# Database connection
-db_user = os.getenv("DB_USER")
-db_password = os.getenv("DB_PASSWORD")
-db_host = os.getenv("DB_HOST")
-db_name = os.getenv("DB_NAME")
+# Password hashing cost
+# BCRYPT_ROUNDS (4-31) pins the work factor, otherwise it is calibrated to BCRYPT_TARGET_MS
+from .helpers.passwords import get_deployment_rounds
+app.config["BCRYPT_TARGET_MS"] = int(os.getenv("BCRYPT_TARGET_MS") or 250)
+app.config["BCRYPT_ROUNDS"] = get_deployment_rounds(redis_client, os.getenv("BCRYPT_ROUNDS"),
+                                                    app.config["BCRYPT_TARGET_MS"])
+app.config["BCRYPT_ROUNDS_PINNED"] = bool(os.getenv("BCRYPT_ROUNDS"))
 
-DATABASE_URL = f"mysql+pymysql://{db_user}:{db_password}@{db_host}/{db_name}"
-engine = create_engine(DATABASE_URL)
-Session = sessionmaker(bind=engine)
+# Database connection pools (DB_POOL_*) and optional read replicas (DB_REPLICA_*)
+engine, replica_router = create_engines(app, redis_client)
+
+# One session per request, connection is returned on app context teardown
+Session = create_request_session(app, engine, replica_router)
 Base = declarative_base()
 
 from .database import accessLevels, comments, companies, \
     media, mediaTagsConnector, ratings, ratingTypes, searchHistory, \
     subscribers, tags, userRoles, users, viewHistory, mediaPreview, \
-    logos, reports
-Base.metadata.create_all(engine)
+    logos, reports, schemaVersion
+# Schema is created and migrated by database.migrations, once per deploy
 
 # Configuration for uploads
 # UPLOAD_FOLDER = 'uploads'  # Directory to store uploaded files
@@ -88,3 +93,6 @@ Base.metadata.create_all(engine)
 @app.route("/")
 def home():
     return "<h1>Hello World from user routes!</h1>"
+
+
+register_pool_route(app, engine, replica_router)
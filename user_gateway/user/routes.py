@@ -2,15 +2,19 @@ from .. import app, redis_client, Session
 from .users import *
 from flask import Flask, request, jsonify, redirect, url_for
 import datetime
-import bcrypt
 from sqlalchemy import exc
-from ..helpers.functions import (generate_token, token_required, after_token_required,
+from sqlalchemy.orm import selectinload, joinedload
+from ..helpers.functions import (generate_token, token_required,
                         has_admin_access, has_company_owner_access,
-                        has_moderator_access, get_access_level_by_name)
+                        has_moderator_access, get_access_level_by_name,
+                        generate_refresh_token, rotate_refresh_token, revoke_refresh_tokens)
+from ..helpers.passwords import hash_password, check_password, get_password_rounds
+from ..helpers.search_events import publish_search_event, USER
 from ..database.users import Users
 from ..database.companies import Companies
 from ..database.accessLevels import AccessLevels
 from ..database.userRoles import UserRoles
+from ..database.subscribers import Subscribers
 
 # Fix for pylsp
 app: Flask
@@ -55,6 +59,9 @@ responses:
             token:
               type: string
               description: The authentication token for the user.
+            refresh_token:
+              type: string
+              description: Long-lived token to obtain new authentication tokens via /profile/refresh.
             is_admin:
               type: boolean
               description: Whether the user has admin privileges.
@@ -83,8 +90,19 @@ responses:
     session = Session()
     try:
         user = session.query(Users).filter_by(LoginUser=username).first()
-        if user and user.IsActive and bcrypt.checkpw(password.encode('utf-8'), user.Password.encode('utf-8')):
+        if user and user.IsActive and check_password(password, user.Password):
+            rounds = password_rounds()
+            if get_password_rounds(user.Password) != rounds:
+                # Move stored hash to the currently configured cost
+                try:
+                    user.Password = hash_password(password, rounds)
+                    session.commit()
+                except exc.SQLAlchemyError as e:
+                    session.rollback()
+                    app.logger.warning(f"Failed to rehash password for user {user.IdUser}: {e}")
+
             token = generate_token(app, redis_client, user.IdUser)
+            refresh_token = generate_refresh_token(app, redis_client, user.IdUser)
             is_admin = has_admin_access(user, session)
             is_mod = has_moderator_access(user, session)
             is_comp_owner = has_company_owner_access(user, session)
@@ -92,6 +110,7 @@ responses:
             return jsonify({
                 'user_id': user.IdUser, 
                 'token': token,
+                'refresh_token': refresh_token,
                 'is_admin': is_admin,
                 'is_mod': is_mod,
                 'is_comp_owner': is_comp_owner,
@@ -107,7 +126,6 @@ responses:
 
 @app.post("/profile/logout")
 @token_required(app, redis_client, Session)
-@after_token_required
 def logout(current_user, session):
     """
 Logs out a user from the application.
@@ -133,9 +151,85 @@ responses:
     token = request.headers['Authorization'].split(" ")[1]
     redis_client.delete(f"user:{current_user.IdUser}:token")
     redis_client.delete(f"token:{token}")
+    revoke_refresh_tokens(redis_client, current_user.IdUser)
     return jsonify({'message': 'Logged out successfully'}), 200
 
 
+@app.post("/profile/refresh")
+def refresh():
+    """
+Issues a new authentication token in exchange for a refresh token.
+
+Refresh tokens are single-use: every call returns a new refresh token that replaces
+the one sent. Sending an already used refresh token revokes all tokens issued from it.
+---
+tags:
+  - User profile
+requestBody:
+  required: true
+  content:
+    application/json:
+      schema:
+        type: object
+        required:
+          - refresh_token
+        properties:
+          refresh_token:
+            type: string
+            description: The refresh token received from login or a previous refresh.
+responses:
+  200:
+    description: Token refreshed successfully.
+    content:
+      application/json:
+        schema:
+          type: object
+          properties:
+            user_id:
+              type: integer
+              description: The ID of the user.
+            token:
+              type: string
+              description: The new authentication token.
+            refresh_token:
+              type: string
+              description: The new refresh token.
+            message:
+              type: string
+              description: Success message.
+  401:
+    description: Refresh token is missing, invalid, expired or was already used, or the user is no longer active.
+  500:
+    description: Internal server error during token refresh.
+"""
+    data = request.get_json(silent=True)
+
+    if not data or not data.get('refresh_token'):
+        return jsonify({'message': 'Refresh token is missing!'}), 401
+
+    try:
+        user_id, refresh_token = rotate_refresh_token(app, redis_client, data.get('refresh_token'))
+        if not user_id:
+            return jsonify({'message': 'Refresh token is invalid!'}), 401
+
+        user = Session().query(Users.IsActive).filter_by(IdUser=user_id).first()
+        if not user or not user.IsActive:
+            # Deactivated or deleted since the token was issued
+            revoke_refresh_tokens(redis_client, user_id)
+            return jsonify({'message': 'User not found'}), 401
+
+        token = generate_token(app, redis_client, user_id)
+        return jsonify({
+            'user_id': user_id,
+            'token': token,
+            'refresh_token': refresh_token,
+            'message': "success"
+        }), 200
+    except Exception as e:
+        app.logger.error(f"Error during token refresh: {e}")
+        return jsonify({'message': 'Token refresh failed'}), 500
+
+
 @app.get("/profile/")
 def profile_redir():
     return redirect(url_for('profile'), 302)
@@ -143,7 +237,6 @@ def profile_redir():
 
 @app.get("/profile")
 @token_required(app, redis_client, Session)
-@after_token_required
 def profile(current_user, session):
     """
 Retrieves the profile information of the currently logged-in user.
@@ -205,7 +298,10 @@ responses:
     description: Internal server error while retrieving user profile.
 """
     try:
-        user = session.query(Users).filter_by(IdUser=current_user.IdUser).first()
+        user = session.query(Users).options(
+            selectinload(Users.user_roles).joinedload(UserRoles.companies),
+            selectinload(Users.user_roles).joinedload(UserRoles.access_levels)
+        ).filter_by(IdUser=current_user.IdUser).first()
         if not user:
             return jsonify({'message': 'User not found'}), 404  # Should not happen if token_required is working correctly
 
@@ -252,7 +348,6 @@ responses:
 
 @app.get("/profile/subscriptions")
 @token_required(app, redis_client, Session)
-@after_token_required
 def get_profile_subscriptions(current_user, session):
     """
 Retrieves a list of companies the currently logged-in user is subscribed to.
@@ -287,14 +382,15 @@ responses:
         if not user:
             return jsonify({'message': 'User not found'}), 404  # Should not happen if token_required is working correctly
 
-        subscriptions = []
-        for subscription in user.subscribers:
-            company = session.query(Companies).filter_by(IdCompany=subscription.IdCompany).first()
-            if company: # Handle cases where company might have been deleted
-                subscriptions.append({
-                    "company_id": subscription.IdCompany,
-                    "company_name": company.Name
-                })
+        # Inner join skips subscriptions to companies that were deleted
+        subscribed_companies = session.query(Companies.IdCompany, Companies.Name)\
+                                      .join(Subscribers, Subscribers.IdCompany == Companies.IdCompany)\
+                                      .filter(Subscribers.IdUser == user.IdUser).all()
+
+        subscriptions = [{
+            "company_id": company_id,
+            "company_name": company_name
+        } for company_id, company_name in subscribed_companies]
 
         return jsonify(subscriptions), 200
 
@@ -385,7 +481,7 @@ responses:
         return jsonify({'message': 'Passwords do not match'}), 400
 
 
-    hashed_password = bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt()).decode('utf-8')
+    hashed_password = hash_password(password, password_rounds())
 
     session = Session()
     try:
@@ -405,6 +501,7 @@ responses:
         session.add(new_user_role)
 
         session.commit()
+        publish_search_event(redis_client, USER, [new_user.IdUser])
         return jsonify({'message': 'User registered successfully'}), 201
     except exc.IntegrityError as e: # Catch IntegrityError (most common MySQL errors)
         session.rollback()
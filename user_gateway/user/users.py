@@ -2,20 +2,27 @@ from .. import app, redis_client, Session
 from ..database.users import Users
 from ..helpers.functions import (token_required, company_owner_level,
     user_or_admin_required, user_has_access_level,
-    get_access_level_by_name, after_token_required)
+    get_access_level_by_name, admin_level,
+    revoke_refresh_tokens)
+from ..helpers.passwords import hash_password, check_password, get_current_rounds, recalibrate_rounds
+from ..helpers.search_events import publish_search_event, USER
 from flask import Flask, request, jsonify
+from sqlalchemy import func
 from sqlalchemy.exc import IntegrityError
-import bcrypt
 import redis
 
 app: Flask
 redis_client: redis.Redis
 
 
+def password_rounds():
+    """Work factor for new password hashes, shared by all workers (see helpers/passwords.py)."""
+    return get_current_rounds(redis_client, app.config['BCRYPT_ROUNDS'], app.config['BCRYPT_ROUNDS_PINNED'])
+
+
 @app.get('/users/search')
 @token_required(app, redis_client, Session)
 @company_owner_level
-@after_token_required
 def search_users(user, session):
     """
 Searches for users based on their email (company owners and higher).
@@ -77,9 +84,101 @@ responses:
         app.logger.exception(f"Error searching users: {e}")
         return jsonify({'message': 'Internal server error'}), 500
 
+@app.get('/users/password-costs')
+@token_required(app, redis_client, Session)
+@admin_level
+def get_password_costs(user, session):
+    """
+Reports the distribution of bcrypt work factors among stored passwords (Admin only).
+
+Hashes are moved to the configured cost on successful login, so this shows
+how far the user base is from the current target.
+---
+tags:
+    - Users
+security:
+  - bearerAuth: []
+responses:
+  200:
+    description: Distribution of password hash costs.
+    content:
+      application/json:
+        schema:
+          type: object
+          properties:
+            target_rounds:
+              type: integer
+              description: Work factor used for new hashes in this deployment.
+            costs:
+              type: object
+              description: Number of users per work factor (e.g. {"10": 5, "12": 120}).
+  403:
+    description: Forbidden. Admin access required.
+  500:
+    description: Internal server error.
+"""
+    try:
+        # bcrypt hashes look like $2b$12$..., so the cost is at position 5
+        cost = func.substr(Users.Password, 5, 2)
+        rows = session.query(cost, func.count(Users.IdUser)).group_by(cost).all()
+
+        return jsonify({
+            'target_rounds': password_rounds(),
+            'costs': {str(row_cost): count for row_cost, count in rows}
+        }), 200
+
+    except Exception as e:
+        app.logger.exception(f"Error getting password costs: {e}")
+        return jsonify({'message': 'Internal server error'}), 500
+
+
+@app.post('/users/password-costs/recalibrate')
+@token_required(app, redis_client, Session)
+@admin_level
+def recalibrate_password_cost(user, session):
+    """
+Calibrates the bcrypt work factor again, after a hardware change for instance (Admin only).
+
+The new cost is shared through Redis, so every worker hashes new passwords with it
+and rehashes existing ones on login.
+---
+tags:
+    - Users
+security:
+  - bearerAuth: []
+responses:
+  200:
+    description: The work factor now used for new hashes.
+    content:
+      application/json:
+        schema:
+          type: object
+          properties:
+            target_rounds:
+              type: integer
+              description: Work factor used for new hashes in this deployment.
+  403:
+    description: Forbidden. Admin access required.
+  409:
+    description: The work factor is pinned by BCRYPT_ROUNDS.
+  500:
+    description: Internal server error.
+"""
+    if app.config['BCRYPT_ROUNDS_PINNED']:
+        return jsonify({'message': 'Work factor is pinned by BCRYPT_ROUNDS'}), 409
+
+    try:
+        rounds = recalibrate_rounds(redis_client, app.config['BCRYPT_TARGET_MS'])
+        app.logger.info(f"bcrypt work factor recalibrated to {rounds} by user {user.IdUser}")
+        return jsonify({'target_rounds': rounds}), 200
+
+    except Exception as e:
+        app.logger.exception(f"Error recalibrating password cost: {e}")
+        return jsonify({'message': 'Internal server error'}), 500
+
+
 @app.get("/users/<int:id>")
 @token_required(app, redis_client, Session)
-@after_token_required
 def get_user_info(user, session, id):
     """
 Retrieves information about a specific user.
@@ -157,7 +256,6 @@ responses:
 @app.put('/users/<int:id>')
 @token_required(app, redis_client, Session)
 @user_or_admin_required
-@after_token_required
 def update_user(user, session, id):
     """
 Updates user information. Accessible to the user themselves or an admin.
@@ -204,7 +302,7 @@ requestBody:
             description: Current user's password.
           newPassword:
             type: string
-            description: New user's password.
+            description: New user's password. Changing it revokes the user's refresh and access tokens.
 responses:
   200:
     description: User information retrieved successfully.
@@ -266,7 +364,7 @@ responses:
         user_to_update.Surname = data.get('surname', user_to_update.Surname)
         user_to_update.Patronymic = data.get('patronymic', user_to_update.Patronymic)
         user_to_update.LoginUser = data.get('login', user_to_update.LoginUser)
-        user_to_update.Birthday = data.get('birthday', user_to_update.Birthday.isoformat())
+        user_to_update.Birthday = data.get('birthday', user_to_update.Birthday)
 
         # Password update logic
         old_password = data.get('oldPassword')
@@ -275,16 +373,20 @@ responses:
         am_i_admin = user_has_access_level(user, get_access_level_by_name(session, "Admin"), session)
 
         if old_password and new_password and not am_i_admin:
-            if bcrypt.checkpw(old_password.encode('utf-8'), user_to_update.Password.encode('utf-8')):
-                user_to_update.Password = bcrypt.hashpw(new_password.encode('utf-8'), bcrypt.gensalt()).decode('utf-8')
+            if check_password(old_password, user_to_update.Password):
+                user_to_update.Password = hash_password(new_password, password_rounds())
             else:
                 return jsonify({'message': 'Incorrect current password'}), 400
         elif new_password and am_i_admin:
-            user_to_update.Password = bcrypt.hashpw(new_password.encode('utf-8'), bcrypt.gensalt()).decode('utf-8')
+            user_to_update.Password = hash_password(new_password, password_rounds())
         elif old_password or new_password:
             return jsonify({'message': 'Both old and new passwords are required'}), 400
 
         session.commit()
+        if new_password:
+            # A stolen refresh token must not outlive the password
+            revoke_refresh_tokens(redis_client, user_to_update.IdUser)
+        publish_search_event(redis_client, USER, [id])
         return jsonify({'message': 'User updated successfully'}), 200
 
     except IntegrityError as e:
@@ -299,7 +401,6 @@ responses:
 @app.delete('/users/<int:id>')
 @token_required(app, redis_client, Session)
 @user_or_admin_required
-@after_token_required
 def delete_user(user, session, id):
     """
     Marks a user as inactive (soft delete). Accessible to the user themselves or an admin.
@@ -331,12 +432,14 @@ def delete_user(user, session, id):
 
         user_to_delete.IsActive = False  # Soft delete: Mark as inactive
         session.commit()
+        publish_search_event(redis_client, USER, [id])
         
         # Retrieving current user token, if exist
         current_token = redis_client.get(f"user:{user_to_delete.IdUser}:token")
         if current_token:
             redis_client.delete(f"user:{user_to_delete.IdUser}:token")
             redis_client.delete(f"token:{current_token.decode('utf-8')}")
+        revoke_refresh_tokens(redis_client, user_to_delete.IdUser)
 
         return jsonify({'message': 'User deleted successfully'}), 200
 
@@ -5,16 +5,20 @@ from ..database.media import Media
 from ..database.users import Users
 from ..database.reports import Reports
 from .. import app, Session, redis_client
-from ..helpers.functions import token_required, after_token_required, has_moderator_access
+from ..helpers.functions import token_required, has_moderator_access
+from ..helpers.pagination import paginate_request, next_cursor_headers, PaginationError
 from sqlalchemy import exc
+from sqlalchemy.orm import joinedload, selectinload
 
 
 @app.get('/video/<int:v>/comments')
 @token_required(app, redis_client, Session)
-@after_token_required
 def get_video_comments(user, session, v):
     """
 Retrieves all comments for a specific video.
+
+Returns at most `limit` items (50 by default), where it used to return the whole list:
+follow the X-Next-Cursor header until a response comes without it.
 ---
 security:
   - bearerAuth: []
@@ -27,9 +31,21 @@ parameters:
     type: integer
     required: true
     description: The ID of the video for which to retrieve comments.
+  - in: query
+    name: limit
+    type: integer
+    description: Maximum number of items to return (default 50, at most 200).
+  - in: query
+    name: cursor
+    type: string
+    description: Value of the X-Next-Cursor header from the previous page.
 responses:
   200:
     description: List of video comments retrieved successfully.
+    headers:
+      X-Next-Cursor:
+        type: string
+        description: Cursor of the next page. Missing on the last page.
     content:
       application/json:
         schema:
@@ -61,6 +77,8 @@ responses:
               reported:
                 type: boolean
                 description: Whether this message is reported. This is for moderators only.
+  400:
+    description: Invalid limit or cursor.
   404:
     description: Video not found.
   500:
@@ -71,7 +89,10 @@ responses:
         if not media:
             return jsonify({'message': 'Video not found'}), 404
 
-        comments = session.query(Comments).filter_by(IdMedia=v).all()
+        comments, next_cursor = paginate_request(
+            session.query(Comments).options(joinedload(Comments.users), selectinload(Comments.reports)).filter_by(IdMedia=v),
+            (Comments.Date, Comments.IdComment), request, descending=False  # Oldest first, as in a thread
+        )
 
         has_weak_moderator = has_moderator_access(user, session, media.IdCompany)
         has_strong_moderator = has_moderator_access(user, session, media.IdCompany, False)
@@ -88,8 +109,10 @@ responses:
                 "reported": True if comment.reports and has_strong_moderator else False
             })
 
-        return jsonify(comment_list), 200
+        return jsonify(comment_list), 200, next_cursor_headers(next_cursor)
 
+    except PaginationError as e:
+        return jsonify({'message': str(e)}), 400
     except Exception as e:
         app.logger.exception(f"Error retrieving comments: {e}")
         return jsonify({'message': 'Error retrieving comments'}), 500
@@ -97,7 +120,6 @@ responses:
 
 @app.post('/video/<int:v>/comments')
 @token_required(app, redis_client, Session)
-@after_token_required
 def add_video_comment(user, session, v):
     """
 Adds a new comment to a video.
@@ -200,7 +222,6 @@ responses:
 
 @app.delete('/comments/<int:comment_id>')
 @token_required(app, redis_client, Session)
-@after_token_required
 def delete_video_comment(current_user, session, comment_id):
     """
 Deletes a specific comment.
@@ -268,7 +289,6 @@ responses:
 
 @app.post('/comments/<int:id>/report')
 @token_required(app, redis_client, Session)
-@after_token_required
 def report_comment(user, session, id):
     """
     Creates a new report for a comment.
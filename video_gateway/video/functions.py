@@ -13,10 +13,15 @@ from ..database.ratingTypes import RatingTypes
 from ..database.tags import Tags
 from ..database.mediaTagsConnector import MediaTagsConnector
 import uuid
-from sqlalchemy import func, and_, or_
+from sqlalchemy import func, and_, or_, insert, exc
+from ..helpers.cards import MediaCard, media_card_query, load_media_tags
+from ..helpers.stats import get_media_stats
 
 app: Flask
 
+MYSQL_DEADLOCK = 1213  # ER_LOCK_DEADLOCK
+RATING_ATTEMPTS = 3  # Writes of a rating, retried when a concurrent request of the same user wins
+
 def allowed_file(filename):
     return '.' in filename and \
            filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
@@ -71,27 +76,67 @@ def generate_temporary_link(media_id, filename, host):
     return f"/stream/{link_id}/{encoded_filename}"
 
 
+_rating_type_ids = {}  # RatingFactor -> IdRatingType, rating types never change at runtime
+
+
+def get_rating_type_ids(session):
+    """Returns the id of every rating type by its factor, loaded once per process."""
+    if not _rating_type_ids:
+        _rating_type_ids.update({factor: type_id for type_id, factor
+                                 in session.query(RatingTypes.IdRatingType, RatingTypes.RatingFactor)})
+    return _rating_type_ids
+
+
+def get_rating_factor(session, rating_type_id):
+    """Returns the factor of a rating type id, 0 if it is unknown or None."""
+    for factor, type_id in get_rating_type_ids(session).items():
+        if type_id == rating_type_id:
+            return factor
+    return 0
+
+
+def get_user_rating(session, media_id, user_id, for_update=False):
+    """
+    Returns the rating factor a user gave a media, 0 if they didn't rate it.
+    With for_update, the rating stays locked until the transaction ends.
+    """
+    query = session.query(Ratings.IdRatingType).filter_by(IdUser=user_id, IdMedia=media_id)
+    if for_update:
+        query = query.with_for_update()
+    return get_rating_factor(session, query.scalar())
+
+
+def add_rating(session, media_id, user_id, rating_type_id):
+    """Inserts a rating. Fails on the unique (IdUser, IdMedia) key if the user rated the media meanwhile."""
+    session.execute(insert(Ratings).values(IdUser=user_id, IdMedia=media_id, IdRatingType=rating_type_id,
+                                           RatingTime=datetime.datetime.now()))
+
+
+def update_rating(session, media_id, user_id, rating_type_id):
+    session.query(Ratings).filter_by(IdUser=user_id, IdMedia=media_id).update(
+        {"IdRatingType": rating_type_id, "RatingTime": datetime.datetime.now()}, synchronize_session=False)
+
+
+def delete_rating(session, media_id, user_id):
+    """Removes the rating of a user. Returns whether there was one."""
+    return session.query(Ratings).filter_by(IdUser=user_id, IdMedia=media_id).delete(synchronize_session=False) > 0
+
+
+def is_rating_conflict(session, media_id, error):
+    """
+    Whether a rating write failed because a concurrent request of the same user rated the media
+    first: both found no rating, and the other one's insert won (duplicate key, or InnoDB picked
+    this transaction as the victim of the deadlock of their gap locks). Call after the rollback.
+    """
+    if isinstance(error, exc.OperationalError):
+        return getattr(error.orig, "args", (None,))[0] == MYSQL_DEADLOCK
+    return session.query(Media.IdMedia).filter_by(IdMedia=media_id).scalar() is not None  # Else the video is missing
+
+
 def get_rating_counts(session, media_id, user_id):
     """Retrieves like/dislike counts and user's rating."""
-    likes = session.query(func.count(Ratings.IdRating)).filter(
-        Ratings.IdMedia == media_id,
-        Ratings.IdRatingType == 2  # Like
-    ).scalar() or 0
-
-    dislikes = session.query(func.count(Ratings.IdRating)).filter(
-        Ratings.IdMedia == media_id,
-        Ratings.IdRatingType == 3  # Dislike
-    ).scalar() or 0
-
-    user_rating = session.query(Ratings).filter_by(IdUser=user_id, IdMedia=media_id).first()
-    user_rating_value = 0  # Default: no rating
-    if user_rating:
-        if user_rating.IdRatingType == 2:
-            user_rating_value = 1  # Like
-        elif user_rating.IdRatingType == 3:
-            user_rating_value = -1  # Dislike
-
-    return likes, dislikes, user_rating_value
+    stats = get_media_stats(redis_client, session, media_id)
+    return stats["likes"], stats["dislikes"], get_user_rating(session, media_id, user_id)
 
 def get_chunk(byte1: Optional[int] = None, byte2: Optional[int] = None, filepath: str = None) -> Tuple[bytes, int, int, int]:
     """
@@ -148,7 +193,22 @@ def calculate_time_decay(rating_time):
     return decay_factor
 
 
+def get_rating_weights(session, media_ids):
+    """Returns time-decayed (like weight, dislike weight) per media, loading all ratings in one query."""
+    weights = {media_id: [0, 0] for media_id in media_ids}
+    if not weights:
+        return weights
+
+    ratings = session.query(Ratings.IdMedia, Ratings.RatingTime, RatingTypes.RatingFactor)\
+                     .join(Ratings.rating_types)\
+                     .filter(Ratings.IdMedia.in_(weights.keys()), RatingTypes.RatingFactor.in_((1, -1))).all()
+    for media_id, rating_time, rating_factor in ratings:
+        weights[media_id][0 if rating_factor == 1 else 1] += calculate_time_decay(rating_time)
+    return weights
+
+
 def recommendation_generator(user, session, num_recent_videos, recent_videos, is_audio=False):
+    """Returns up to 10 (more if the user has history) recommended media as MediaCard rows."""
     recommended_videos = []
 
     if num_recent_videos > 0:
@@ -165,35 +225,32 @@ def recommendation_generator(user, session, num_recent_videos, recent_videos, is
             tag_counts = Counter(recent_tag_ids) # Count tag occurrences
             one_week_ago = datetime.datetime.now() - datetime.timedelta(days=7)
 
-            personalized_recommendations = session.query(Media).join(Media.tags).filter(
-                Tags.IdTag.in_(recent_tag_ids),
+            personalized_recommendations = media_card_query(session).filter(
+                Media.tags.any(Tags.IdTag.in_(recent_tag_ids)),
                 Media.UploadTime >= one_week_ago,
                 ~Media.IdMedia.in_(recent_video_ids),
                 or_(*[Media.VideoPath.ilike(f"%{ext}") for ext in (ALLOWED_AUDIO_EXTENSIONS if is_audio else ALLOWED_VIDEO_EXTENSIONS) ])
             ).order_by(Media.UploadTime.desc()).all()
         else:
-
+            tag_counts = Counter()
             one_week_ago = datetime.datetime.now() - datetime.timedelta(days=7)
 
-            personalized_recommendations = session.query(Media).filter(
+            personalized_recommendations = media_card_query(session).filter(
                 Media.UploadTime >= one_week_ago,
                 ~Media.IdMedia.in_(recent_video_ids),
                 or_(*[Media.VideoPath.ilike(f"%{ext}") for ext in (ALLOWED_AUDIO_EXTENSIONS if is_audio else ALLOWED_VIDEO_EXTENSIONS) ])
             ).order_by(Media.UploadTime.desc()).all()
 
+        personalized_recommendations = [MediaCard._make(row) for row in personalized_recommendations]
+        media_ids = [video.IdMedia for video in personalized_recommendations]
+        rating_weights = get_rating_weights(session, media_ids)
+        media_tags = load_media_tags(session, media_ids)
         weighted_videos = []
         for video in personalized_recommendations:
-            weight = sum(tag_counts[tag.IdTag] for tag in video.tags if tag.IdTag in tag_counts)
-
-            # Incorporate likes and dislikes
-            likes = session.query(Ratings).join(Ratings.rating_types)\
-                           .filter(Ratings.IdMedia == video.IdMedia, RatingTypes.RatingFactor == 1).all()
-            dislikes = session.query(Ratings).join(Ratings.rating_types)\
-                              .filter(Ratings.IdMedia == video.IdMedia, RatingTypes.RatingFactor == -1).all()
+            weight = sum(tag_counts[tag.IdTag] for tag in media_tags.get(video.IdMedia, []) if tag.IdTag in tag_counts)
 
             # Adjust weight based on likes and dislikes
-            like_weight = sum(calculate_time_decay(rating.RatingTime) for rating in likes) if likes else 0
-            dislike_weight = sum(calculate_time_decay(rating.RatingTime) for rating in dislikes) if dislikes else 0
+            like_weight, dislike_weight = rating_weights[video.IdMedia]
 
             weight += like_weight * 0.5 - dislike_weight * 0.2
             weighted_videos.append((video, weight))
@@ -204,17 +261,13 @@ def recommendation_generator(user, session, num_recent_videos, recent_videos, is
     if len(recommended_videos) < 10:  # Cold start problem
         num_to_fill = 10 - len(recommended_videos)
         one_week_ago = datetime.datetime.now() - datetime.timedelta(days=7)
-        coldstart_recommendations = session.query(Media).filter(~Media.IdMedia.in_([video.IdMedia for video in recommended_videos]), or_(*[Media.VideoPath.ilike(f"%{ext}") for ext in (ALLOWED_AUDIO_EXTENSIONS if is_audio else ALLOWED_VIDEO_EXTENSIONS) ]))\
+        coldstart_recommendations = media_card_query(session).filter(~Media.IdMedia.in_([video.IdMedia for video in recommended_videos]), or_(*[Media.VideoPath.ilike(f"%{ext}") for ext in (ALLOWED_AUDIO_EXTENSIONS if is_audio else ALLOWED_VIDEO_EXTENSIONS) ]))\
                                            .order_by(Media.UploadTime.desc()).all()
+        coldstart_recommendations = [MediaCard._make(row) for row in coldstart_recommendations]
+        rating_weights = get_rating_weights(session, [video.IdMedia for video in coldstart_recommendations])
         weighted_coldstart_videos = []
         for video in coldstart_recommendations:
-            likes = session.query(Ratings).join(Ratings.rating_types)\
-                           .filter(Ratings.IdMedia == video.IdMedia, RatingTypes.RatingFactor == 1).all()
-            dislikes = session.query(Ratings).join(Ratings.rating_types)\
-                              .filter(Ratings.IdMedia == video.IdMedia, RatingTypes.RatingFactor == -1).all()
-
-            like_weight = sum(calculate_time_decay(rating.RatingTime) for rating in likes) if likes else 0
-            dislike_weight = sum(calculate_time_decay(rating.RatingTime) for rating in dislikes) if dislikes else 0
+            like_weight, dislike_weight = rating_weights[video.IdMedia]
 
             weight = like_weight * 0.5 - dislike_weight * 0.2
             weighted_coldstart_videos.append((video, weight))
@@ -1,6 +1,9 @@
 from .. import app, redis_client, Session
-from flask import Flask, jsonify
-from ..helpers.functions import token_required, after_token_required, moderator_level, get_access_level_by_name
+from flask import Flask, jsonify, request
+from sqlalchemy.orm import contains_eager, joinedload
+from ..helpers.functions import token_required, moderator_level, get_access_level_by_name
+from ..helpers.sessions import read_only
+from ..helpers.pagination import paginate_request, next_cursor_headers, PaginationError
 from ..database.userRoles import UserRoles
 from ..database.reports import Reports
 from ..database.comments import Comments
@@ -14,18 +17,34 @@ app: Flask
 @app.get('/reports')
 @token_required(app, redis_client, Session)
 @moderator_level
-@after_token_required
+@read_only
 def get_reports(user, session):
     """
     Retrieves all reports for companies where the current user is a moderator.
+
+    Returns at most `limit` items (50 by default), where it used to return the whole list:
+    follow the X-Next-Cursor header until a response comes without it.
     ---
     security:
       - bearerAuth: []
     tags:
       - Reports
+    parameters:
+      - in: query
+        name: limit
+        type: integer
+        description: Maximum number of items to return (default 50, at most 200).
+      - in: query
+        name: cursor
+        type: string
+        description: Value of the X-Next-Cursor header from the previous page.
     responses:
       200:
         description: List of reports retrieved successfully.
+        headers:
+          X-Next-Cursor:
+            type: string
+            description: Cursor of the next page. Missing on the last page.
         content:
           application/json:
             schema:
@@ -61,6 +80,8 @@ def get_reports(user, session):
                   video_name:
                       type: string
                       description: Name of a reported video.
+      400:
+        description: Invalid limit or cursor.
       500:
         description: Internal server error.
     """
@@ -83,9 +104,12 @@ def get_reports(user, session):
         company_ids = [mc.IdCompany for mc in moderated_companies]
 
         # Get reports for comments from videos from moderated companies
-        reports = session.query(Reports).join(Reports.comments)\
-                         .join(Comments.media).join(Media.companies)\
-                         .filter(Companies.IdCompany.in_(company_ids)).all()
+        reports_query = session.query(Reports).join(Reports.comments)\
+                               .join(Comments.media).join(Media.companies)\
+                               .options(contains_eager(Reports.comments).contains_eager(Comments.media),
+                                        contains_eager(Reports.comments).joinedload(Comments.users))\
+                               .filter(Companies.IdCompany.in_(company_ids))
+        reports, next_cursor = paginate_request(reports_query, (Reports.ReportTime, Reports.IdReport), request)
 
         report_list = []
         for report in reports:
@@ -101,8 +125,10 @@ def get_reports(user, session):
                 "video_name": report.comments.media.NameV,
             })
 
-        return jsonify(report_list), 200
+        return jsonify(report_list), 200, next_cursor_headers(next_cursor)
 
+    except PaginationError as e:
+        return jsonify({'message': str(e)}), 400
     except Exception as e:
         app.logger.exception(f"Error retrieving reports: {e}")
         return jsonify({'message': 'Internal server error'}), 500
@@ -111,7 +137,6 @@ def get_reports(user, session):
 @app.post('/reports/<int:id>/approve')
 @token_required(app, redis_client, Session)
 @moderator_level
-@after_token_required
 def approve_report(user, session, id):
     """
     Approves a report and deletes the reported comment. (>Moderator)
@@ -163,7 +188,6 @@ def approve_report(user, session, id):
 @app.post('/reports/<int:id>/dismiss')
 @token_required(app, redis_client, Session)
 @moderator_level
-@after_token_required
 def dismiss_report(user, session, id):
     """
     Dismisses a report (removes the report without deleting the comment). (>Moderator)
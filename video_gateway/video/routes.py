@@ -5,11 +5,23 @@ import re
 import json
 import urllib
 import mimetypes
+import redis
 from collections import Counter
 from werkzeug.utils import secure_filename  # For secure filename
 from . import tags, comments, reports
 from .. import app, Session, redis_client, ALLOWED_VIDEO_EXTENSIONS, ALLOWED_AUDIO_EXTENSIONS
-from ..helpers.functions import token_required, after_token_required, company_owner_level
+from ..helpers.functions import token_required, company_owner_level, admin_level
+from ..helpers.sessions import read_only
+from ..helpers.pagination import paginate_request, next_cursor_headers, PaginationError
+from ..helpers.streaming import get_stream_format, stream_query, StreamFormatError
+from ..helpers.cards import media_card_query, serialize_media_cards
+from ..helpers.stats import (get_media_stats, begin_media_stats_update, increment_media_stats,
+                             cancel_media_stats_update, rating_deltas)
+from ..helpers.views import record_view, write_views
+from ..helpers.viewers import count_media_viewers, count_exact_media_viewers
+from ..helpers.deletion import delete_media_batch
+from ..helpers.search_events import publish_search_event, MEDIA
+from ..helpers.suggest import update_suggestion
 from ..database.media import Media
 from ..database.mediaPreview import MediaPreview
 from ..database.tags import Tags
@@ -19,15 +31,16 @@ from ..database.viewHistory import ViewHistory
 from .functions import (allowed_file, allowed_preview_file,
                         get_unique_filepath, generate_temporary_link,
                         get_rating_counts, get_chunk, get_unique_filepath_preview,
-                        recommendation_generator)
+                        recommendation_generator, get_rating_type_ids, get_user_rating,
+                        add_rating, update_rating, delete_rating, is_rating_conflict, RATING_ATTEMPTS)
 from sqlalchemy import exc, func, distinct, or_, and_
+from functools import partial
 
 app: Flask
 
 @app.post('/video/upload')
 @token_required(app, redis_client, Session)  # Protect this endpoint
 @company_owner_level
-@after_token_required
 def upload_video(current_user, session):  # current_user is passed from decorator
     """
 Uploads a video to the application.
@@ -91,7 +104,7 @@ responses:
     try:
         filename = secure_filename(file.filename)
         original_filepath = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-        filepath = get_unique_filepath(original_filepath, Session())
+        filepath = get_unique_filepath(original_filepath, session)
         try:
             app.logger.info(f"File upload started. Future filename: {filename}")
             with open(filepath, 'wb') as f:
@@ -121,7 +134,7 @@ responses:
                 # Save preview
                 preview_filename = secure_filename(preview_file.filename)
                 preview_path = os.path.join(app.config['PREVIEW_FOLDER'], preview_filename)
-                preview_path = get_unique_filepath_preview(preview_path, Session())
+                preview_path = get_unique_filepath_preview(preview_path, session)
                 preview_file.save(preview_path)
                 new_preview_file = True
             else:  # If preview file is not of allowed type
@@ -171,6 +184,8 @@ responses:
 
                     new_media.tags.append(tag)
             session.commit()
+            publish_search_event(redis_client, MEDIA, [new_media.IdMedia])
+            update_suggestion(redis_client, MEDIA, new_media.IdMedia, name)
 
             return jsonify({'message': 'File uploaded successfully'}), 201
         except Exception as e:
@@ -187,7 +202,6 @@ responses:
 @app.put('/video/<int:id>')
 @token_required(app, redis_client, Session)
 @company_owner_level
-@after_token_required
 def update_video(user, session, id):
     """
 Updates a video's information (name, description, tags, and/or preview).
@@ -318,7 +332,10 @@ responses:
                     session.delete(old_preview)
             else:
                 return jsonify({'message': 'Invalid preview file type'}), 400
+        name = video.NameV
         session.commit()
+        publish_search_event(redis_client, MEDIA, [id])
+        update_suggestion(redis_client, MEDIA, id, name)
         return jsonify({'message': 'Video updated successfully'}), 200
 
     except exc.SQLAlchemyError as e:
@@ -333,10 +350,10 @@ responses:
 @app.delete('/video/<int:id>')
 @token_required(app, redis_client, Session)
 @company_owner_level
-@after_token_required
 def delete_video(user, session, id):
     """
-Deletes a video and its associated data (preview, tags, comments, ratings, view history).
+Deletes a video and its associated data (preview, tag links, comments, ratings, view history).
+The files are removed in the background.
 
 Returns a 404 Not Found if the video is not found.
 Returns a 500 Internal Server Error on database errors.
@@ -360,52 +377,10 @@ responses:
     description: Internal server error during video deletion.
 """
     try:
-        video = session.query(Media).filter_by(IdMedia=id).first()
-        if not video:
+        if not delete_media_batch(session, redis_client, [id]):
             return jsonify({'message': 'Video not found'}), 404
 
-        # if video.IdCompany != request.headers.get("X-idCompany"):
-        #     return jsonify({'message': 'video not found'}), 404
-
-        # Remove associated preview if exists
-        if video.IdMediaPreview and video.IdMediaPreview != 1 and video.IdMediaPreview != 2:
-            preview = video.preview
-            if preview:
-                try:
-                    os.remove(preview.PreviewPath)
-                except FileNotFoundError:
-                    pass
-                except Exception as e:
-                    app.logger.exception(f"Error removing video preview: {e}")
-
-        # Remove video tags
-        video.tags = []
-
-        for rating in video.ratings:
-            session.delete(rating)
-
-        for comment in video.comments:
-            for report in comment.reports:
-                session.delete(report)
-            session.delete(comment)
-
-        for view in video.view_history:
-            session.delete(view)
-
-        try:
-            os.remove(video.VideoPath)
-        except FileNotFoundError:
-            pass
-        except Exception as e:
-            app.logger.exception(f"Error removing video file: {e}")
-            return jsonify({'message': 'Error while removing video file'}), 500
-
-        preview = video.preview
-        session.delete(video)
-        if preview.IdMediaPreview != 1 and preview.IdMediaPreview != 2:
-            session.delete(preview)
-        session.commit()
-
+        # The video and preview files are removed by the video worker
         return jsonify({'message': 'Video deleted successfully'}), 200
 
     except exc.SQLAlchemyError as e:
@@ -419,7 +394,6 @@ responses:
 
 @app.route('/video/<int:id>/get')
 @token_required(app, redis_client, Session)
-@after_token_required
 def get_video_link(user, session, id):
     """
 Get temporary link to stream video
@@ -495,7 +469,7 @@ responses:
               description: Total number of times this video has been viewed.
             unique_viewers:
               type: integer
-              description: Number of unique users who have viewed this video.
+              description: Approximate number of unique users who have viewed this video (about 1% error).
   404:
     description: Video not found.
   500:
@@ -506,28 +480,20 @@ responses:
         if not media:
             return jsonify({'message': 'Video not found'}), 404
 
-        # View History Logic
-        view_history_entry = session.query(ViewHistory).filter_by(IdUser=user.IdUser, IdMedia=id).first()
-        if view_history_entry:
-            view_history_entry.ViewTime = datetime.datetime.now()
-            view_history_entry.ViewCount += 1
-        else:
-            new_view_history = ViewHistory(
-                IdUser=user.IdUser,
-                IdMedia=id,
-                ViewTime=datetime.datetime.now()
-            )
-            session.add(new_view_history)
-        session.commit()
+        # View History Logic: the view is queued and written by the video worker
+        try:
+            record_view(redis_client, user.IdUser, id, media.IdCompany)
+        except redis.RedisError as e:
+            app.logger.warning(f"Could not queue view, writing it directly: {e}")
+            write_views(session, redis_client, {(user.IdUser, id): [1, datetime.datetime.now()]})
         # End of View History Logic
 
-        # Get total view count
-        total_views = session.query(func.sum(ViewHistory.ViewCount)).filter(ViewHistory.IdMedia == id).scalar()
-        total_views = int(total_views) if total_views is not None else 0 # Explicitly convert to int
-
-        # Get unique viewer count
-        unique_viewers = session.query(func.count(distinct(ViewHistory.IdUser))).filter(ViewHistory.IdMedia == id).scalar()
-        unique_viewers = int(unique_viewers) if unique_viewers is not None else 0 # Explicitly convert to int
+        # Total views come from the cached counters, unique viewers are approximate
+        total_views = get_media_stats(redis_client, session, id)["views"]
+        try:
+            unique_viewers = count_media_viewers(redis_client, id)
+        except redis.RedisError:
+            unique_viewers = count_exact_media_viewers(session, id)
 
         _, extension = os.path.splitext(media.VideoPath)
 
@@ -557,9 +523,64 @@ responses:
         return jsonify({'message': 'Error generating link'}), 500
 
 
+@app.get('/video/<int:id>/viewers')
+@token_required(app, redis_client, Session)
+@admin_level
+def get_video_viewers(user, session, id):
+    """
+Compares the approximate and exact unique viewer counts of a video (Admin only).
+
+The exact count scans the view history of the video, so it is meant for audits,
+not for regular use.
+---
+security:
+  - bearerAuth: []
+tags:
+  - Video
+parameters:
+  - in: path
+    name: id
+    type: integer
+    required: true
+    description: The ID of the video.
+responses:
+  200:
+    description: Unique viewer counts.
+    content:
+      application/json:
+        schema:
+          type: object
+          properties:
+            approximate:
+              type: integer
+              description: Unique viewers counted by the HyperLogLog.
+            exact:
+              type: integer
+              description: Unique viewers counted from the view history.
+  403:
+    description: Admin access required.
+  404:
+    description: Video not found.
+  500:
+    description: Internal server error.
+"""
+    try:
+        media = session.query(Media).filter_by(IdMedia=id).first()
+        if not media:
+            return jsonify({'message': 'Video not found'}), 404
+
+        return jsonify({
+            'approximate': count_media_viewers(redis_client, id),
+            'exact': count_exact_media_viewers(session, id)
+        }), 200
+
+    except Exception as e:
+        app.logger.exception(f"Error counting video viewers: {e}")
+        return jsonify({'message': 'Internal server error'}), 500
+
+
 @app.get('/video/<int:id>/preview')
 @token_required(app, redis_client, Session)
-@after_token_required
 def get_video_preview(current_user, session, id):
     """
 Retrieves the preview image for a video, if available.
@@ -607,7 +628,6 @@ responses:
 
 @app.post('/video/<int:id>/rating')
 @token_required(app, redis_client, Session)
-@after_token_required
 def rate_video(current_user, session, id):
     """
 Rates a video (like, dislike, or remove rating).
@@ -638,9 +658,13 @@ responses:
       - Rating value is missing in the request body.
       - Invalid rating value (must be 0, 1, or -1).
       - Rating cannot be the same as the previous rating.
+  404:
+    description: Video not found.
+  409:
+    description: Concurrent requests of the same user kept changing the rating, even after retries.
   500:
     description: 
-      - Database integrity error during rating.
+      - Rating types not configured correctly.
       - Error adding/updating rating.
 """
     data = request.get_json()
@@ -652,75 +676,77 @@ responses:
     if rating_value not in (0, 1, -1):
         return jsonify({'message': 'Invalid rating value. Must be 0, 1, or -1'}), 400
 
-    try:
-        media = session.query(Media).filter_by(IdMedia=id).first()
-        if not media:
-            return jsonify({'message': 'Video not found'}), 404
-
-        existing_rating = session.query(Ratings).filter_by(IdUser=current_user.IdUser, IdMedia=id).first()
-
-        if rating_value == 0:  # Remove rating
-            if existing_rating:
-                session.delete(existing_rating)
-                session.commit()
-                likes, dislikes, user_rating_value = get_rating_counts(session, id, current_user.IdUser)
-                return jsonify({
-                    'message': 'Rating removed',
-                    'likes': likes,
-                    'dislikes': dislikes,
-                    'user_rating': user_rating_value
-                }), 200
-            else:
-                return jsonify({'message': 'No rating to remove'}), 200 # Nothing to remove
+    for attempt in range(RATING_ATTEMPTS):
+        try:
+            return apply_rating(session, id, current_user.IdUser, rating_value, repeated=attempt > 0)
+        except (exc.IntegrityError, exc.OperationalError) as e:
+            session.rollback()
+            if is_rating_conflict(session, id, e):
+                # A concurrent request of the same user (a double click) rated the video first:
+                # this one is applied again, over the rating it wrote
+                app.logger.info(f"Concurrent rating of video {id} by user {current_user.IdUser}: {e}")
+                continue
+            if isinstance(e, exc.IntegrityError):
+                app.logger.info(f"Rating of missing video {id}: {e}")
+                return jsonify({'message': 'Video not found'}), 404
+            app.logger.exception(f"Error adding/updating rating: {e}")
+            return jsonify({'message': 'Error adding/updating rating'}), 500
+        except Exception as e:
+            session.rollback()
+            app.logger.exception(f"Error adding/updating rating: {e}")
+            return jsonify({'message': 'Error adding/updating rating'}), 500
+    return jsonify({'message': 'Rating changed by other requests, try again'}), 409
 
-        rating_type = None
-        if rating_value == 1:
-            rating_type = session.query(RatingTypes).filter_by(NameRating="Like").first()
-        elif rating_value == -1:
-            rating_type = session.query(RatingTypes).filter_by(NameRating="Dislike").first()
 
-        if not rating_type:
+def apply_rating(session, media_id, user_id, rating_value, repeated=False):
+    """
+    Writes the rating of rate_video and updates the counters by what it replaced.
+    A repeated attempt that finds the rating already set reports success.
+    """
+    # A missing video is reported by the foreign key of the write, no existence check needed.
+    # The rating stays locked until the commit, so the counters change by what this write replaced.
+    old_rating_value = get_user_rating(session, media_id, user_id, for_update=True)
+
+    if rating_value == 0:  # Remove rating
+        if not old_rating_value:
+            return jsonify({'message': 'No rating to remove'}), 200 # Nothing to remove
+        delete_rating(session, media_id, user_id)
+        message, code = 'Rating removed', 200
+    else:
+        rating_type_id = get_rating_type_ids(session).get(rating_value)
+        if rating_type_id is None:
             return jsonify({'message': 'Rating types not configured correctly'}), 500
 
-        if existing_rating:
-            if existing_rating.IdRatingType == rating_type.IdRatingType:
+        if old_rating_value == rating_value:
+            if not repeated:
                 return jsonify({'message': 'Rating cannot be the same as before.'}), 400
+            session.rollback()  # Written by the request this one raced with
+            stats = get_media_stats(redis_client, session, media_id)
+            return jsonify({'message': 'Rating added', 'likes': stats['likes'], 'dislikes': stats['dislikes'],
+                            'user_rating': rating_value}), 201
+
+        if old_rating_value:
+            update_rating(session, media_id, user_id, rating_type_id)
+            message = 'Rating updated'
+        else:
+            add_rating(session, media_id, user_id, rating_type_id)
+            message = 'Rating added'
+        code = 201
 
-            existing_rating.IdRatingType = rating_type.IdRatingType
-            existing_rating.RatingTime = datetime.datetime.now()
-            session.commit()
-            likes, dislikes, user_rating_value = get_rating_counts(session, id, current_user.IdUser)
-            return jsonify({
-                'message': 'Rating updated',
-                'likes': likes,
-                'dislikes': dislikes,
-                'user_rating': user_rating_value
-            }), 201
-
-        new_rating = Ratings(
-            IdUser=current_user.IdUser,
-            IdMedia=id,
-            IdRatingType=rating_type.IdRatingType,
-            RatingTime=datetime.datetime.now()
-        )
-        session.add(new_rating)
+    begin_media_stats_update(redis_client, [media_id])
+    try:
         session.commit()
-        likes, dislikes, user_rating_value = get_rating_counts(session, id, current_user.IdUser)
-        return jsonify({
-            'message': 'Rating added',
-            'likes': likes,
-            'dislikes': dislikes,
-            'user_rating': user_rating_value
-        }), 201
-
-    except exc.IntegrityError as e:
-        session.rollback()
-        app.logger.exception(f"Database integrity error during rating: {e}")
-        return jsonify({'message': 'Database integrity error'}), 500
-    except Exception as e:
-        session.rollback()
-        app.logger.exception(f"Error adding/updating rating: {e}")
-        return jsonify({'message': 'Error adding/updating rating'}), 500
+    except Exception:
+        cancel_media_stats_update(redis_client, [media_id])
+        raise
+    increment_media_stats(redis_client, media_id, **rating_deltas(old_rating_value or None, rating_value or None))
+    stats = get_media_stats(redis_client, session, media_id)
+    return jsonify({
+        'message': message,
+        'likes': stats['likes'],
+        'dislikes': stats['dislikes'],
+        'user_rating': rating_value
+    }), code
 
 
 @app.route('/stream/<link_id>/<filename>') # Added filename parameter
@@ -802,8 +828,6 @@ responses:
     except Exception as e:
         app.logger.exception(f"Error streaming video: {e}")
         return jsonify({'message': 'Error streaming video'}), 500
-    finally:
-        session.close()
 
 
 @app.get("/video/")
@@ -812,18 +836,41 @@ def redirect_video():
 
 @app.get('/video')
 @token_required(app, redis_client, Session)
-@after_token_required
+@read_only
 def get_all_videos(current_user, session):
     """
 Retrieves a list of all videos.
+
+Returns at most `limit` items (50 by default), where it used to return the whole list:
+follow the X-Next-Cursor header until a response comes without it, or stream the whole listing.
 ---
 security:
   - bearerAuth: []
 tags:
   - Video
+parameters:
+  - in: query
+    name: limit
+    type: integer
+    description: Maximum number of items to return (default 50, at most 200).
+  - in: query
+    name: cursor
+    type: string
+    description: Value of the X-Next-Cursor header from the previous page.
+  - in: query
+    name: stream
+    type: string
+    enum: ["ndjson", "json"]
+    description: >-
+      Stream the whole listing instead of one page, as NDJSON or as a JSON array.
+      An NDJSON stream that fails midway ends with an {"error": ...} line, a JSON array stream is cut off.
 responses:
   200:
     description: List of videos retrieved successfully.
+    headers:
+      X-Next-Cursor:
+        type: string
+        description: Cursor of the next page. Missing on the last page.
     content:
       application/json:
         schema:
@@ -858,23 +905,26 @@ responses:
               company_id:
                 type: integer
                 description: The ID of the company that owns the video.
+              company_name:
+                type: string
+                description: The name of the company that owns the video.
+  400:
+    description: Invalid limit, cursor or stream format.
   500:
     description: Error retrieving videos.
 """
     try:
-        videos = session.query(Media).all()
-        video_list = []
-        for video in videos:
-            tags = [{"id": tag.IdTag, "name": tag.TagName} for tag in video.tags]
-            video_list.append({
-                "id": video.IdMedia,
-                "name": video.NameV,
-                "description": video.DescriptionV,
-                "upload_time": video.UploadTime.isoformat() if video.UploadTime else None,
-                "tags": tags,
-                "company_id": video.IdCompany
-            })
-        return jsonify(video_list), 200
+        videos_query = media_card_query(session)
+        serialize = partial(serialize_media_cards, session)
+        stream_format = get_stream_format(request)
+        if stream_format:
+            return stream_query(app, videos_query, (Media.UploadTime, Media.IdMedia), serialize, stream_format)
+
+        videos, next_cursor = paginate_request(videos_query, (Media.UploadTime, Media.IdMedia), request)
+        video_list = serialize(videos)
+        return jsonify(video_list), 200, next_cursor_headers(next_cursor)
+    except (PaginationError, StreamFormatError) as e:
+        return jsonify({'message': str(e)}), 400
     except Exception as e:
         app.logger.exception(f"Error retrieving videos: {e}")
         return jsonify({'message': 'Error retrieving videos'}), 500
@@ -882,7 +932,7 @@ responses:
 
 @app.get('/video/recommendations')
 @token_required(app, redis_client, Session)
-@after_token_required
+@read_only
 def get_video_recommendations(user, session):
     """
     Retrieves personalized video recommendations for the current user.
@@ -1033,24 +1083,8 @@ def get_video_recommendations(user, session):
 
         recommended_audios = recommendation_generator(user, session, num_recent_audios, recent_audios, is_audio=True)
 
-        video_list = [{
-            "id": video.IdMedia,
-            "name": video.NameV,
-            "description": video.DescriptionV,
-            "company_id": video.companies.IdCompany,
-            "company_name": video.companies.Name,
-            "upload_time": video.UploadTime.isoformat(),
-            "tags": [{"id": tag.IdTag, "name": tag.TagName} for tag in video.tags]
-        } for video in recommended_videos]
-        audio_list = [{
-            "id": audio.IdMedia,
-            "name": audio.NameV,
-            "description": audio.DescriptionV,
-            "company_id": audio.companies.IdCompany,
-            "company_name": audio.companies.Name,
-            "upload_time": audio.UploadTime.isoformat(),
-            "tags": [{"id": tag.IdTag, "name": tag.TagName} for tag in audio.tags]
-        } for audio in recommended_audios]
+        video_list = serialize_media_cards(session, recommended_videos)
+        audio_list = serialize_media_cards(session, recommended_audios)
         return jsonify({
             "video": video_list,
             "audio": audio_list
@@ -0,0 +1,74 @@
+"""
+Background worker of the video gateway.
+
+Flushes queued view events to the database, runs queued company deletions and
+removes the files of deleted media every VIEW_FLUSH_INTERVAL seconds.
+Run it next to the gateway (see the video-worker service in docker-compose.yaml):
+
+    python -m video_gateway.video.worker
+
+Its consumer name is the host name and VIEW_WORKER_INDEX, so a restarted worker
+picks up its own pending views. Give every worker on one host its own index.
+"""
+import logging
+import socket
+import time
+from .. import app, Session, redis_client
+from ..helpers.views import (ensure_views_group, flush_views, remove_consumer, remove_idle_consumers,
+                             VIEWS_STREAM, VIEWS_GROUP)
+from ..helpers.deletion import remove_queued_files, delete_queued_companies
+
+logger = logging.getLogger(__name__)
+
+
+def run():
+    consumer = f"{socket.gethostname()}-{app.config['VIEW_WORKER_INDEX']}"
+    interval = app.config['VIEW_FLUSH_INTERVAL']
+    batch_size = app.config['VIEW_FLUSH_BATCH_SIZE']
+    logger.info(f"Video worker {consumer} started, flushing views every {interval} s")
+
+    try:
+        work(consumer, interval, batch_size)
+    finally:
+        try:
+            if remove_consumer(redis_client, VIEWS_STREAM, VIEWS_GROUP, consumer):
+                logger.info(f"Video worker {consumer} stopped")
+        except Exception as e:
+            logger.warning(f"Could not remove consumer {consumer}: {e}")
+
+
+def work(consumer, interval, batch_size):
+    group_ready = False
+    while True:
+        processed = removed = purged = 0
+        with app.app_context():  # Sessions are scoped to the application context
+            try:
+                if not group_ready:
+                    ensure_views_group(redis_client)
+                    for stale in remove_idle_consumers(redis_client, VIEWS_STREAM, VIEWS_GROUP):
+                        logger.info(f"Removed consumer {stale.decode('utf-8')} of a stopped worker")
+                    group_ready = True
+                processed = flush_views(redis_client, Session(), consumer, batch_size)
+            except Exception as e:
+                # Unacknowledged views stay pending and are retried on the next flush
+                logger.exception(f"Error flushing views: {e}")
+
+        with app.app_context():
+            try:
+                purged = delete_queued_companies(Session(), redis_client)
+            except Exception as e:
+                logger.exception(f"Error deleting companies: {e}")
+
+        try:
+            removed = remove_queued_files(redis_client, batch_size)
+        except Exception as e:
+            logger.exception(f"Error removing files: {e}")
+
+        # Keep going without waiting while there is a backlog
+        if processed < batch_size and removed < batch_size and not purged:
+            time.sleep(interval)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+    run()